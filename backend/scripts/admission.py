@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""Admission control for server.py: priority lanes, per-client rate limits and load shedding.
+
+Every request is admitted into one lane before it runs:
+
+    control   GET routes (/skills, /status, /metrics, static assets, ...)
+    text      /chat without an image
+    image     /chat with an image, /analyze-image
+
+Each lane has its own concurrency limit and bounded FIFO queue, so a burst of
+photo uploads can only fill the image lane while text turns and control
+requests keep their own slots. A request is rejected instead of queued when
+
+  * its client has exhausted the lane's token bucket (429), or
+  * the lane queue is full, or its deadline cannot be met given the lane's
+    recent service time, or the deadline passes while it waits (503).
+
+A lane is under pressure for a request that had to queue, or while others
+queue behind it; the image lane then grades a preview instead of the
+full-resolution photo.
+
+    ADMISSION=0                   disable (every admit is a no-op)
+    ADMIT_<LANE>_CONCURRENCY      requests running at once
+    ADMIT_<LANE>_QUEUE            requests allowed to wait
+    ADMIT_<LANE>_WAIT             default deadline in seconds (queue wait + expected service)
+    ADMIT_<LANE>_RATE / _BURST    per-client token bucket (requests/s, bucket size; rate 0 = unlimited)
+"""
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import metrics
+
+
+# Idle per-client buckets are dropped after this many seconds.
+BUCKET_IDLE_SEC = 600
+SERVICE_EWMA_ALPHA = 0.2
+
+LANE_DEFAULTS = {
+    #          concurrency, queue, wait (s), rate (/s), burst
+    "control": (32, 128, 5.0, 0.0, 0),
+    "text": (8, 32, 120.0, 2.0, 10),
+    "image": (2, 8, 120.0, 0.5, 6),
+}
+
+
+def _env(lane, name, default, cast):
+    return cast(os.getenv(f"ADMIT_{lane.upper()}_{name}", str(default)))
+
+
+class Rejected(Exception):
+    """Request not admitted; `status` is 429 or 503 and `retry_after` a hint in seconds."""
+
+    def __init__(self, lane, reason, status, retry_after):
+        super().__init__(f"{lane} lane: {reason}")
+        self.lane = lane
+        self.reason = reason
+        self.status = status
+        self.retry_after = max(1, int(round(retry_after)))
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def take(self, now):
+        """Seconds until a token is available (0 means one was taken)."""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class Ticket:
+    def __init__(self, lane, waited, queued):
+        self.lane = lane
+        self.waited = waited
+        self.queued = queued
+
+
+class Lane:
+    def __init__(self, name, concurrency, queue, wait, rate, burst):
+        self.name = name
+        self.concurrency = max(1, concurrency)
+        self.queue_limit = max(0, queue)
+        self.default_wait = wait
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.service_ewma = None
+        self._cond = threading.Condition()
+        self._running = 0
+        self._waiting = deque()
+        self._buckets = {}
+        self._last_prune = time.monotonic()
+
+    def _check_rate(self, client, now):
+        if self.rate <= 0 or client is None:
+            return
+        bucket = self._buckets.get(client)
+        if bucket is None:
+            bucket = self._buckets[client] = TokenBucket(self.rate, self.burst)
+        retry = bucket.take(now)
+        if now - self._last_prune > BUCKET_IDLE_SEC:
+            self._last_prune = now
+            for key in [k for k, b in self._buckets.items() if now - b.updated > BUCKET_IDLE_SEC]:
+                del self._buckets[key]
+        if retry:
+            raise Rejected(self.name, "rate_limited", 429, retry)
+
+    def expected_wait(self, position):
+        """Rough seconds until a request at `position` in the queue starts running."""
+        if self.service_ewma is None:
+            return 0.0
+        return (position // self.concurrency + 1) * self.service_ewma if position >= 0 else 0.0
+
+    def acquire(self, client=None, budget=None):
+        budget = self.default_wait if budget is None else budget
+        now = time.monotonic()
+        deadline = now + budget
+        with self._cond:
+            self._check_rate(client, now)
+            if self._running < self.concurrency and not self._waiting:
+                self._running += 1
+                return Ticket(self.name, 0.0, False)
+            if len(self._waiting) >= self.queue_limit:
+                raise Rejected(self.name, "queue_full", 503, self.expected_wait(len(self._waiting)))
+            position = len(self._waiting)
+            if self.service_ewma is not None and self.expected_wait(position) + self.service_ewma > budget:
+                raise Rejected(self.name, "deadline", 503, self.expected_wait(position))
+            me = object()
+            self._waiting.append(me)
+            try:
+                while self._waiting[0] is not me or self._running >= self.concurrency:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise Rejected(self.name, "deadline", 503, self.expected_wait(position))
+                    self._cond.wait(remaining)
+            finally:
+                self._waiting.remove(me)
+                self._cond.notify_all()
+            self._running += 1
+            return Ticket(self.name, time.monotonic() - now, True)
+
+    def release(self, service_seconds):
+        with self._cond:
+            self._running -= 1
+            if self.service_ewma is None:
+                self.service_ewma = service_seconds
+            else:
+                self.service_ewma += SERVICE_EWMA_ALPHA * (service_seconds - self.service_ewma)
+            self._cond.notify_all()
+
+    def under_pressure(self):
+        with self._cond:
+            return bool(self._waiting)
+
+    def snapshot(self):
+        with self._cond:
+            return {
+                "running": self._running,
+                "queued": len(self._waiting),
+                "concurrency": self.concurrency,
+                "queue_limit": self.queue_limit,
+                "service_ewma": round(self.service_ewma, 3) if self.service_ewma is not None else None,
+            }
+
+
+class Admission:
+    def __init__(self, enabled=None, lanes=None):
+        """Settings default to the ADMISSION / ADMIT_* environment, read here rather than at import."""
+        if enabled is None:
+            enabled = os.getenv("ADMISSION", "1").strip().lower() not in ("0", "false", "no", "off")
+        self.enabled = enabled
+        lanes = lanes or {
+            name: (
+                _env(name, "CONCURRENCY", c, int),
+                _env(name, "QUEUE", q, int),
+                _env(name, "WAIT", w, float),
+                _env(name, "RATE", r, float),
+                _env(name, "BURST", b, int),
+            )
+            for name, (c, q, w, r, b) in LANE_DEFAULTS.items()
+        }
+        self.lanes = {name: Lane(name, *spec) for name, spec in lanes.items()}
+
+    @contextmanager
+    def admit(self, lane_name, client=None, budget=None):
+        """Hold a slot in the lane for the block; yields a Ticket (None when disabled). Raises Rejected."""
+        if not self.enabled:
+            yield None
+            return
+        lane = self.lanes[lane_name]
+        try:
+            ticket = lane.acquire(client, budget)
+        except Rejected as e:
+            metrics.inc("admission_rejected", lane=lane_name, reason=e.reason)
+            raise
+        metrics.observe("admission_queue_seconds", ticket.waited, lane=lane_name)
+        self._publish(lane)
+        started = time.perf_counter()
+        try:
+            yield ticket
+        finally:
+            lane.release(time.perf_counter() - started)
+            self._publish(lane)
+
+    def under_pressure(self, ticket):
+        """True if the ticket's request had to queue or others are queued in its lane now."""
+        return bool(ticket) and (ticket.queued or self.lanes[ticket.lane].under_pressure())
+
+    def _publish(self, lane):
+        snap = lane.snapshot()
+        metrics.set_gauge("admission_running", snap["running"], lane=lane.name)
+        metrics.set_gauge("admission_queued", snap["queued"], lane=lane.name)
+
+    def snapshot(self):
+        return {name: lane.snapshot() for name, lane in self.lanes.items()} if self.enabled else {}
+
+
+def parse_deadline(value):
+    """Budget in seconds from an X-Request-Deadline header value (milliseconds); None if absent or invalid."""
+    try:
+        ms = float(value)
+    except (TypeError, ValueError):
+        return None
+    return ms / 1000 if ms > 0 else None
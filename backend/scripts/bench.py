@@ -0,0 +1,683 @@
+#!/usr/bin/env python3
+"""Offline benchmarks: end-to-end load against server.py and micro-benchmarks.
+
+    # spawn a stub provider + server on free ports and load every endpoint
+    python3 backend/scripts/bench.py e2e --concurrency 8 --requests 200
+
+    # same, but the server replays recorded provider calls (cassette.py) with no network
+    python3 backend/scripts/bench.py e2e --cassette backend/eval/cassettes/stub.jsonl --replay-speed 1
+
+    # load an already running server
+    python3 backend/scripts/bench.py load --url http://127.0.0.1:8000 --endpoint chat
+
+    # in-process micro-benchmarks
+    python3 backend/scripts/bench.py micro --sizes 256,1024,2048
+
+    # cold start: time until the port accepts, the ready signal and the first /chat
+    python3 backend/scripts/bench.py startup --runs 5
+
+    # compiled skill catalog vs scanning SKILL.md files, on synthetic libraries
+    python3 backend/scripts/bench.py catalog --counts 10,1000,10000
+
+    # session stores: per-turn save latency, reopen (index rebuild) time and disk use
+    python3 backend/scripts/bench.py sessions --turns 5000
+"""
+import argparse
+import base64
+import io
+import json
+import math
+import os
+import select
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.abspath(os.path.join(SCRIPT_DIR, "..", ".."))
+
+
+# --- Helpers ---
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[idx]
+
+
+def summarize(latencies):
+    return {
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 2) if latencies else 0.0,
+    }
+
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_port(port, timeout=15.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            sock.settimeout(0.2)
+            if sock.connect_ex(("127.0.0.1", port)) == 0:
+                return True
+        time.sleep(0.05)
+    return False
+
+
+def local_rss_bytes():
+    try:
+        with open("/proc/self/statm", "r", encoding="utf-8") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except Exception:
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss if rss > 1 << 32 else rss * 1024
+
+
+def scrape_server_rss(base_url):
+    try:
+        with urllib.request.urlopen(f"{base_url}/metrics", timeout=5) as resp:
+            text = resp.read().decode("utf-8")
+    except Exception:
+        return None
+    for line in text.splitlines():
+        if line.startswith("skills_process_resident_memory_bytes "):
+            return int(float(line.split()[1]))
+    return None
+
+
+def make_test_image(size, fmt="PNG"):
+    from PIL import Image
+    import numpy as np
+
+    h = size
+    w = int(size * 1.5)
+    y = np.linspace(0, 255, h, dtype=np.float32)[:, None]
+    x = np.linspace(0, 255, w, dtype=np.float32)[None, :]
+    arr = np.stack([
+        np.broadcast_to(x, (h, w)),
+        np.broadcast_to(y, (h, w)),
+        np.broadcast_to((x + y) / 2, (h, w)),
+    ], axis=-1).astype(np.uint8)
+    output = io.BytesIO()
+    Image.fromarray(arr, mode="RGB").save(output, format=fmt)
+    return output.getvalue()
+
+
+# --- Load generator ---
+
+def build_request(base_url, endpoint, args, image_bytes):
+    if endpoint == "skills":
+        return urllib.request.Request(f"{base_url}/skills", method="GET")
+    if endpoint == "chat":
+        body = {"message": args.message, "skill": args.skill}
+        if image_bytes:
+            body["image_data"] = "data:image/png;base64," + base64.b64encode(image_bytes).decode("ascii")
+        return urllib.request.Request(
+            f"{base_url}/chat",
+            data=json.dumps(body).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+    if endpoint == "analyze-image":
+        boundary = "----skillsbench"
+        parts = [
+            f"--{boundary}\r\n".encode("ascii"),
+            b'Content-Disposition: form-data; name="image"; filename="landscape.png"\r\n',
+            b"Content-Type: image/png\r\n\r\n",
+            image_bytes or b"",
+            f"\r\n--{boundary}--\r\n".encode("ascii"),
+        ]
+        return urllib.request.Request(
+            f"{base_url}/analyze-image",
+            data=b"".join(parts),
+            headers={"Content-Type": f"multipart/form-data; boundary={boundary}"},
+            method="POST",
+        )
+    raise ValueError(f"unknown endpoint: {endpoint}")
+
+
+def run_load(base_url, endpoint, args):
+    image_bytes = None
+    if endpoint == "analyze-image" or (endpoint == "chat" and args.image_size):
+        image_bytes = make_test_image(args.image_size or 512)
+
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+    deadline = time.time() + args.duration if args.duration else None
+    issued = [0]
+
+    def next_slot():
+        with lock:
+            if deadline is None and issued[0] >= args.requests:
+                return False
+            if deadline is not None and time.time() >= deadline:
+                return False
+            issued[0] += 1
+            return True
+
+    def worker():
+        nonlocal errors
+        while next_slot():
+            req = build_request(base_url, endpoint, args, image_bytes)
+            start = time.perf_counter()
+            try:
+                with urllib.request.urlopen(req, timeout=args.timeout) as resp:
+                    resp.read()
+                    ok = 200 <= resp.status < 300
+            except Exception:
+                ok = False
+            elapsed = time.perf_counter() - start
+            with lock:
+                if ok:
+                    latencies.append(elapsed)
+                else:
+                    errors += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        for _ in range(args.concurrency):
+            pool.submit(worker)
+    wall = time.perf_counter() - started
+
+    result = {
+        "endpoint": endpoint,
+        "concurrency": args.concurrency,
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "wall_s": round(wall, 3),
+        "rps": round(len(latencies) / wall, 2) if wall > 0 else 0.0,
+        **summarize(latencies),
+        "server_rss_mb": None,
+        "client_rss_mb": round(local_rss_bytes() / 1e6, 1),
+    }
+    rss = scrape_server_rss(base_url)
+    if rss is not None:
+        result["server_rss_mb"] = round(rss / 1e6, 1)
+    return result
+
+
+def print_rows(rows, columns):
+    widths = {c: max(len(c), *(len(str(r.get(c))) for r in rows)) for c in columns}
+    print("  ".join(c.ljust(widths[c]) for c in columns))
+    for row in rows:
+        print("  ".join(str(row.get(c)).ljust(widths[c]) for c in columns))
+
+
+LOAD_COLUMNS = ["endpoint", "concurrency", "requests", "errors", "rps",
+                "p50_ms", "p95_ms", "p99_ms", "server_rss_mb", "client_rss_mb"]
+
+
+def cmd_load(args):
+    rows = [run_load(args.url.rstrip("/"), ep, args) for ep in args.endpoint]
+    emit(rows, LOAD_COLUMNS, args)
+
+
+def spawn_stack(args):
+    """Start stub_llm.py and server.py on free ports; returns (base_url, processes).
+
+    With --cassette the server replays recorded provider calls and no stub is started.
+    """
+    stub_port = free_port()
+    server_port = free_port()
+    if getattr(args, "cassette", None):
+        sys.path.insert(0, SCRIPT_DIR)
+        import cassette
+        return spawn_server(server_port, [], {
+            "LLM_PROVIDER": args.provider,
+            "LLM_CASSETTE_MODE": "replay",
+            **cassette.path_env(args.cassette),
+            "LLM_REPLAY_SPEED": str(args.replay_speed),
+            # Never contacted in replay; only needs to be well formed.
+            "DEEPSEEK_API_KEY": "replay",
+            "DEEPSEEK_BASE_URL": f"http://127.0.0.1:{stub_port}",
+            "OLLAMA_HOST": f"http://127.0.0.1:{stub_port}",
+        })
+    stub_cmd = [
+        sys.executable, os.path.join(SCRIPT_DIR, "stub_llm.py"),
+        "--port", str(stub_port),
+        "--latency", str(args.stub_latency),
+        "--token-rate", str(args.stub_token_rate),
+        "--fail-rate", str(args.stub_fail_rate),
+        "--hang-rate", str(args.stub_hang_rate),
+        "--hang-seconds", str(args.stub_hang_seconds),
+    ]
+    stub = subprocess.Popen(stub_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    procs = [stub]
+    env = {}
+    if args.provider == "ollama":
+        env.update({"LLM_PROVIDER": "ollama", "OLLAMA_HOST": f"http://127.0.0.1:{stub_port}"})
+    else:
+        env.update({
+            "LLM_PROVIDER": "deepseek",
+            "DEEPSEEK_API_KEY": "stub",
+            "DEEPSEEK_BASE_URL": f"http://127.0.0.1:{stub_port}",
+        })
+    if args.failover:
+        # A second, healthy stub stands in for local Ollama behind the faulty primary.
+        backup_port = free_port()
+        procs.append(subprocess.Popen(
+            [sys.executable, os.path.join(SCRIPT_DIR, "stub_llm.py"), "--port", str(backup_port),
+             "--latency", str(args.stub_latency), "--token-rate", str(args.stub_token_rate)],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        ))
+        env.update({"LLM_FAILOVER": "ollama", "OLLAMA_HOST": f"http://127.0.0.1:{backup_port}"})
+        if args.provider == "ollama":
+            env.update({"LLM_FAILOVER": "deepseek", "DEEPSEEK_API_KEY": "stub",
+                        "DEEPSEEK_BASE_URL": f"http://127.0.0.1:{backup_port}",
+                        "OLLAMA_HOST": f"http://127.0.0.1:{stub_port}"})
+        if not wait_port(backup_port):
+            stop_stack(procs)
+            raise RuntimeError("backup stub failed to start")
+    if not wait_port(stub_port):
+        stop_stack(procs)
+        raise RuntimeError("stub failed to start")
+    return spawn_server(server_port, procs, env)
+
+
+def spawn_server(server_port, procs, overrides):
+    env = dict(os.environ)
+    env.update({
+        "SERVER_PORT": str(server_port),
+        "SERVER_HOST": "127.0.0.1",
+        "METRICS_ENABLED": env.get("METRICS_ENABLED", "1"),
+        # The load generator is a single client; lane concurrency limits still apply.
+        "ADMIT_TEXT_RATE": env.get("ADMIT_TEXT_RATE", "0"),
+        "ADMIT_IMAGE_RATE": env.get("ADMIT_IMAGE_RATE", "0"),
+    })
+    env.update(overrides)
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(SCRIPT_DIR, "server.py"), "--no-browser"],
+        cwd=PROJECT_ROOT,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    procs.insert(0, server)
+    if not wait_port(server_port):
+        stop_stack(procs)
+        raise RuntimeError("server failed to start")
+    return f"http://127.0.0.1:{server_port}", procs
+
+
+def stop_stack(procs):
+    for proc in procs:
+        proc.terminate()
+    for proc in procs:
+        try:
+            proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def cmd_e2e(args):
+    base_url, procs = spawn_stack(args)
+    try:
+        rows = [run_load(base_url, ep, args) for ep in args.endpoint]
+    finally:
+        stop_stack(procs)
+    emit(rows, LOAD_COLUMNS, args)
+
+
+# --- Startup ---
+
+def post_chat(base_url, message, skill, timeout=60.0):
+    req = urllib.request.Request(
+        f"{base_url}/chat",
+        data=json.dumps({"message": message, "skill": skill}).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+        method="POST",
+    )
+    with urllib.request.urlopen(req, timeout=timeout) as resp:
+        resp.read()
+        return resp.status
+
+
+def measure_startup(stub_port, preload, args):
+    """One cold start of server.py; returns seconds to listen, to the ready signal and to the first reply."""
+    port = free_port()
+    ready_read, ready_write = os.pipe()
+    env = dict(os.environ)
+    env.update({
+        "SERVER_PORT": str(port),
+        "SERVER_HOST": "127.0.0.1",
+        "SERVER_READY_FD": str(ready_write),
+        "SERVER_IMAGE_PRELOAD": preload,
+        "LLM_PROVIDER": "deepseek",
+        "DEEPSEEK_API_KEY": "stub",
+        "DEEPSEEK_BASE_URL": f"http://127.0.0.1:{stub_port}",
+        "OLLAMA_WARMUP": "0",
+        "SINGLE_FLIGHT": "0",
+    })
+    started = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(SCRIPT_DIR, "server.py"), "--no-browser"],
+        cwd=PROJECT_ROOT,
+        env=env,
+        pass_fds=(ready_write,),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    os.close(ready_write)
+    try:
+        listen = ready = None
+        deadline = time.time() + args.timeout
+        while listen is None and time.time() < deadline and proc.poll() is None:
+            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+                if sock.connect_ex(("127.0.0.1", port)) == 0:
+                    listen = time.perf_counter() - started
+                    break
+            time.sleep(0.002)
+        if listen is None:
+            raise RuntimeError("server did not start listening")
+        if select.select([ready_read], [], [], max(0.0, deadline - time.time()))[0]:
+            if os.read(ready_read, 64).startswith(b"ready"):
+                ready = time.perf_counter() - started
+        post_chat(f"http://127.0.0.1:{port}", args.message, args.skill, args.timeout)
+        first_chat = time.perf_counter() - started
+        return listen, ready, first_chat
+    finally:
+        os.close(ready_read)
+        proc.terminate()
+        try:
+            proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def cmd_startup(args):
+    stub_port = free_port()
+    stub = subprocess.Popen(
+        [sys.executable, os.path.join(SCRIPT_DIR, "stub_llm.py"), "--port", str(stub_port),
+         "--latency", str(args.stub_latency)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    rows = []
+    try:
+        if not wait_port(stub_port):
+            raise RuntimeError("stub failed to start")
+        for preload in args.preload:
+            samples = [measure_startup(stub_port, preload, args) for _ in range(args.runs)]
+            for name, idx in (("time_to_listen", 0), ("time_to_ready", 1), ("time_to_first_chat", 2)):
+                values = [sample[idx] for sample in samples if sample[idx] is not None]
+                rows.append({"bench": name, "note": f"preload={preload}", "runs": len(values),
+                             **summarize(values)})
+    finally:
+        stop_stack([stub])
+    emit(rows, ["bench", "note", "runs", "p50_ms", "p95_ms", "p99_ms", "mean_ms"], args)
+
+
+# --- Skill catalog ---
+
+SYNTHETIC_BODY = "\n".join(
+    ["# 技能说明", "根据用户输入完成任务，回答分步骤。"] + [f"- 规则 {i}：保持输出简洁，引用参考资料。" for i in range(20)]
+)
+SYNTHETIC_REFERENCE = "\n\n".join(
+    f"## 第 {i} 节\n" + "参考内容，包含示例与注意事项。" * 10 for i in range(4)
+)
+
+
+def make_skill_library(root, count):
+    for i in range(count):
+        skill_dir = os.path.join(root, f"skill-{i:05d}")
+        os.makedirs(os.path.join(skill_dir, "reference"))
+        with open(os.path.join(skill_dir, "SKILL.md"), "w", encoding="utf-8") as f:
+            f.write(f"---\nname: skill-{i:05d}\ndescription: 合成技能 {i}，用于基准测试。\n---\n\n{SYNTHETIC_BODY}\n")
+        with open(os.path.join(skill_dir, "reference", "notes.md"), "w", encoding="utf-8") as f:
+            f.write(SYNTHETIC_REFERENCE)
+
+
+def cmd_catalog(args):
+    os.environ.setdefault("METRICS_ENABLED", "0")
+    os.environ["SKILL_CATALOG"] = "0"
+    sys.path.insert(0, SCRIPT_DIR)
+    import server
+    from skill_catalog import SkillCatalog
+
+    rows = []
+
+    def add(name, count, samples):
+        rows.append({"bench": name, "skills": count, "runs": len(samples), **summarize(samples)})
+
+    for count in args.counts:
+        root = tempfile.mkdtemp(prefix="skills-bench-")
+        try:
+            make_skill_library(root, count)
+            repeat = max(3, args.repeat // max(1, count // 100))
+            add("scan_skill_files", count, time_call(lambda: server.list_skills(root), repeat))
+
+            path = os.path.join(root, ".skill_catalog.sqlite3")
+            add("catalog_full_build", count, time_call(lambda: SkillCatalog(root, path).refresh(force=True), 1))
+
+            def open_list():
+                catalog = SkillCatalog(root, path)
+                catalog.skills()
+                catalog.close()
+            add("catalog_open_list", count, time_call(open_list, repeat))
+
+            def boot():
+                # What server.py does at boot: check against the disk, then list.
+                catalog = SkillCatalog(root, path)
+                catalog.refresh()
+                catalog.skills()
+                catalog.close()
+            add("catalog_boot", count, time_call(boot, repeat))
+
+            catalog = SkillCatalog(root, path)
+            add("catalog_refresh_no_change", count, time_call(catalog.refresh, repeat))
+            touched = os.path.join(root, "skill-00000", "SKILL.md")
+
+            def refresh_one():
+                os.utime(touched, ns=(time.time_ns(), time.time_ns()))
+                catalog.refresh()
+            add("catalog_refresh_1_changed", count, time_call(refresh_one, repeat))
+            catalog.close()
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+    emit(rows, ["bench", "skills", "runs", "p50_ms", "p95_ms", "p99_ms", "mean_ms"], args)
+
+
+# --- Session stores ---
+
+def cmd_sessions(args):
+    sys.path.insert(0, SCRIPT_DIR)
+    import session_store
+    from context_packer import trim_history
+
+    rows = []
+    for kind in args.store:
+        root = tempfile.mkdtemp(prefix="sessions-bench-")
+        path = os.path.join(root, "sessions.sqlite3" if kind == "sqlite" else "log")
+        try:
+            store = session_store.open_store(kind, path)
+            samples = []
+            started = time.perf_counter()
+            for turn in range(args.turns):
+                sid = f"s{turn % args.sessions}"
+                t0 = time.perf_counter()
+                state = store.load(sid)
+                history = state["history"] + [
+                    {"role": "user", "content": f"第 {turn} 轮：" + "帮我总结一下今天的会议内容。" * 4},
+                    {"role": "assistant", "content": "摘要：发布计划已确认；TODO：补充测试用例。" * 6},
+                ]
+                state["history"] = trim_history(history, args.history)
+                store.save(sid, state)
+                samples.append(time.perf_counter() - t0)
+            elapsed = time.perf_counter() - started
+            row = {"store": kind, "turns": args.turns, "sessions": args.sessions,
+                   **summarize(samples), "turns_per_s": round(args.turns / elapsed)}
+            if kind != "memory":
+                t0 = time.perf_counter()
+                reopened = session_store.open_store(kind, path)
+                reopened.count()
+                row["reopen_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+                row["disk_kb"] = round(sum(
+                    os.path.getsize(os.path.join(dirpath, name))
+                    for dirpath, _, names in os.walk(root) for name in names) / 1024)
+            rows.append(row)
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+    emit(rows, ["store", "turns", "sessions", "p50_ms", "p95_ms", "p99_ms", "turns_per_s",
+                "reopen_ms", "disk_kb"], args)
+
+
+# --- Micro-benchmarks ---
+
+def time_call(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def cmd_micro(args):
+    # Keep stage hooks out of the measurements.
+    os.environ.setdefault("METRICS_ENABLED", "0")
+    sys.path.insert(0, SCRIPT_DIR)
+    import server
+
+    rows = []
+
+    def add(name, samples, note=""):
+        rows.append({"bench": name, "note": note, "runs": len(samples), **summarize(samples)})
+
+    skills_root = server.SKILLS_DIR
+    add("list_skills", time_call(lambda: server.list_skills(skills_root), args.repeat))
+
+    skills = server.list_skills(skills_root)
+    grading = next((s for s in skills if s["name"] == "color-grading"), skills[0] if skills else None)
+    if grading:
+        import reference_index
+        from context_packer import pack_context
+        skill_text = server.read_text(grading["file"])
+        query = "帮我把这张风景照调成电影感，压一下高光"
+
+        def build_prompt():
+            # What generate_reply does for a chosen skill: stable prompt, retrieval, packing.
+            system_prompt = server.build_system_prompt(skill_text, [])
+            sections = reference_index.search(grading["dir"], query)
+            return pack_context(system_prompt, [], query, sections=sections)
+        add("build_prompt", time_call(build_prompt, args.repeat), grading["name"])
+
+    from stub_llm import DEFAULT_REPLY
+    add("parse_adjustments", time_call(lambda: server.parse_adjustments(DEFAULT_REPLY), args.repeat))
+
+    adjustments = server.parse_adjustments(DEFAULT_REPLY)
+    for size in args.sizes:
+        image_bytes = make_test_image(size)
+        repeat = max(3, args.repeat // max(1, size // 256))
+        add("apply_adjustments",
+            time_call(lambda: server.apply_adjustments(image_bytes, adjustments), repeat),
+            f"{int(size * 1.5)}x{size}")
+        for fmt in ("PNG", "JPEG"):
+            encoded = make_test_image(size, fmt)
+            add("image_stats", time_call(lambda: server.analyze_image(encoded), repeat),
+                f"{int(size * 1.5)}x{size} {fmt}")
+
+    emit(rows, ["bench", "note", "runs", "p50_ms", "p95_ms", "p99_ms", "mean_ms"], args)
+
+
+def emit(rows, columns, args):
+    if args.json:
+        print(json.dumps(rows, ensure_ascii=False, indent=2))
+    else:
+        print_rows(rows, columns)
+
+
+def parse_sizes(text):
+    return [int(x) for x in text.split(",") if x.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load tests and micro-benchmarks")
+    parser.add_argument("--json", action="store_true", help="输出 JSON 而不是表格")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    def add_load_args(p):
+        p.add_argument("--endpoint", action="append", choices=["chat", "skills", "analyze-image"],
+                       help="可重复指定，默认全部")
+        p.add_argument("--concurrency", type=int, default=4)
+        p.add_argument("--requests", type=int, default=100, help="每个端点的请求数")
+        p.add_argument("--duration", type=float, default=0.0, help="按时长压测（秒），优先于 --requests")
+        p.add_argument("--timeout", type=float, default=60.0)
+        p.add_argument("--message", default="帮我总结：今天开会讨论了发布计划和测试分工。")
+        p.add_argument("--skill", default="summary-skill")
+        p.add_argument("--image-size", type=int, default=0, help="/chat 附带图片的高度（像素）")
+
+    p_load = sub.add_parser("load", help="压测已运行的服务")
+    p_load.add_argument("--url", default="http://127.0.0.1:8000")
+    add_load_args(p_load)
+    p_load.set_defaults(func=cmd_load)
+
+    p_e2e = sub.add_parser("e2e", help="启动 stub + server 后压测")
+    p_e2e.add_argument("--provider", choices=["deepseek", "ollama"], default="deepseek")
+    p_e2e.add_argument("--stub-latency", type=float, default=0.05)
+    p_e2e.add_argument("--stub-token-rate", type=float, default=0.0)
+    p_e2e.add_argument("--stub-fail-rate", type=float, default=0.0, help="主 stub 返回 503 的比例")
+    p_e2e.add_argument("--stub-hang-rate", type=float, default=0.0, help="主 stub 挂起不响应的比例")
+    p_e2e.add_argument("--stub-hang-seconds", type=float, default=60.0)
+    p_e2e.add_argument("--failover", action="store_true", help="再起一个健康 stub 作为备用提供方")
+    p_e2e.add_argument("--cassette", default=None, help="回放该 .jsonl 文件中录制的模型调用，不启动 stub")
+    p_e2e.add_argument("--replay-speed", type=float, default=1.0, help="回放延迟倍速，0 表示无延迟")
+    add_load_args(p_e2e)
+    p_e2e.set_defaults(func=cmd_e2e)
+
+    p_micro = sub.add_parser("micro", help="函数级微基准")
+    p_micro.add_argument("--repeat", type=int, default=50)
+    p_micro.add_argument("--sizes", type=parse_sizes, default=[256, 1024, 2048])
+    p_micro.set_defaults(func=cmd_micro)
+
+    p_startup = sub.add_parser("startup", help="冷启动耗时：监听、就绪信号、首个 /chat")
+    p_startup.add_argument("--runs", type=int, default=5)
+    p_startup.add_argument("--preload", action="append", choices=["lazy", "background", "eager"],
+                           help="SERVER_IMAGE_PRELOAD 取值，可重复指定，默认 background 与 eager 对比")
+    p_startup.add_argument("--stub-latency", type=float, default=0.05)
+    p_startup.add_argument("--timeout", type=float, default=60.0)
+    p_startup.add_argument("--message", default="帮我总结：今天开会讨论了发布计划和测试分工。")
+    p_startup.add_argument("--skill", default="summary-skill")
+    p_startup.set_defaults(func=cmd_startup)
+
+    p_sessions = sub.add_parser("sessions", help="会话存储：每轮保存耗时、重启重建耗时与磁盘占用")
+    p_sessions.add_argument("--store", action="append", choices=["memory", "sqlite", "log"],
+                            help="可重复指定，默认全部")
+    p_sessions.add_argument("--turns", type=int, default=5000)
+    p_sessions.add_argument("--sessions", type=int, default=50)
+    p_sessions.add_argument("--history", type=int, default=40, help="保留的历史消息数（HISTORY_MAX_MESSAGES）")
+    p_sessions.set_defaults(func=cmd_sessions)
+
+    p_catalog = sub.add_parser("catalog", help="技能目录编译与刷新耗时（合成技能库）")
+    p_catalog.add_argument("--counts", type=parse_sizes, default=[10, 1000, 10000], help="技能数量列表")
+    p_catalog.add_argument("--repeat", type=int, default=20)
+    p_catalog.set_defaults(func=cmd_catalog)
+
+    args = parser.parse_args()
+    if args.command == "startup" and not args.preload:
+        args.preload = ["background", "eager"]
+    if args.command == "sessions" and not args.store:
+        args.store = ["memory", "sqlite", "log"]
+    if getattr(args, "endpoint", None) is None and args.command in ("load", "e2e"):
+        args.endpoint = ["skills", "chat", "analyze-image"]
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""Record and replay provider calls, for deterministic offline runs of the whole /chat pipeline.
+
+    LLM_CASSETTE_MODE=record   call the real provider and append each exchange (reply + latency)
+                               to LLM_CASSETTE_DIR/<LLM_CASSETTE_NAME>.jsonl
+                               (default backend/data/cassettes/session.jsonl, which git ignores)
+    LLM_CASSETTE_MODE=replay   answer from that same file without any network
+    LLM_REPLAY_SPEED=1         replayed latency factor: 1 as recorded, 4 four times faster, 0 no delay
+
+A call is matched on its exact payload first, then on provider, model and
+last user message, so replays survive history that differs between runs.
+The nth call for a key gets the nth recording (cycling), which keeps
+replays of a fixed request sequence deterministic. Cassettes store hashes,
+the model, a short excerpt of the user message, the reply and the latency,
+never the prompts or images themselves. An unmatched call in replay
+mode fails with CassetteMiss rather than reaching the network.
+"""
+import json
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+
+from providers import ProviderError, RequestCancelled, payload_key
+
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.abspath(os.path.join(SCRIPT_DIR, "..", ".."))
+DEFAULT_DIR = os.path.join(PROJECT_ROOT, "backend", "data", "cassettes")
+MODES = ("off", "record", "replay")
+
+
+class CassetteMiss(ProviderError):
+    """No recording matches a call made in replay mode."""
+
+    def __init__(self, detail):
+        super().__init__(404, f"no cassette recording for {detail}")
+
+
+def last_user_message(payload):
+    for message in reversed(payload.get("messages") or []):
+        if message.get("role") == "user":
+            return message.get("content") or ""
+    return ""
+
+
+def call_keys(provider, payload):
+    """(exact, loose) match keys for one provider call."""
+    exact = payload_key({"provider": provider, **payload})
+    loose = payload_key({"provider": provider, "model": payload.get("model"),
+                         "user": last_user_message(payload)})
+    return exact, loose
+
+
+class Cassette:
+    def __init__(self, mode="off", directory=DEFAULT_DIR, name="session", speed=1.0):
+        if mode not in MODES:
+            raise ValueError(f"LLM_CASSETTE_MODE must be one of {', '.join(MODES)}, not {mode!r}")
+        self.mode = mode
+        self.directory = directory
+        self.path = os.path.join(directory, f"{name}.jsonl")
+        self.speed = speed
+        self._lock = threading.Lock()
+        self._exact = defaultdict(list)
+        self._loose = defaultdict(list)
+        self._cursor = Counter()
+        if mode == "replay":
+            self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            raise ValueError(f"cassette {self.path} does not exist")
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                record = json.loads(line)
+                self._exact[record["key"]].append(record)
+                self._loose[record["loose"]].append(record)
+        return sum(len(v) for v in self._exact.values())
+
+    def wrap(self, provider, fn):
+        """fn(payload, cancel=None) routed through the cassette; fn itself when off."""
+        if self.mode == "off":
+            return fn
+        return lambda payload, cancel=None: self.call(provider, fn, payload, cancel=cancel)
+
+    def call(self, provider, fn, payload, cancel=None):
+        if self.mode == "replay":
+            return self._replay(provider, payload, cancel)
+        if self.mode == "record":
+            return self._record(provider, fn, payload, cancel)
+        return fn(payload, cancel=cancel)
+
+    def _record(self, provider, fn, payload, cancel):
+        started = time.perf_counter()
+        reply = fn(payload, cancel=cancel)
+        seconds = time.perf_counter() - started
+        exact, loose = call_keys(provider, payload)
+        line = json.dumps({
+            "key": exact,
+            "loose": loose,
+            "provider": provider,
+            "model": payload.get("model"),
+            "user": last_user_message(payload)[:80],
+            "seconds": round(seconds, 4),
+            "reply": reply,
+        }, ensure_ascii=False)
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        return reply
+
+    def _next(self, table, key):
+        with self._lock:
+            records = table.get(key)
+            if not records:
+                return None
+            index = self._cursor[key] % len(records)
+            self._cursor[key] += 1
+            return records[index]
+
+    def _replay(self, provider, payload, cancel):
+        exact, loose = call_keys(provider, payload)
+        record = self._next(self._exact, exact) or self._next(self._loose, loose)
+        if record is None:
+            raise CassetteMiss(f"{provider}/{payload.get('model')}: {last_user_message(payload)[:40]!r}")
+        delay = record["seconds"] / self.speed if self.speed > 0 else 0.0
+        if delay:
+            if cancel is None:
+                time.sleep(delay)
+            elif cancel.wait(delay):
+                raise RequestCancelled("provider")
+        return record["reply"]
+
+
+def path_env(path):
+    """LLM_CASSETTE_DIR / LLM_CASSETTE_NAME naming the cassette file at `path` (".jsonl" optional)."""
+    path = os.path.abspath(path)
+    name = os.path.basename(path)
+    if name.endswith(".jsonl"):
+        name = name[:-len(".jsonl")]
+    return {"LLM_CASSETTE_DIR": os.path.dirname(path), "LLM_CASSETTE_NAME": name}
+
+
+def from_env():
+    return Cassette(
+        mode=(os.getenv("LLM_CASSETTE_MODE", "off").strip().lower() or "off"),
+        directory=os.getenv("LLM_CASSETTE_DIR", "") or DEFAULT_DIR,
+        name=os.getenv("LLM_CASSETTE_NAME", "session"),
+        speed=float(os.getenv("LLM_REPLAY_SPEED", "1") or 1),
+    )
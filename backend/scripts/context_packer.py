@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""Token-budgeted prompt assembly shared by server.py and run_skill.py.
+
+Fills CONTEXT_TOKEN_BUDGET by priority: skill instructions and the current
+user message (always), the most relevant reference sections, then history
+from the newest turn backwards. The stable parts are laid out first so
+provider prefix caches (DeepSeek context caching) can hit across turns.
+"""
+import math
+import os
+import re
+
+
+MESSAGE_OVERHEAD = 4
+TRUNCATION_MARK = "…（已截断）"
+
+CJK_RE = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]")
+HEADING_RE = re.compile(r"^(#{1,6})\s+(.*)$")
+LATIN_WORD_RE = re.compile(r"[a-z0-9]+")
+CJK_RUN_RE = re.compile(r"[\u4e00-\u9fff]+")
+
+
+# Knobs are read per call so values loaded from .env after import still apply.
+
+def default_budget():
+    return int(os.getenv("CONTEXT_TOKEN_BUDGET", "4000"))
+
+
+def reference_share():
+    """Share of the budget left after the mandatory parts that references may use;
+    history gets the rest plus whatever references leave unused."""
+    return float(os.getenv("CONTEXT_REFERENCE_SHARE", "0.5"))
+
+
+def history_block_messages():
+    """History is sent from a start index that moves in whole blocks of turns."""
+    return 2 * max(1, int(os.getenv("CONTEXT_HISTORY_BLOCK_TURNS", "2")))
+
+
+def estimate_tokens(text):
+    """Rough DeepSeek-style count: ~0.6 token per CJK char, ~0.3 per other char."""
+    if not text:
+        return 0
+    cjk = len(CJK_RE.findall(text))
+    other = len(text) - cjk
+    return int(math.ceil(cjk * 0.6 + other * 0.3))
+
+
+def message_tokens(message):
+    return estimate_tokens(message.get("content", "")) + MESSAGE_OVERHEAD
+
+
+def split_sections(content):
+    """Split markdown into (title, text) chunks at headings; text keeps its heading line."""
+    sections = []
+    title = ""
+    current = []
+    for line in content.splitlines():
+        m = HEADING_RE.match(line)
+        if m and current and any(l.strip() for l in current):
+            sections.append((title, "\n".join(current).strip()))
+            current = []
+        if m:
+            title = m.group(2).strip()
+        current.append(line)
+    if current and any(l.strip() for l in current):
+        sections.append((title, "\n".join(current).strip()))
+    return sections
+
+
+def tokenize(text):
+    """Latin words plus CJK bigrams (single CJK chars stand alone)."""
+    text = (text or "").lower()
+    tokens = LATIN_WORD_RE.findall(text)
+    for run in CJK_RUN_RE.findall(text):
+        if len(run) == 1:
+            tokens.append(run)
+        for i in range(len(run) - 1):
+            tokens.append(run[i:i + 2])
+    return tokens
+
+
+def group_sections(sections):
+    """Rebuild (name, content) pairs from chosen sections in their original order."""
+    grouped = {}
+    names = []
+    for section in sorted(sections, key=lambda s: s["order"]):
+        if section["name"] not in grouped:
+            grouped[section["name"]] = []
+            names.append(section["name"])
+        grouped[section["name"]].append(section["text"])
+    return [(name, "\n\n".join(grouped[name])) for name in names]
+
+
+def truncate_to_tokens(text, max_tokens):
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    lo, hi = 0, len(text)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if estimate_tokens(text[:mid]) + estimate_tokens(TRUNCATION_MARK) <= max_tokens:
+            lo = mid
+        else:
+            hi = mid - 1
+    return text[:lo] + TRUNCATION_MARK
+
+
+def render_references(references):
+    if not references:
+        return ""
+    parts = ["以下是参考资料："]
+    for name, content in references:
+        parts.append(f"### {name}\n{content}")
+    return "\n\n".join(parts)
+
+
+def trim_history(history, max_messages):
+    """Cap stored history, dropping whole blocks so the kept start stays block-aligned."""
+    if len(history) <= max_messages:
+        return history
+    block = history_block_messages()
+    excess = len(history) - max_messages
+    drop = ((excess + block - 1) // block) * block
+    return history[drop:]
+
+
+def _select_recent(history, budget):
+    """Keep whole turns from newest to oldest; the newest turn is truncated rather than dropped."""
+    chosen = []
+    used = 0
+    i = len(history)
+    while i > 0:
+        start = i - 2 if i >= 2 and history[i - 2].get("role") == "user" else i - 1
+        turn = history[start:i]
+        cost = sum(message_tokens(m) for m in turn)
+        if used + cost > budget:
+            if not chosen:
+                share = max(0, (budget - used) // max(1, len(turn)) - MESSAGE_OVERHEAD)
+                if share >= 32:
+                    chosen = [dict(m, content=truncate_to_tokens(m.get("content", ""), share)) for m in turn]
+                    used += sum(message_tokens(m) for m in chosen)
+            break
+        chosen = turn + chosen
+        used += cost
+        i = start
+    return chosen, used
+
+
+def select_history(history, budget):
+    """Pick the history suffix to send.
+
+    The start index only moves in steps of history_block_messages(), so the
+    same prefix is resent for several turns and provider prefix caches keep
+    hitting. Falls back to newest-first selection when even the last block
+    does not fit.
+    """
+    block = history_block_messages()
+    costs = [message_tokens(m) for m in history]
+    suffix_cost = [0] * (len(history) + 1)
+    for i in range(len(history) - 1, -1, -1):
+        suffix_cost[i] = suffix_cost[i + 1] + costs[i]
+    for start in range(0, len(history), block):
+        if suffix_cost[start] <= budget:
+            return history[start:], suffix_cost[start]
+    return _select_recent(history, budget)
+
+
+def pack_context(system_prompt, history, user_text, sections=None, budget=None, dynamic=""):
+    """Return (messages, stats) for one request.
+
+    Layout is prefix-cache friendly: the stable system prompt (base prompt and
+    skill text) comes first and is byte-identical across turns and users,
+    followed by block-aligned history. Everything that varies per request -
+    retrieved reference sections and `dynamic` hints - goes into a second
+    system message just before the current user message.
+    """
+    budget = budget or default_budget()
+    history = history or []
+    sections = sections or []
+
+    system_message = {"role": "system", "content": system_prompt}
+    user_message = {"role": "user", "content": user_text}
+    mandatory = message_tokens(system_message) + message_tokens(user_message)
+    if dynamic:
+        mandatory += estimate_tokens(dynamic) + MESSAGE_OVERHEAD
+    remaining = max(0, budget - mandatory)
+
+    reference_budget = int(remaining * reference_share()) if history else remaining
+    picked = []
+    reference_tokens = 0
+    for section in sections:
+        if reference_tokens + section["tokens"] <= reference_budget:
+            picked.append(section)
+            reference_tokens += section["tokens"]
+    context_text = "\n\n".join(
+        part for part in (render_references(group_sections(picked)), dynamic.strip()) if part
+    )
+    context_message = {"role": "system", "content": context_text} if context_text else None
+    context_tokens = message_tokens(context_message) if context_message else 0
+
+    history_budget = max(0, budget - message_tokens(system_message) - context_tokens
+                         - message_tokens(user_message))
+    kept_history, history_tokens = select_history(history, history_budget)
+
+    messages = [system_message]
+    messages.extend(kept_history)
+    if context_message:
+        messages.append(context_message)
+    messages.append(user_message)
+
+    system_tokens = message_tokens(system_message)
+    stats = {
+        "budget": budget,
+        "tokens": system_tokens + history_tokens + context_tokens + message_tokens(user_message),
+        "system_tokens": system_tokens,
+        "context_tokens": context_tokens,
+        "history_tokens": history_tokens,
+        "history_messages": len(kept_history),
+        "history_dropped": len(history) - len(kept_history),
+        "reference_sections": len(picked),
+        "reference_sections_total": len(sections),
+    }
+    return messages, stats
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""Offline skill-routing evaluation: accuracy, confusion matrix, latency and calls per decision.
+
+    # lexical scorer only, no provider needed
+    python3 backend/scripts/eval_routing.py --router lexical
+
+    # every router against an in-process stub provider (checks plumbing and overhead, not accuracy)
+    python3 backend/scripts/eval_routing.py --stub --stub-latency 0.05
+
+    # the configured provider (.env / LLM_ROUTER_*), three passes for steadier latency
+    python3 backend/scripts/eval_routing.py --router llm --router hybrid --repeat 3
+
+    # record the llm router's provider calls once, then re-run from them without network
+    python3 backend/scripts/eval_routing.py --router llm --record /tmp/routing.jsonl
+    python3 backend/scripts/eval_routing.py --router llm --cassette /tmp/routing.jsonl
+
+Cases are JSON lines {"text": ..., "skill": <expected skill name, or null for NONE>}
+(default backend/eval/routing.jsonl). Routers:
+
+    lexical   best score_skill above 0 (server.predict_skill_lexical, same as run_skill.py --auto)
+    llm       server.choose_skill_by_model with the router tier
+    hybrid    the lexical guess when its score reaches --min-score, otherwise llm
+
+The threshold table shows, for each minimum lexical score, how many cases the
+lexical guess would cover, how often it is right and how often it agrees with
+the llm router: the trade-off SPECULATIVE_MIN_SCORE makes.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import redirect_stdout
+
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.abspath(os.path.join(SCRIPT_DIR, "..", ".."))
+DEFAULT_DATASET = os.path.join(PROJECT_ROOT, "backend", "eval", "routing.jsonl")
+ROUTERS = ("lexical", "llm", "hybrid")
+NONE = "NONE"
+ERROR = "ERROR"
+
+sys.path.insert(0, SCRIPT_DIR)
+from bench import print_rows, summarize  # noqa: E402
+
+
+def load_cases(path):
+    cases = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            case = json.loads(line)
+            cases.append({"text": case["text"], "expected": case.get("skill") or NONE})
+    return cases
+
+
+class CountingRequest:
+    """Provider request_fn wrapper that counts calls, for calls per decision."""
+
+    def __init__(self, request_fn):
+        self.request_fn = request_fn
+        self.calls = 0
+
+    def __call__(self, payload, **kwargs):
+        self.calls += 1
+        return self.request_fn(payload, **kwargs)
+
+
+def skill_label(skill):
+    return skill["name"] if skill else NONE
+
+
+def start_stub(latency):
+    """In-process stub_llm.py on a free port; the server config is pointed at it."""
+    import stub_llm
+    stub = stub_llm.make_server("127.0.0.1", 0, latency=latency)
+    threading.Thread(target=stub.serve_forever, daemon=True).start()
+    os.environ.update({
+        "LLM_PROVIDER": "deepseek",
+        "LLM_ROUTER_PROVIDER": "deepseek",
+        "LLM_FAILOVER": "",
+        "DEEPSEEK_API_KEY": "stub",
+        "DEEPSEEK_BASE_URL": f"http://127.0.0.1:{stub.server_address[1]}",
+    })
+    return stub
+
+
+def use_cassette(mode, path):
+    """Route provider calls through cassette.py; replay uses the same provider settings but no network."""
+    import cassette
+    os.environ.update({"LLM_CASSETTE_MODE": mode, **cassette.path_env(path)})
+
+
+def build_routers(names, skills, min_score):
+    """{name: (route(text) -> label, counter or None)}; llm-backed routers need a provider."""
+    import server
+    routers = {}
+    if "lexical" in names:
+        routers["lexical"] = (lambda text: skill_label(server.predict_skill_lexical(skills, text)[0]), None)
+    if "llm" in names or "hybrid" in names:
+        with redirect_stdout(sys.stderr):  # keep the config banner out of --json output
+            tier = server.init_config()["tiers"]["router"]
+        for name in ("llm", "hybrid"):
+            if name not in names:
+                continue
+            counter = CountingRequest(tier["request_fn"])
+
+            def llm(text, counter=counter):
+                return skill_label(server.choose_skill_by_model(counter, tier["model"], skills, text))
+
+            if name == "llm":
+                routers[name] = (llm, counter)
+            else:
+                def hybrid(text, llm=llm):
+                    guess, score = server.predict_skill_lexical(skills, text)
+                    return skill_label(guess) if guess and score >= min_score else llm(text)
+                routers[name] = (hybrid, counter)
+    return routers
+
+
+def run_router(route, cases, repeat):
+    decisions = []
+    for _ in range(repeat):
+        for case in cases:
+            started = time.perf_counter()
+            try:
+                predicted = route(case["text"])
+            except Exception as e:
+                predicted, error = ERROR, str(e)
+            else:
+                error = None
+            decisions.append({
+                "text": case["text"],
+                "expected": case["expected"],
+                "predicted": predicted,
+                "seconds": time.perf_counter() - started,
+                "error": error,
+            })
+    return decisions
+
+
+def router_row(name, decisions, counter):
+    correct = sum(1 for d in decisions if d["predicted"] == d["expected"])
+    errors = sum(1 for d in decisions if d["predicted"] == ERROR)
+    latency = summarize([d["seconds"] for d in decisions])
+    return {
+        "router": name,
+        "decisions": len(decisions),
+        "accuracy": round(correct / len(decisions), 3) if decisions else 0.0,
+        "errors": errors,
+        "p50_ms": latency["p50_ms"],
+        "p95_ms": latency["p95_ms"],
+        "calls_per_decision": round(counter.calls / len(decisions), 2) if counter and decisions else 0.0,
+    }
+
+
+def confusion(decisions):
+    matrix = defaultdict(Counter)
+    for d in decisions:
+        matrix[d["expected"]][d["predicted"]] += 1
+    return {expected: dict(row) for expected, row in matrix.items()}
+
+
+def threshold_table(skills, cases, llm_decisions=None):
+    import server
+    llm_by_text = {d["text"]: d["predicted"] for d in llm_decisions or []}
+    guesses = [(case, *server.predict_skill_lexical(skills, case["text"])) for case in cases]
+    top = max([score for _, _, score in guesses] + [1])
+    rows = []
+    for min_score in range(1, top + 1):
+        covered = [(case, skill_label(guess)) for case, guess, score in guesses if guess and score >= min_score]
+        right = sum(1 for case, label in covered if label == case["expected"])
+        row = {
+            "min_score": min_score,
+            "covered": len(covered),
+            "coverage": round(len(covered) / len(cases), 3) if cases else 0.0,
+            "precision": round(right / len(covered), 3) if covered else None,
+        }
+        if llm_by_text:
+            agree = sum(1 for case, label in covered if llm_by_text.get(case["text"]) == label)
+            row["agrees_llm"] = round(agree / len(covered), 3) if covered else None
+        rows.append(row)
+    return rows
+
+
+def print_confusion(name, matrix, labels):
+    print(f"\n混淆矩阵 [{name}]（行：期望，列：预测）")
+    columns = ["expected"] + labels
+    rows = [{"expected": e, **{p: matrix.get(e, {}).get(p, 0) for p in labels}} for e in labels]
+    print_rows(rows, columns)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline skill-routing evaluation")
+    parser.add_argument("--dataset", default=DEFAULT_DATASET, help="标注数据（JSON Lines）")
+    parser.add_argument("--router", action="append", choices=ROUTERS, help="可重复指定，默认全部")
+    parser.add_argument("--repeat", type=int, default=1, help="每条样本重复次数（用于延迟统计）")
+    parser.add_argument("--min-score", type=int, default=None,
+                        help="hybrid 采用词法结果的最低得分，默认 SPECULATIVE_MIN_SCORE")
+    parser.add_argument("--stub", action="store_true", help="使用进程内 stub 模型（只验证流程与开销）")
+    parser.add_argument("--stub-latency", type=float, default=0.0)
+    parser.add_argument("--record", default=None, help="把模型调用追加录制到该 .jsonl 文件（cassette.py）")
+    parser.add_argument("--cassette", default=None, help="从该 .jsonl 文件回放录制的模型调用，不访问网络")
+    parser.add_argument("--mistakes", type=int, default=5, help="每个路由器列出的错误样本数")
+    parser.add_argument("--json", action="store_true", help="输出 JSON 而不是表格")
+    args = parser.parse_args()
+
+    os.environ.setdefault("METRICS_ENABLED", "0")
+    os.environ.setdefault("OLLAMA_WARMUP", "0")
+    os.environ["SKILL_CATALOG"] = "0"
+    os.environ["SESSION_STORE"] = "memory"
+    names = args.router or list(ROUTERS)
+    stub = start_stub(args.stub_latency) if args.stub else None
+    if args.cassette:
+        use_cassette("replay", args.cassette)
+    elif args.record:
+        use_cassette("record", args.record)
+
+    import server
+    with redirect_stdout(sys.stderr):
+        server.load_env_file()
+    min_score = server.speculative_min_score() if args.min_score is None else args.min_score
+    skills = server.list_skills(server.SKILLS_DIR)
+    cases = load_cases(args.dataset)
+    routers = build_routers(names, skills, min_score)
+
+    rows, matrices, mistakes, results = [], {}, {}, {}
+    for name in names:
+        route, counter = routers[name]
+        decisions = run_router(route, cases, max(1, args.repeat))
+        results[name] = decisions
+        rows.append(router_row(name, decisions, counter))
+        matrices[name] = confusion(decisions)
+        mistakes[name] = [d for d in decisions[:len(cases)] if d["predicted"] != d["expected"]]
+    thresholds = threshold_table(skills, cases, results.get("llm", [])[:len(cases)])
+    if stub:
+        stub.shutdown()
+
+    if args.json:
+        print(json.dumps({
+            "dataset": args.dataset,
+            "cases": len(cases),
+            "min_score": min_score,
+            "routers": rows,
+            "confusion": matrices,
+            "thresholds": thresholds,
+            "mistakes": {name: [{k: d[k] for k in ("text", "expected", "predicted", "error")} for d in ms]
+                         for name, ms in mistakes.items()},
+        }, ensure_ascii=False, indent=2))
+        return
+
+    print(f"\n数据集 {args.dataset}：{len(cases)} 条，重复 {max(1, args.repeat)} 次；hybrid 阈值 {min_score}")
+    print_rows(rows, ["router", "decisions", "accuracy", "errors", "p50_ms", "p95_ms", "calls_per_decision"])
+    labels = sorted({s["name"] for s in skills} | {c["expected"] for c in cases} - {NONE}) + [NONE]
+    for name in names:
+        extra = sorted({d["predicted"] for d in results[name]} - set(labels))
+        print_confusion(name, matrices[name], labels + extra)
+        for d in mistakes[name][:args.mistakes]:
+            print(f"  ✗ {d['text'][:40]!r}: 期望 {d['expected']}，得到 {d['predicted']}"
+                  + (f"（{d['error']}）" if d["error"] else ""))
+    print("\n词法阈值（SPECULATIVE_MIN_SCORE）")
+    columns = ["min_score", "covered", "coverage", "precision"] + (["agrees_llm"] if "llm" in results else [])
+    print_rows(thresholds, columns)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""Numeric summary of an uploaded image for grading prompts.
+
+Computed on a downsampled copy (JPEG is decoded at reduced scale via
+Image.draft), so it takes a few milliseconds even for camera-sized uploads,
+and rendered as a few hundred bytes of text the model can ground exposure
+and white-balance numbers in. derive_auto_adjustments turns the same
+statistics into a grading dict directly, for corrections that need no model:
+
+    python3 backend/scripts/image_stats.py photo.jpg
+"""
+import io
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+
+MAX_SIDE = int(os.getenv("IMAGE_STATS_MAX_SIDE", "256"))
+# Luma at or beyond these is counted as clipped.
+CLIP_LOW = 2 / 255
+CLIP_HIGH = 253 / 255
+PERCENTILES = (1, 5, 50, 95, 99)
+
+
+def load_small(image_bytes, max_side=MAX_SIDE):
+    """Decode to a float32 RGB array in [0, 1] no larger than max_side; also returns the original size."""
+    image = Image.open(io.BytesIO(image_bytes))
+    size = image.size
+    image.draft("RGB", (max_side, max_side))
+    image.thumbnail((max_side, max_side), Image.BILINEAR)
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    return np.asarray(image, dtype=np.float32) / 255.0, size
+
+
+def srgb_to_linear(arr):
+    return np.where(arr <= 0.04045, arr / 12.92, ((arr + 0.055) / 1.055) ** 2.4)
+
+
+def estimate_cct(linear_rgb_mean):
+    """Correlated colour temperature (K) of the average colour, McCamy's approximation."""
+    r, g, b = (float(v) for v in linear_rgb_mean)
+    x_ = 0.4124 * r + 0.3576 * g + 0.1805 * b
+    y_ = 0.2126 * r + 0.7152 * g + 0.0722 * b
+    z_ = 0.0193 * r + 0.1192 * g + 0.9505 * b
+    total = x_ + y_ + z_
+    if total <= 1e-6:
+        return None
+    x, y = x_ / total, y_ / total
+    if abs(0.1858 - y) < 1e-6:
+        return None
+    n = (x - 0.3320) / (0.1858 - y)
+    cct = 449 * n ** 3 + 3525 * n ** 2 + 6823.3 * n + 5520.33
+    return int(round(max(1500.0, min(15000.0, cct))))
+
+
+def summarize_image(image_bytes, max_side=MAX_SIDE):
+    started = time.perf_counter()
+    arr, (width, height) = load_small(image_bytes, max_side)
+    pixels = arr.reshape(-1, 3)
+    luma = pixels @ np.array([0.2126, 0.7152, 0.0722], dtype=np.float32)
+    high = pixels.max(axis=1)
+    low = pixels.min(axis=1)
+    saturation = np.where(high > 1e-6, (high - low) / np.maximum(high, 1e-6), 0.0)
+    means = pixels.mean(axis=0)
+    stats = {
+        "width": width,
+        "height": height,
+        "luma_percentiles": {p: round(float(v) * 100, 1)
+                             for p, v in zip(PERCENTILES, np.percentile(luma, PERCENTILES))},
+        "luma_mean": round(float(luma.mean()) * 100, 1),
+        "clip_shadows": round(float((luma <= CLIP_LOW).mean()) * 100, 2),
+        "clip_highlights": round(float((luma >= CLIP_HIGH).mean()) * 100, 2),
+        "channel_means": [int(round(float(v) * 255)) for v in means],
+        "cct": estimate_cct(srgb_to_linear(pixels).mean(axis=0)),
+        "saturation_mean": round(float(saturation.mean()) * 100, 1),
+        "saturation_std": round(float(saturation.std()) * 100, 1),
+        "saturation_p90": round(float(np.percentile(saturation, 90)) * 100, 1),
+    }
+    stats["ms"] = round((time.perf_counter() - started) * 1000, 2)
+    return stats
+
+
+def describe_cct(cct):
+    if cct is None:
+        return "无法估计"
+    if cct < 5000:
+        return f"约 {cct}K（偏暖）"
+    if cct > 7000:
+        return f"约 {cct}K（偏冷）"
+    return f"约 {cct}K（接近中性）"
+
+
+def format_stats(stats):
+    p = stats["luma_percentiles"]
+    r, g, b = stats["channel_means"]
+    return "\n".join([
+        "[图像统计] 以下数值由服务端根据上传图片的像素计算，请据此判断曝光与白平衡，不要凭空猜测：",
+        f"- 尺寸 {stats['width']}x{stats['height']}；亮度均值 {stats['luma_mean']:g}（0-100）",
+        "- 亮度分位 P1/P5/P50/P95/P99 = " + "/".join(f"{p[k]:g}" for k in PERCENTILES),
+        f"- 暗部裁切 {stats['clip_shadows']:g}%，高光裁切 {stats['clip_highlights']:g}%",
+        f"- RGB 均值 R {r} / G {g} / B {b}；估计色温 {describe_cct(stats['cct'])}",
+        f"- 饱和度 均值 {stats['saturation_mean']:g}%，标准差 {stats['saturation_std']:g}%，"
+        f"P90 {stats['saturation_p90']:g}%",
+    ])
+
+
+# --- Auto grade ---
+
+# Median luma (0-100) band that auto exposure leaves alone; outside it the median is moved to the edge.
+AUTO_MEDIAN_BAND = (38.0, 58.0)
+# P1..P99 luma spread below which the image counts as flat, and the spread auto contrast aims for.
+AUTO_FLAT_SPREAD = 75.0
+AUTO_TARGET_SPREAD = 85.0
+
+
+def _clamp(value, low, high):
+    return max(low, min(high, value))
+
+
+def derive_auto_adjustments(stats):
+    """Auto levels, grey-world white balance and a saturation nudge, in apply_adjustments units.
+
+    Deterministic and conservative: each value moves in whole percent steps
+    (so the reply text parses back to the same dict) and small corrections
+    are skipped.
+    """
+    p = stats["luma_percentiles"]
+    adjustments = {}
+
+    median = max(p[50], 1.0)
+    target = _clamp(median, *AUTO_MEDIAN_BAND)
+    exposure = round(_clamp(target / median - 1, -0.3, 0.3) * 100)
+    if abs(exposure) >= 3:
+        adjustments["exposure"] = exposure / 100
+    spread = max((p[99] - p[1]) * (1 + adjustments.get("exposure", 0)), 1.0)
+    if spread < AUTO_FLAT_SPREAD:
+        adjustments["contrast"] = 1 + round(_clamp(AUTO_TARGET_SPREAD / spread - 1, 0.05, 0.3) * 100) / 100
+
+    if stats["clip_highlights"] >= 0.5:
+        adjustments["highlights"] = -round(_clamp(10 + stats["clip_highlights"] * 3, 10, 40))
+    if stats["clip_shadows"] >= 0.5 or p[5] < 4:
+        adjustments["shadows"] = round(_clamp(10 + stats["clip_shadows"] * 3, 10, 30))
+
+    # apply_adjustments scales R by warmth and B by 2 - warmth; equalise their means, 60% of the way.
+    r, _, b = stats["channel_means"]
+    if r + b > 0:
+        warmth = round(_clamp((2 * b / (r + b) - 1) * 0.6, -0.1, 0.1) * 100)
+        if abs(warmth) >= 1:
+            adjustments["warmth"] = 1 + warmth / 100
+
+    saturation_mean = stats["saturation_mean"]
+    if saturation_mean < 3:
+        pass  # monochrome: nothing to boost
+    elif saturation_mean < 20:
+        adjustments["saturation"] = 1.15
+    elif saturation_mean < 35:
+        adjustments["saturation"] = 1.08
+    elif saturation_mean > 60:
+        adjustments["saturation"] = 0.95
+    return adjustments
+
+
+def _signed(value):
+    return f"{value:+d}"
+
+
+def describe_auto_adjustments(adjustments):
+    """Reply text in the color-grading output format; parse_adjustments reads it back to the same values."""
+    global_parts = []
+    if "exposure" in adjustments:
+        global_parts.append(f"曝光 {_signed(round(adjustments['exposure'] * 100))}")
+    if "contrast" in adjustments:
+        global_parts.append(f"对比度 {_signed(round((adjustments['contrast'] - 1) * 100))}")
+    if "warmth" in adjustments:
+        global_parts.append(f"色温 {_signed(round((adjustments['warmth'] - 1) * 100))}")
+    if "saturation" in adjustments:
+        global_parts.append(f"饱和度 {_signed(round((adjustments['saturation'] - 1) * 100))}")
+    local_parts = []
+    if "highlights" in adjustments:
+        local_parts.append(f"高光 {_signed(adjustments['highlights'])}")
+    if "shadows" in adjustments:
+        local_parts.append(f"阴影 {_signed(adjustments['shadows'])}")
+    # The summary line avoids parameter names: parse_adjustments takes the first mention of each.
+    lines = ["调整摘要：按像素统计自动校正明暗与白平衡（本地计算，未调用模型）。"]
+    lines.append("全局参数：" + ("，".join(global_parts) if global_parts else "无需调整"))
+    if local_parts:
+        lines.append("局部参数：" + "，".join(local_parts))
+    lines.append("如需胶片感、电影感等风格化调色，请说明想要的风格。")
+    return "\n".join(lines)
+
+
+def main():
+    if len(sys.argv) != 2:
+        print("用法: python3 backend/scripts/image_stats.py <图片路径>")
+        sys.exit(1)
+    with open(sys.argv[1], "rb") as f:
+        stats = summarize_image(f.read())
+    print(format_stats(stats))
+    print(f"（用时 {stats['ms']} ms）")
+    print()
+    print(describe_auto_adjustments(derive_auto_adjustments(stats)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""Liveness and in-flight work tracking for server.py.
+
+Open browser tabs keep one `/events` SSE stream each, so liveness costs no
+polling round trips; every other request just refreshes the activity
+timestamp. Chat and image work is counted by kind so a shutdown can stop
+accepting, wait for that work within a deadline and report what it drained.
+"""
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+
+class Lifecycle:
+    def __init__(self, idle_timeout=60.0):
+        self.idle_timeout = idle_timeout
+        self._cond = threading.Condition()
+        self._active = Counter()
+        self._finished_while_draining = Counter()
+        self._streams = {}
+        self._next_stream = 0
+        self.last_activity = time.time()
+        self.draining = False
+        self.drain_started = None
+
+    def touch(self):
+        self.last_activity = time.time()
+
+    @contextmanager
+    def work(self, kind):
+        """Count a unit of chat/image work for the duration of the block."""
+        with self._cond:
+            self._active[kind] += 1
+            self.last_activity = time.time()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._active[kind] -= 1
+                if not self._active[kind]:
+                    del self._active[kind]
+                if self.draining:
+                    self._finished_while_draining[kind] += 1
+                self.last_activity = time.time()
+                self._cond.notify_all()
+
+    def open_stream(self, session_id):
+        with self._cond:
+            self._next_stream += 1
+            self._streams[self._next_stream] = session_id
+            self.last_activity = time.time()
+            return self._next_stream
+
+    def close_stream(self, token):
+        with self._cond:
+            self._streams.pop(token, None)
+            self.last_activity = time.time()
+
+    def live_sessions(self, exclude=None):
+        with self._cond:
+            return {sid for sid in self._streams.values() if sid != exclude}
+
+    def is_idle(self, now=None):
+        now = now or time.time()
+        with self._cond:
+            if self._active or self._streams:
+                return False
+        return now - self.last_activity > self.idle_timeout
+
+    def begin_drain(self):
+        """Returns False if a drain is already under way."""
+        with self._cond:
+            if self.draining:
+                return False
+            self.draining = True
+            self.drain_started = time.time()
+            self._cond.notify_all()
+            return True
+
+    def wait_drained(self, timeout, settle=0.2):
+        """Block until no work is in flight (stable for `settle` s) or the deadline; returns a report.
+
+        The settle period covers connections accepted just before the listener
+        stopped whose handlers have not registered their work yet.
+        """
+        deadline = time.time() + timeout
+        idle_since = None
+        with self._cond:
+            while True:
+                now = time.time()
+                if self._active:
+                    idle_since = None
+                elif idle_since is None:
+                    idle_since = now
+                elif now - idle_since >= settle:
+                    break
+                if now >= deadline:
+                    break
+                self._cond.wait(min(0.05, max(0.0, deadline - now)))
+            return {
+                "drained": dict(self._finished_while_draining),
+                "abandoned": dict(self._active),
+                "seconds": round(time.time() - (self.drain_started or time.time()), 3),
+            }
+
+    def wait_draining(self, timeout):
+        """Sleep up to `timeout` seconds, waking early when a drain starts; True if draining."""
+        with self._cond:
+            if not self.draining:
+                self._cond.wait(timeout)
+            return self.draining
+
+    def snapshot(self):
+        with self._cond:
+            return {
+                "active": dict(self._active),
+                "live_streams": len(self._streams),
+                "idle_seconds": round(time.time() - self.last_activity, 1),
+                "draining": self.draining,
+            }
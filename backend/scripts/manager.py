@@ -1,21 +1,35 @@
 #!/usr/bin/env python3
 import os
 import sys
+import json
 import time
+import select
 import socket
+import signal
+import argparse
 import threading
 import subprocess
 import platform
+import urllib.request
 from http.server import BaseHTTPRequestHandler, HTTPServer
 
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 PROJECT_ROOT = os.path.abspath(os.path.join(SCRIPT_DIR, "..", ".."))
 
-MANAGER_PORT = 8010
-SERVER_PORT = 8000
+MANAGER_PORT = int(os.getenv("MANAGER_PORT", "8010"))
+SERVER_PORT = int(os.getenv("SERVER_PORT", "8000"))
 SERVER_CMD = [sys.executable, os.path.join(SCRIPT_DIR, "server.py"), "--no-browser"]
 LOG_DIR = os.path.join(PROJECT_ROOT, "backend", "logs")
 SERVER_LOG = os.path.join(LOG_DIR, "manager-server.log")
+HEALTH_BASE_PORT = 8100
+HEALTH_INTERVAL_SEC = 2
+HEALTH_FAILURES_BEFORE_RESTART = 3
+READY_TIMEOUT_SEC = 60
+READY_POLL_SEC = 0.05
+# Workers that die sooner than this after starting are restarted with backoff.
+CRASH_WINDOW_SEC = 10
+MAX_BACKOFF_SEC = 30
+WORKERS = None
 
 
 def is_port_open(port):
@@ -77,6 +91,306 @@ def start_server():
     return False
 
 
+class Worker:
+    def __init__(self, worker_id):
+        self.id = worker_id
+        self.proc = None
+        self.health_port = None
+        self.generation = 0
+        self.started = 0.0
+        self.restarts = 0
+        self.failures = 0
+        self.healthy = False
+        self.ready = False
+        self.stopped = False
+        self.starting = False
+        self.health = {}
+        self.backoff = 0.0
+        self.next_start = 0.0
+        self.last_restart_seconds = None
+
+
+class WorkerPool:
+    """server.py processes accepting on one listening socket created here and inherited by each.
+
+    Because the manager keeps the socket open, a replacement process can be
+    started and checked on /readyz before the old one is told to drain; no
+    connection is refused in between. The one exception is a single worker
+    that shut down after idling: the socket is closed then, so the port reads
+    as down until /restart starts the worker and reopens it.
+    """
+
+    def __init__(self, count, port=SERVER_PORT, health_base=HEALTH_BASE_PORT):
+        self.count = count
+        self.port = port
+        self.health_base = health_base
+        self.lock = threading.Lock()
+        self.workers = [Worker(i) for i in range(count)]
+        self.sock = None
+
+    def listen(self):
+        if is_port_open(self.port):
+            kill_port_process(self.port)
+            time.sleep(0.5)
+        host = os.getenv("SERVER_HOST", "127.0.0.1")
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((host, self.port))
+        sock.listen(128)
+        sock.set_inheritable(True)
+        self.sock = sock
+
+    def ensure_listening(self):
+        with self.lock:
+            if self.sock is not None:
+                return
+        self.listen()
+
+    def close_listener(self):
+        """Stop accepting on the port (caller holds self.lock)."""
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def health_port_for(self, worker, generation):
+        # Two ports per slot so a replacement can come up beside the process it replaces.
+        return self.health_base + worker.id * 2 + generation % 2
+
+    def spawn_process(self, worker, generation):
+        os.makedirs(LOG_DIR, exist_ok=True)
+        log_file = open(SERVER_LOG, "a", encoding="utf-8")
+        log_file.write(f"[manager] starting worker {worker.id} (generation {generation})\n")
+        log_file.flush()
+        health_port = self.health_port_for(worker, generation)
+        # The server writes "ready" here once it serves; /readyz polling is the fallback.
+        ready_read, ready_write = os.pipe()
+        env = dict(os.environ)
+        env.update({
+            "SERVER_PORT": str(self.port),
+            "SERVER_LISTEN_FD": str(self.sock.fileno()),
+            "SERVER_HEALTH_PORT": str(health_port),
+            "SERVER_READY_FD": str(ready_write),
+        })
+        if self.count > 1:
+            # History lives in the shared session store (log or sqlite by default),
+            # so whichever worker gets the next message sees it.
+            env["SERVER_WORKER_ID"] = str(worker.id)
+        try:
+            proc = subprocess.Popen(
+                SERVER_CMD,
+                cwd=PROJECT_ROOT,
+                env=env,
+                pass_fds=(self.sock.fileno(), ready_write),
+                stdout=log_file,
+                stderr=log_file,
+            )
+            proc.ready_pipe = ready_read
+        except Exception as e:
+            log_file.write(f"[manager] Failed to start worker {worker.id}: {e}\n")
+            os.close(ready_read)
+            proc = None
+        os.close(ready_write)
+        log_file.close()
+        return proc, health_port
+
+    def probe(self, port, path="/healthz"):
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}{path}", timeout=1) as resp:
+                return json.loads(resp.read().decode("utf-8"))
+        except Exception:
+            return None
+
+    def wait_ready_pipe(self, proc, deadline):
+        """True once the worker writes "ready"; False on EOF (it exited or never signals) or timeout."""
+        pipe = proc.ready_pipe
+        try:
+            while time.time() < deadline:
+                readable, _, _ = select.select([pipe], [], [], min(0.5, max(0.0, deadline - time.time())))
+                if not readable:
+                    if proc.poll() is not None:
+                        return False
+                    continue
+                return os.read(pipe, 64).startswith(b"ready")
+            return False
+        finally:
+            os.close(pipe)
+
+    def wait_ready(self, proc, port, timeout=READY_TIMEOUT_SEC):
+        deadline = time.time() + timeout
+        if self.wait_ready_pipe(proc, deadline):
+            return True
+        while time.time() < deadline:
+            if proc.poll() is not None:
+                return False
+            if self.probe(port, "/readyz") is not None:
+                return True
+            time.sleep(READY_POLL_SEC)
+        return False
+
+    def launch(self, worker):
+        """Start a process for an empty slot and wait until it reports ready."""
+        started = time.time()
+        self.ensure_listening()
+        proc, port = self.spawn_process(worker, worker.generation)
+        with self.lock:
+            worker.proc, worker.health_port = proc, port
+            worker.started = started
+            worker.failures = 0
+            worker.health = {}
+            worker.healthy = worker.ready = False
+            worker.stopped = False
+        try:
+            if proc is not None and self.wait_ready(proc, port):
+                with self.lock:
+                    worker.ready = worker.healthy = True
+                    worker.last_restart_seconds = round(time.time() - started, 2)
+                print(f"[manager] worker {worker.id} ready in {worker.last_restart_seconds:.2f}s")
+                return True
+            return False
+        finally:
+            worker.starting = False
+
+    def replace(self, worker):
+        """Zero-downtime restart: bring up the next generation, then drain the old process."""
+        with self.lock:
+            if worker.starting:
+                return False
+            worker.starting = True
+        try:
+            return self._replace(worker)
+        finally:
+            worker.starting = False
+
+    def _replace(self, worker):
+        started = time.time()
+        generation = worker.generation + 1
+        proc, port = self.spawn_process(worker, generation)
+        if proc is None or not self.wait_ready(proc, port):
+            if proc is not None:
+                proc.kill()
+            print(f"[manager] worker {worker.id} replacement never became ready; keeping the old one")
+            return False
+        with self.lock:
+            old = worker.proc
+            worker.proc, worker.health_port, worker.generation = proc, port, generation
+            worker.started = started
+            worker.failures = 0
+            worker.health = {}
+            worker.ready = worker.healthy = True
+            worker.stopped = False
+            worker.restarts += 1
+            worker.last_restart_seconds = round(time.time() - started, 2)
+        if old is not None and old.poll() is None:
+            old.terminate()  # SIGTERM: stop accepting, finish in-flight requests, exit
+        print(f"[manager] worker {worker.id} replaced in {worker.last_restart_seconds:.2f}s")
+        return True
+
+    def start(self):
+        self.listen()
+        for worker in self.workers:
+            worker.starting = True
+        threads = [threading.Thread(target=self.launch, args=(w,)) for w in self.workers]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    def reload(self):
+        """Rolling restart, one slot at a time so the others keep serving."""
+        for worker in self.workers:
+            if worker.proc is not None and worker.proc.poll() is None:
+                self.replace(worker)
+            else:
+                with self.lock:
+                    if worker.starting:
+                        continue
+                    worker.starting = True
+                self.launch(worker)
+
+    def ensure(self):
+        """Start any slot that is not running, including ones stopped on purpose."""
+        for worker in self.workers:
+            with self.lock:
+                running = worker.proc is not None and worker.proc.poll() is None
+                if running or worker.starting:
+                    continue
+                worker.next_start = 0.0
+                worker.starting = True
+            self.launch(worker)
+
+    def check(self):
+        """Restart dead or unresponsive workers individually, backing off on crash loops."""
+        now = time.time()
+        for worker in self.workers:
+            with self.lock:
+                proc = worker.proc
+                if proc is not None and proc.poll() is not None:
+                    code = proc.returncode
+                    worker.proc = None
+                    worker.healthy = worker.ready = False
+                    if code == 0 and self.count == 1:
+                        # Clean exit of a single server (idle shutdown): close the port so clients
+                        # and start scripts see it down instead of queueing, and wait for /restart.
+                        worker.stopped = True
+                        self.close_listener()
+                        print(f"[manager] worker {worker.id} stopped")
+                        continue
+                    quick = now - worker.started < CRASH_WINDOW_SEC
+                    worker.backoff = min(MAX_BACKOFF_SEC, worker.backoff * 2 or 1.0) if quick else 0.0
+                    worker.next_start = now + worker.backoff
+                    worker.restarts += 1
+                    print(f"[manager] worker {worker.id} exited ({code}), restart in {worker.backoff:.0f}s")
+                pending = (worker.proc is None and not worker.stopped and not worker.starting
+                           and now >= worker.next_start)
+                if pending:
+                    worker.starting = True
+            if pending:
+                if not self.launch(worker):
+                    with self.lock:
+                        worker.backoff = min(MAX_BACKOFF_SEC, worker.backoff * 2 or 1.0)
+                        worker.next_start = time.time() + worker.backoff
+                continue
+            if worker.proc is None or worker.starting:
+                continue
+            health = self.probe(worker.health_port)
+            with self.lock:
+                worker.health = health or {}
+                worker.healthy = health is not None
+                worker.failures = 0 if health else worker.failures + 1
+                if worker.failures >= HEALTH_FAILURES_BEFORE_RESTART and worker.proc is not None:
+                    print(f"[manager] worker {worker.id} failed {worker.failures} health checks, killing")
+                    worker.proc.kill()
+
+    def supervise(self):
+        while True:
+            time.sleep(HEALTH_INTERVAL_SEC)
+            try:
+                self.check()
+            except Exception as e:
+                print(f"[manager] supervise error: {e}")
+
+    def any_healthy(self):
+        with self.lock:
+            return any(w.healthy for w in self.workers)
+
+    def status(self):
+        with self.lock:
+            return [{
+                "worker": w.id,
+                "pid": w.proc.pid if w.proc else None,
+                "alive": w.proc is not None and w.proc.poll() is None,
+                "healthy": w.healthy,
+                "ready": w.ready,
+                "stopped": w.stopped,
+                "generation": w.generation,
+                "restarts": w.restarts,
+                "last_restart_seconds": w.last_restart_seconds,
+                "uptime_seconds": round(time.time() - w.started, 1) if w.proc else 0,
+                "active_requests": w.health.get("active_requests"),
+                "health_port": w.health_port,
+            } for w in self.workers]
+
+
 class ManagerHandler(BaseHTTPRequestHandler):
     def _send(self, code=200, body=b"OK"):
         self.send_response(code)
@@ -93,21 +407,47 @@ class ManagerHandler(BaseHTTPRequestHandler):
 
     def do_GET(self):
         if self.path == "/status":
-            status = b"OK" if is_port_open(SERVER_PORT) else b"DOWN"
-            self._send(200, status)
+            up = WORKERS.any_healthy() if WORKERS else is_port_open(SERVER_PORT)
+            self._send(200, b"OK" if up else b"DOWN")
+        elif self.path == "/workers":
+            workers = WORKERS.status() if WORKERS else []
+            self._send(200, json.dumps({"workers": workers}).encode("utf-8"))
         else:
             self._send(404, b"Not Found")
 
     def do_POST(self):
         if self.path == "/restart":
             self._send(200, b"OK")
-            threading.Thread(target=start_server, daemon=True).start()
+            target = WORKERS.ensure if WORKERS else start_server
+            threading.Thread(target=target, daemon=True).start()
+        elif self.path == "/reload" and WORKERS:
+            self._send(200, b"OK")
+            threading.Thread(target=WORKERS.reload, daemon=True).start()
         else:
             self._send(404, b"Not Found")
 
 
 def run():
-    start_server()
+    global WORKERS
+    parser = argparse.ArgumentParser(description="Supervise the chat server")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("SERVER_WORKERS", "1")),
+                        help="server.py 进程数；大于 1 时共享监听端口")
+    parser.add_argument("--health-base-port", type=int, default=HEALTH_BASE_PORT,
+                        help="第 i 个 worker 的健康检查端口为 base + 2i 或 base + 2i + 1（新旧进程交替使用）")
+    args = parser.parse_args()
+
+    if platform.system().lower().startswith("win"):
+        # No fd inheritance: fall back to a single self-binding server without handoff.
+        if args.workers > 1:
+            print("[manager] 多 worker 需要继承监听 socket，Windows 上退回单进程模式。")
+        start_server()
+    else:
+        WORKERS = WorkerPool(max(1, args.workers), SERVER_PORT, args.health_base_port)
+        WORKERS.start()
+        threading.Thread(target=WORKERS.supervise, daemon=True).start()
+        if hasattr(signal, "SIGHUP"):
+            signal.signal(signal.SIGHUP, lambda *_: threading.Thread(target=WORKERS.reload, daemon=True).start())
+        print(f"[manager] {len(WORKERS.workers)} worker(s) on port {SERVER_PORT}")
     server = HTTPServer(("127.0.0.1", MANAGER_PORT), ManagerHandler)
     server.serve_forever()
 
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""Lightweight in-process metrics: counters, gauges, histograms and per-request stage timers.
+
+Disabled with METRICS_ENABLED=0, in which case every helper is a no-op.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+
+ENABLED = os.getenv("METRICS_ENABLED", "1").strip().lower() not in ("0", "false", "no", "off")
+PREFIX = "skills_"
+
+DEFAULT_BUCKETS = (
+    0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0,
+)
+TOKEN_BUCKETS = (
+    64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768, 65536,
+)
+
+_LOCK = threading.Lock()
+_COUNTERS = {}
+_GAUGES = {}
+_HISTOGRAMS = {}
+_HELP = {}
+_LOCAL = threading.local()
+START_TIME = time.time()
+
+
+def _key(name, labels):
+    if not labels:
+        return (name, ())
+    return (name, tuple(sorted(labels.items())))
+
+
+def describe(name, text):
+    _HELP[name] = text
+
+
+def inc(name, value=1, **labels):
+    if not ENABLED:
+        return
+    key = _key(name, labels)
+    with _LOCK:
+        _COUNTERS[key] = _COUNTERS.get(key, 0) + value
+
+
+def set_gauge(name, value, **labels):
+    if not ENABLED:
+        return
+    key = _key(name, labels)
+    with _LOCK:
+        _GAUGES[key] = value
+
+
+def observe(name, value, buckets=DEFAULT_BUCKETS, **labels):
+    if not ENABLED:
+        return
+    key = _key(name, labels)
+    with _LOCK:
+        hist = _HISTOGRAMS.get(key)
+        if hist is None:
+            hist = {"buckets": buckets, "counts": [0] * len(buckets), "sum": 0.0, "count": 0}
+            _HISTOGRAMS[key] = hist
+        for i, bound in enumerate(hist["buckets"]):
+            if value <= bound:
+                hist["counts"][i] += 1
+                break
+        hist["sum"] += value
+        hist["count"] += 1
+
+
+# --- Per-request stage timing ---
+
+def begin_request():
+    if ENABLED:
+        _LOCAL.timings = []
+
+
+def end_request():
+    timings = getattr(_LOCAL, "timings", None)
+    _LOCAL.timings = None
+    return timings or []
+
+
+def current_timings():
+    return getattr(_LOCAL, "timings", None) or []
+
+
+def add_timings(timings):
+    """Append stages timed on another thread (e.g. a worker pool) to this thread's request."""
+    current = getattr(_LOCAL, "timings", None)
+    if current is not None:
+        current.extend(timings)
+
+
+def record_stage(stage, seconds):
+    if not ENABLED:
+        return
+    observe("stage_duration_seconds", seconds, stage=stage)
+    timings = getattr(_LOCAL, "timings", None)
+    if timings is not None:
+        timings.append((stage, seconds))
+
+
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+@contextmanager
+def _timed_stage(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start)
+
+
+def stage(name):
+    if not ENABLED:
+        return _NULL_STAGE
+    return _timed_stage(name)
+
+
+def timed(stage_name):
+    """Decorator form of stage(); returns the function untouched when metrics are disabled."""
+    def decorator(fn):
+        if not ENABLED:
+            return fn
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                record_stage(stage_name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def server_timing_header(timings):
+    parts = []
+    seen = {}
+    for stage_name, seconds in timings:
+        count = seen.get(stage_name, 0)
+        seen[stage_name] = count + 1
+        label = stage_name if count == 0 else f"{stage_name}-{count + 1}"
+        label = "".join(c if c.isalnum() or c in "-_" else "_" for c in label)
+        parts.append(f"{label};dur={seconds * 1000:.1f}")
+    return ", ".join(parts)
+
+
+# --- Exposition ---
+
+def _resident_memory_bytes():
+    try:
+        with open("/proc/self/statm", "r", encoding="utf-8") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE")
+    except Exception:
+        pass
+    try:
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports KiB, macOS reports bytes.
+        return rss if rss > 1 << 32 else rss * 1024
+    except Exception:
+        return None
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels, extra=None):
+    items = list(labels)
+    if extra:
+        items.append(extra)
+    if not items:
+        return ""
+    body = ",".join(f'{k}="{_escape(v)}"' for k, v in items)
+    return "{" + body + "}"
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        if value == float("inf"):
+            return "+Inf"
+        return repr(value)
+    return str(value)
+
+
+def render_prometheus():
+    with _LOCK:
+        counters = dict(_COUNTERS)
+        gauges = dict(_GAUGES)
+        histograms = {k: {"buckets": v["buckets"], "counts": list(v["counts"]),
+                          "sum": v["sum"], "count": v["count"]}
+                      for k, v in _HISTOGRAMS.items()}
+
+    gauges[("process_uptime_seconds", ())] = round(time.time() - START_TIME, 3)
+    rss = _resident_memory_bytes()
+    if rss is not None:
+        gauges[("process_resident_memory_bytes", ())] = rss
+
+    lines = []
+
+    def emit_family(kind, series, suffix=""):
+        by_name = {}
+        for (name, labels), value in series.items():
+            by_name.setdefault(name, []).append((labels, value))
+        for name in sorted(by_name):
+            full = f"{PREFIX}{name}{suffix}"
+            if name in _HELP:
+                lines.append(f"# HELP {full} {_HELP[name]}")
+            lines.append(f"# TYPE {full} {kind}")
+            for labels, value in sorted(by_name[name], key=lambda item: item[0]):
+                emit_value(full, labels, value, kind)
+
+    def emit_value(full, labels, value, kind):
+        if kind != "histogram":
+            lines.append(f"{full}{_format_labels(labels)} {_format_value(value)}")
+            return
+        cumulative = 0
+        for bound, count in zip(value["buckets"], value["counts"]):
+            cumulative += count
+            lines.append(f"{full}_bucket{_format_labels(labels, ('le', _format_value(float(bound))))} {cumulative}")
+        lines.append(f"{full}_bucket{_format_labels(labels, ('le', '+Inf'))} {value['count']}")
+        lines.append(f"{full}_sum{_format_labels(labels)} {_format_value(value['sum'])}")
+        lines.append(f"{full}_count{_format_labels(labels)} {value['count']}")
+
+    emit_family("counter", counters, "_total")
+    emit_family("gauge", gauges)
+    emit_family("histogram", histograms)
+    return "\n".join(lines) + "\n"
+
+
+def snapshot():
+    """Plain-dict view used by scripts that want numbers rather than exposition text."""
+    with _LOCK:
+        return {
+            "counters": {f"{n}{dict(l)}": v for (n, l), v in _COUNTERS.items()},
+            "gauges": {f"{n}{dict(l)}": v for (n, l), v in _GAUGES.items()},
+            "histograms": {f"{n}{dict(l)}": {"count": h["count"], "sum": h["sum"]}
+                           for (n, l), h in _HISTOGRAMS.items()},
+        }
+
+
+def reset():
+    with _LOCK:
+        _COUNTERS.clear()
+        _GAUGES.clear()
+        _HISTOGRAMS.clear()
+
+
+describe("stage_duration_seconds", "Time spent in each /chat pipeline stage.")
+describe("http_requests", "HTTP requests handled, by path and status.")
+describe("http_request_duration_seconds", "End-to-end HTTP handler latency.")
+describe("context_tokens", "Estimated prompt tokens sent per chat request.")
+describe("llm_tokens", "Provider-reported tokens by kind (prompt, completion, prompt_cache_hit, prompt_cache_miss).")
+describe("speculative_routing", "Speculative answers by outcome (hit, miss, skipped, busy) and lexical score.")
+describe("speculative_saved_seconds", "Time kept speculative answers saved versus selecting then generating, measured at completion.")
+describe("speculative_wasted_seconds", "Time spent on speculative answers that were discarded.")
+describe("cancelled_requests", "Chat requests abandoned after the client disconnected, by stage.")
+describe("single_flight", "Provider calls by role: leader (sent upstream) or shared (joined an identical in-flight call).")
+describe("provider_events", "Resilience events per backend: retry, hedge, hedge_won, failover, error, circuit_open, circuit_skip.")
+describe("provider_circuit_open", "1 while a backend's circuit breaker is open or half-open.")
+describe("model_warmup_seconds", "Time for a background Ollama warm-up request to load a model.")
+describe("admission_queue_seconds", "Time requests waited in their admission lane (control, text, image).")
+describe("admission_rejected", "Requests refused by admission control, by lane and reason (rate_limited, queue_full, deadline).")
+describe("admission_degraded", "Image requests graded as a downscaled preview because their lane was under pressure.")
+describe("admission_running", "Requests currently running per admission lane.")
+describe("admission_queued", "Requests currently waiting per admission lane.")
+describe("auto_grades", "Image requests graded locally from pixel statistics without a model call.")
+describe("response_cache", "Exact-match reply cache lookups for skills with cache_ttl, by result.")
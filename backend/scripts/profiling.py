@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""Opt-in per-request profiling for server.py (cProfile + tracemalloc).
+
+    PROFILING=1                  enable; otherwise every hook is a no-op and /debug/profiles is 404
+    PROFILE_TOKEN=secret         required: without it profiling stays off. The X-Profile header
+                                 must carry it, both to trigger a profile and to read /debug/profiles*
+    PROFILE_SAMPLE_RATE=0.01     profile this share of /chat and /analyze-image requests
+    X-Profile: <token>           request header that profiles one specific request
+    PROFILE_KEEP=20              profiles kept in the in-memory ring buffer
+    PROFILE_MEMORY=1             also record allocation top-N with tracemalloc
+
+At most one request is profiled at a time (cProfile and tracemalloc are
+process-wide tools); requests that would overlap simply run unprofiled.
+cProfile only sees the handler thread, but tracemalloc counts allocations
+from every thread during the window. Reports are built after the handler
+has written its response. Settings are applied by configure(), which
+server.init_config() calls once .env is loaded.
+"""
+import hmac
+import io
+import itertools
+import marshal
+import os
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+
+
+ENABLED = False
+SAMPLE_RATE = 0.0
+TOKEN = ""
+MEMORY = True
+TOP_FUNCTIONS = 30
+TOP_ALLOCATIONS = 15
+HEADER = "X-Profile"
+
+_BUSY = threading.Lock()
+_LOCK = threading.Lock()
+_RING = deque(maxlen=20)
+_IDS = itertools.count(1)
+_DISABLED = nullcontext()
+
+
+def configure():
+    """Read the PROFILE* settings; profiling stays off unless PROFILING=1 and PROFILE_TOKEN are both set."""
+    global ENABLED, SAMPLE_RATE, TOKEN, MEMORY, TOP_FUNCTIONS, _RING
+    TOKEN = os.getenv("PROFILE_TOKEN", "")
+    requested = os.getenv("PROFILING", "0").strip().lower() in ("1", "true", "yes", "on")
+    if requested and not TOKEN:
+        print("Warning: PROFILING=1 ignored, PROFILE_TOKEN is not set.")
+    ENABLED = requested and bool(TOKEN)
+    SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0") or 0)
+    MEMORY = os.getenv("PROFILE_MEMORY", "1").strip().lower() not in ("0", "false", "no", "off")
+    TOP_FUNCTIONS = int(os.getenv("PROFILE_TOP", "30"))
+    with _LOCK:
+        _RING = deque(_RING, maxlen=max(1, int(os.getenv("PROFILE_KEEP", "20"))))
+
+
+def authorized(header_value):
+    """True if a request carrying this X-Profile value may trigger or read profiles; never without a token."""
+    if not TOKEN or not header_value:
+        return False
+    return hmac.compare_digest(header_value.encode("utf-8"), TOKEN.encode("utf-8"))
+
+
+def trigger(header_value):
+    """Why this request should be profiled ("header" / "sampled"), or None."""
+    if header_value:
+        return "header" if authorized(header_value) else None
+    if SAMPLE_RATE > 0 and random.random() < SAMPLE_RATE:
+        return "sampled"
+    return None
+
+
+def profile_request(path, header_value=None, on_start=None):
+    """Context manager around one request; zero work unless profiling is enabled and triggered.
+
+    on_start(profile_id) is called once profiling has started, e.g. to
+    report the id in a response header.
+    """
+    if not ENABLED:
+        return _DISABLED
+    reason = trigger(header_value)
+    if reason is None:
+        return _DISABLED
+    return _profiled(path, reason, on_start)
+
+
+@contextmanager
+def _profiled(path, reason, on_start):
+    if not _BUSY.acquire(blocking=False):
+        yield None
+        return
+    import cProfile
+    import tracemalloc
+    try:
+        profile_id = next(_IDS)
+        traced_before = tracemalloc.is_tracing()
+        memory = MEMORY
+        if memory:
+            if not traced_before:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            before = tracemalloc.take_snapshot()
+        if on_start:
+            on_start(profile_id)
+        profiler = cProfile.Profile()
+        started = time.time()
+        t0 = time.perf_counter()
+        profiler.enable()
+        try:
+            yield profile_id
+        finally:
+            profiler.disable()
+            seconds = time.perf_counter() - t0
+            allocations, peak = [], None
+            if memory:
+                after = tracemalloc.take_snapshot()
+                _, peak = tracemalloc.get_traced_memory()
+                if not traced_before:
+                    tracemalloc.stop()
+                allocations = top_allocations(after, before)
+            _store({
+                "id": profile_id,
+                "path": path,
+                "reason": reason,
+                "started": started,
+                "seconds": round(seconds, 4),
+                "alloc_peak_kb": round(peak / 1024, 1) if peak is not None else None,
+                "allocations": allocations,
+                "report": function_report(profiler),
+                "pstats": marshal.dumps(stats_dict(profiler)),
+            })
+    finally:
+        _BUSY.release()
+
+
+def stats_dict(profiler):
+    profiler.create_stats()
+    return profiler.stats
+
+
+def function_report(profiler, limit=None):
+    import pstats
+    limit = TOP_FUNCTIONS if limit is None else limit
+    out = io.StringIO()
+    stats = pstats.Stats(profiler, stream=out)
+    stats.strip_dirs().sort_stats("cumulative").print_stats(limit)
+    return out.getvalue()
+
+
+def top_allocations(after, before, limit=TOP_ALLOCATIONS):
+    import tracemalloc
+    ignore = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+    diff = after.filter_traces(ignore).compare_to(before.filter_traces(ignore), "lineno")
+    return [
+        {
+            "where": f"{os.path.basename(d.traceback[0].filename)}:{d.traceback[0].lineno}",
+            "size_kb": round(d.size_diff / 1024, 1),
+            "count": d.count_diff,
+        }
+        for d in diff[:limit] if d.size_diff > 0
+    ]
+
+
+def _store(record):
+    with _LOCK:
+        _RING.append(record)
+
+
+def list_profiles():
+    with _LOCK:
+        records = list(_RING)
+    return [
+        {key: r[key] for key in ("id", "path", "reason", "started", "seconds", "alloc_peak_kb")}
+        for r in reversed(records)
+    ]
+
+
+def get_profile(profile_id):
+    with _LOCK:
+        for record in _RING:
+            if record["id"] == profile_id:
+                return record
+    return None
+
+
+def render_text(record):
+    lines = [
+        f"profile {record['id']}  {record['path']}  ({record['reason']})",
+        f"started {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(record['started']))}, "
+        f"{record['seconds'] * 1000:.1f} ms",
+    ]
+    if record["alloc_peak_kb"] is not None:
+        lines.append(f"traced memory peak {record['alloc_peak_kb']} KiB; "
+                     "largest net allocations still held when the request ended:")
+        for a in record["allocations"]:
+            lines.append(f"  {a['size_kb']:>10} KiB  {a['count']:>7}  {a['where']}")
+    lines.append("")
+    lines.append(record["report"])
+    return "\n".join(lines)
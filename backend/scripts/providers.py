@@ -0,0 +1,502 @@
+#!/usr/bin/env python3
+"""Cancellable HTTP transport for the LLM provider calls.
+
+urllib blocks until the read timeout with no way to abort from another
+thread. Here every call runs on an explicit http.client connection whose
+socket is shut down as soon as the caller's CancelToken fires.
+
+ResilientClient layers retries, hedging, ordered failover and per-backend
+circuit breakers over those calls.
+"""
+import hashlib
+import http.client
+import json
+import os
+import queue
+import random
+import socket
+import threading
+import time
+import urllib.parse
+from collections import OrderedDict, deque
+
+
+class RequestCancelled(Exception):
+    def __init__(self, stage="provider"):
+        super().__init__(f"request cancelled during {stage}")
+        self.stage = stage
+
+
+class ProviderError(Exception):
+    def __init__(self, status, body="", retry_after=None):
+        super().__init__(f"HTTP {status}: {body[:200]}")
+        self.status = status
+        self.body = body
+        self.retry_after = retry_after
+
+
+class ProviderUnavailable(ProviderError):
+    """Every backend in the failover chain failed or has its circuit open."""
+
+    def __init__(self, detail=""):
+        super().__init__(503, detail or "no provider available")
+
+
+class CancelToken:
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self.reason = None
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def cancel(self, reason="cancelled"):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.reason = reason
+            self._event.set()
+            callbacks = list(self._callbacks)
+            self._callbacks.clear()
+        for fn in callbacks:
+            try:
+                fn()
+            except Exception:
+                pass
+
+    def add_callback(self, fn):
+        """Run fn on cancel (immediately if already cancelled); returns a remover."""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(fn)
+
+                def remove():
+                    with self._lock:
+                        if fn in self._callbacks:
+                            self._callbacks.remove(fn)
+                return remove
+        fn()
+        return lambda: None
+
+    def raise_if_cancelled(self, stage="provider"):
+        if self._event.is_set():
+            raise RequestCancelled(stage)
+
+    def wait(self, timeout=None):
+        return self._event.wait(timeout)
+
+    def child(self):
+        """A token cancelled with this one but cancellable on its own; returns (token, unlink)."""
+        token = CancelToken()
+        return token, self.add_callback(lambda: token.cancel(self.reason))
+
+
+def _open_connection(url, timeout):
+    parts = urllib.parse.urlsplit(url)
+    if parts.scheme == "https":
+        conn = http.client.HTTPSConnection(parts.hostname, parts.port, timeout=timeout)
+    else:
+        conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=timeout)
+    path = parts.path or "/"
+    if parts.query:
+        path = f"{path}?{parts.query}"
+    return conn, path
+
+
+def _abort(conn):
+    sock = conn.sock
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+    conn.close()
+
+
+def _retry_after(value):
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def post_json(url, payload, headers=None, timeout=300, cancel=None, connect_timeout=None):
+    """POST JSON and decode the reply; `timeout` bounds each socket read, `connect_timeout` the connect."""
+    if cancel is not None:
+        cancel.raise_if_cancelled()
+    conn, path = _open_connection(url, connect_timeout or timeout)
+    remove = cancel.add_callback(lambda: _abort(conn)) if cancel is not None else None
+    try:
+        body = json.dumps(payload).encode("utf-8")
+        all_headers = {"Content-Type": "application/json"}
+        all_headers.update(headers or {})
+        conn.connect()
+        # A cancel that fired while connecting found no socket to abort.
+        if cancel is not None and cancel.cancelled:
+            raise RequestCancelled()
+        conn.sock.settimeout(timeout)
+        conn.request("POST", path, body=body, headers=all_headers)
+        resp = conn.getresponse()
+        data = resp.read().decode("utf-8")
+        if resp.status >= 400:
+            raise ProviderError(resp.status, data, _retry_after(resp.getheader("Retry-After")))
+        return json.loads(data)
+    except Exception:
+        if cancel is not None and cancel.cancelled:
+            raise RequestCancelled()
+        raise
+    finally:
+        if remove is not None:
+            remove()
+        conn.close()
+
+
+# --- Coalescing and caching ---
+
+def payload_key(payload):
+    """Canonical hash of a request payload (model, messages and options)."""
+    canonical = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class _Flight:
+    def __init__(self):
+        self.done = False
+        self.result = None
+        self.error = None
+        self.waiters = []
+        self.cancel = CancelToken()
+
+
+class SingleFlight:
+    """Coalesce identical in-flight calls onto one upstream request.
+
+    The shared call runs on its own thread with its own CancelToken, which is
+    only cancelled once every waiter has gone away; one client disconnecting
+    never aborts a response other clients are still waiting for.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    def do(self, key, fn, cancel=None):
+        """Return (result, shared); fn(cancel_token) performs the real call."""
+        wake = threading.Event()
+        with self._lock:
+            flight = self._flights.get(key)
+            shared = flight is not None
+            if not shared:
+                flight = _Flight()
+                self._flights[key] = flight
+                threading.Thread(target=self._run, args=(key, flight, fn), daemon=True).start()
+            flight.waiters.append(wake)
+
+        remove = cancel.add_callback(wake.set) if cancel is not None else None
+        try:
+            wake.wait()
+        finally:
+            if remove is not None:
+                remove()
+
+        with self._lock:
+            if not flight.done:
+                flight.waiters.remove(wake)
+                if not flight.waiters:
+                    flight.cancel.cancel("all waiters cancelled")
+                    if self._flights.get(key) is flight:
+                        del self._flights[key]
+                raise RequestCancelled()
+        if flight.error is not None:
+            raise flight.error
+        return flight.result, shared
+
+    def _run(self, key, flight, fn):
+        try:
+            flight.result = fn(flight.cancel)
+        except BaseException as exc:
+            flight.error = exc
+        with self._lock:
+            flight.done = True
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            waiters = list(flight.waiters)
+        for wake in waiters:
+            wake.set()
+
+
+class ResponseCache:
+    """Small LRU of exact-match responses with per-entry TTL."""
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value, ttl):
+        if self.max_entries <= 0 or ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+# --- Retries, hedging, failover ---
+
+def is_retryable(exc):
+    """Connection failures, timeouts, 429 and 5xx are worth another attempt."""
+    if isinstance(exc, RequestCancelled):
+        return False
+    if isinstance(exc, ProviderError):
+        return exc.status == 429 or exc.status >= 500
+    return isinstance(exc, (OSError, http.client.HTTPException))
+
+
+def backoff_delay(attempt, base, cap, exc=None):
+    """Full-jitter exponential backoff, never shorter than a server's Retry-After."""
+    delay = random.uniform(0, min(cap, base * (2 ** attempt)))
+    retry_after = getattr(exc, "retry_after", None)
+    if retry_after is not None:
+        delay = max(delay, min(cap, retry_after))
+    return delay
+
+
+class CircuitBreaker:
+    """closed -> open after `threshold` consecutive failures; one probe is let through after `reset_timeout`."""
+
+    def __init__(self, threshold=5, reset_timeout=30.0):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self):
+        if self.threshold <= 0:
+            return True
+        with self._lock:
+            state = self._state()
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def release(self):
+        """An attempt ended without a verdict (caller cancelled); free the half-open probe slot."""
+        with self._lock:
+            self._probing = False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        """Returns True when this failure opened (or re-opened) the circuit."""
+        with self._lock:
+            self._failures += 1
+            reopen = self._probing
+            self._probing = False
+            if reopen or (self._opened_at is None and self.threshold > 0 and self._failures >= self.threshold):
+                self._opened_at = time.monotonic()
+                return True
+            return False
+
+
+_BREAKERS = {}
+_BREAKERS_LOCK = threading.Lock()
+
+
+def get_breaker(name, threshold=5, reset_timeout=30.0):
+    """Breakers are shared per backend so every call tier sees the same health."""
+    with _BREAKERS_LOCK:
+        breaker = _BREAKERS.get(name)
+        if breaker is None:
+            breaker = _BREAKERS[name] = CircuitBreaker(threshold, reset_timeout)
+        return breaker
+
+
+def breaker_states():
+    with _BREAKERS_LOCK:
+        return {name: b.state for name, b in _BREAKERS.items()}
+
+
+class LatencyWindow:
+    def __init__(self, size=200):
+        self._lock = threading.Lock()
+        self._samples = deque(maxlen=size)
+
+    def add(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, pct, min_samples=1):
+        with self._lock:
+            if len(self._samples) < max(1, min_samples):
+                return None
+            ordered = sorted(self._samples)
+        index = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered))) - 1))
+        return ordered[index]
+
+
+def resilience_settings():
+    """LLM_* knobs for ResilientClient, read when a call tier is built (after .env is loaded)."""
+    return {
+        "retries": int(os.getenv("LLM_RETRIES", "2")),
+        "backoff_base": float(os.getenv("LLM_RETRY_BASE", "0.5")),
+        "backoff_max": float(os.getenv("LLM_RETRY_MAX", "8")),
+        "hedge_percentile": float(os.getenv("LLM_HEDGE_PERCENTILE", "0")),
+        "hedge_min_samples": int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20")),
+        "breaker_threshold": int(os.getenv("LLM_CIRCUIT_FAILURES", "5")),
+        "breaker_reset": float(os.getenv("LLM_CIRCUIT_RESET", "30")),
+    }
+
+
+class ResilientClient:
+    """Ordered failover over `backends`, a list of (name, fn(payload, cancel)).
+
+    Each backend gets up to `retries` extra attempts with jittered backoff on
+    retryable errors. With hedge_percentile set, an attempt still running
+    after that latency percentile is duplicated and the first success wins.
+    `observer(event, backend)` is told about retry, hedge, hedge_won,
+    circuit_open, circuit_skip, failover and error events.
+    """
+
+    def __init__(self, backends, retries=2, backoff_base=0.5, backoff_max=8.0,
+                 hedge_percentile=0.0, hedge_min_samples=20,
+                 breaker_threshold=5, breaker_reset=30.0, observer=None):
+        self.backends = [
+            (name, fn, get_breaker(name, breaker_threshold, breaker_reset), LatencyWindow())
+            for name, fn in backends
+        ]
+        self.retries = max(0, retries)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.observer = observer or (lambda event, backend: None)
+
+    def call(self, payload, cancel=None):
+        last_error = None
+        for position, (name, fn, breaker, latency) in enumerate(self.backends):
+            if position:
+                self.observer("failover", name)
+            for attempt in range(self.retries + 1):
+                if cancel is not None:
+                    cancel.raise_if_cancelled()
+                if not breaker.allow():
+                    self.observer("circuit_skip", name)
+                    break
+                started = time.monotonic()
+                try:
+                    result = self._attempt(name, fn, latency, payload, cancel)
+                except RequestCancelled:
+                    breaker.release()
+                    raise
+                except Exception as exc:
+                    last_error = exc
+                    self.observer("error", name)
+                    if not is_retryable(exc):
+                        # A 4xx answer means the backend is up; anything else gives no verdict.
+                        if isinstance(exc, ProviderError):
+                            breaker.record_success()
+                        else:
+                            breaker.release()
+                        break
+                    if breaker.record_failure():
+                        self.observer("circuit_open", name)
+                    if attempt < self.retries:
+                        self.observer("retry", name)
+                        self._sleep(backoff_delay(attempt, self.backoff_base, self.backoff_max, exc), cancel)
+                    continue
+                breaker.record_success()
+                latency.add(time.monotonic() - started)
+                return result
+        if last_error is None:
+            raise ProviderUnavailable("all provider circuits are open")
+        raise last_error
+
+    def _sleep(self, delay, cancel):
+        if cancel is None:
+            time.sleep(delay)
+        elif cancel.wait(delay):
+            raise RequestCancelled()
+
+    def _attempt(self, name, fn, latency, payload, cancel):
+        hedge_after = None
+        if self.hedge_percentile > 0:
+            hedge_after = latency.percentile(self.hedge_percentile, self.hedge_min_samples)
+        if hedge_after is None:
+            return fn(payload, cancel)
+
+        results = queue.Queue()
+        tokens = []
+
+        def launch(hedge):
+            token, unlink = cancel.child() if cancel is not None else (CancelToken(), lambda: None)
+            tokens.append((token, unlink))
+
+            def run():
+                try:
+                    results.put((hedge, True, fn(payload, token)))
+                except BaseException as exc:
+                    results.put((hedge, False, exc))
+            threading.Thread(target=run, daemon=True).start()
+
+        launch(False)
+        pending = 1
+        try:
+            try:
+                outcome = results.get(timeout=hedge_after)
+            except queue.Empty:
+                self.observer("hedge", name)
+                launch(True)
+                pending += 1
+                outcome = results.get()
+            while True:
+                pending -= 1
+                hedge, ok, value = outcome
+                if ok:
+                    if hedge:
+                        self.observer("hedge_won", name)
+                    return value
+                if not pending:
+                    raise value
+                outcome = results.get()
+        finally:
+            for token, unlink in tokens:
+                unlink()
+                token.cancel("hedge settled")
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""Section-level BM25 retrieval over a skill's reference/ folder.
+
+Reference files are split at markdown headings and indexed into
+`<skill>/.reference_index.json`. The index is refreshed incrementally: only
+files whose size, mtime or content hash changed are re-chunked.
+
+    python3 backend/scripts/reference_index.py build            # every skill
+    python3 backend/scripts/reference_index.py build skills/color-grading
+    python3 backend/scripts/reference_index.py search skills/color-grading "电影感怎么调"
+"""
+import hashlib
+import json
+import math
+import os
+import sys
+import threading
+from collections import Counter
+
+from context_packer import estimate_tokens, split_sections, tokenize
+
+
+INDEX_NAME = ".reference_index.json"
+INDEX_VERSION = 1
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+_CACHE = {}
+_CACHE_LOCK = threading.Lock()
+
+
+def _reference_files(skill_dir):
+    reference_dir = os.path.join(skill_dir, "reference")
+    if not os.path.isdir(reference_dir):
+        return []
+    files = []
+    for name in sorted(os.listdir(reference_dir)):
+        path = os.path.join(reference_dir, name)
+        if os.path.isfile(path) and not name.startswith("."):
+            st = os.stat(path)
+            files.append((f"reference/{name}", path, st.st_mtime_ns, st.st_size))
+    return files
+
+
+def _chunk_file(name, text):
+    chunks = []
+    for title, body in split_sections(text):
+        tf = Counter(tokenize(body))
+        chunks.append({
+            "name": name,
+            "title": title,
+            "text": body,
+            "tokens": estimate_tokens(body),
+            "length": sum(tf.values()),
+            "tf": dict(tf),
+        })
+    return chunks
+
+
+def _load_index_file(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if data.get("version") != INDEX_VERSION:
+        return None
+    return data
+
+
+def _write_index_file(path, data):
+    tmp = f"{path}.tmp{os.getpid()}"
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp, path)
+    except OSError:
+        # Read-only checkouts still work; the index just lives in memory.
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+
+
+def _finalize(data):
+    """Derive document frequencies and ordering used at query time."""
+    chunks = []
+    for name in sorted(data["files"]):
+        chunks.extend(data["files"][name]["chunks"])
+    df = Counter()
+    for order, chunk in enumerate(chunks):
+        chunk["order"] = order
+        df.update(chunk["tf"].keys())
+    total = sum(c["length"] for c in chunks)
+    return {
+        "chunks": chunks,
+        "df": df,
+        "avgdl": (total / len(chunks)) if chunks else 0.0,
+    }
+
+
+def update_index(skill_dir, force=False):
+    """Bring the on-disk index up to date; returns (index, changed_file_count)."""
+    index_path = os.path.join(skill_dir, INDEX_NAME)
+    data = None if force else _load_index_file(index_path)
+    if data is None:
+        data = {"version": INDEX_VERSION, "files": {}}
+
+    changed = 0
+    current = _reference_files(skill_dir)
+    seen = set()
+    for name, path, mtime_ns, size in current:
+        seen.add(name)
+        entry = data["files"].get(name)
+        if entry and entry["mtime_ns"] == mtime_ns and entry["size"] == size:
+            continue
+        with open(path, "rb") as f:
+            raw = f.read()
+        digest = hashlib.sha1(raw).hexdigest()
+        if entry and entry["sha1"] == digest:
+            entry["mtime_ns"] = mtime_ns
+            entry["size"] = size
+            changed += 1
+            continue
+        data["files"][name] = {
+            "mtime_ns": mtime_ns,
+            "size": size,
+            "sha1": digest,
+            "chunks": _chunk_file(name, raw.decode("utf-8").strip()),
+        }
+        changed += 1
+    for name in list(data["files"]):
+        if name not in seen:
+            del data["files"][name]
+            changed += 1
+
+    if current and (changed or not os.path.exists(index_path)):
+        _write_index_file(index_path, data)
+    elif not current and os.path.exists(index_path):
+        try:
+            os.remove(index_path)
+        except OSError:
+            pass
+    return _finalize(data), changed
+
+
+def _signature(skill_dir):
+    return tuple((name, mtime_ns, size) for name, _, mtime_ns, size in _reference_files(skill_dir))
+
+
+def get_index(skill_dir):
+    """In-memory index for skill_dir, refreshed when any reference file changes."""
+    signature = _signature(skill_dir)
+    with _CACHE_LOCK:
+        cached = _CACHE.get(skill_dir)
+        if cached and cached[0] == signature:
+            return cached[1]
+    index, _ = update_index(skill_dir)
+    with _CACHE_LOCK:
+        _CACHE[skill_dir] = (signature, index)
+    return index
+
+
+def bm25_scores(index, query):
+    terms = set(tokenize(query))
+    n = len(index["chunks"])
+    scores = []
+    for chunk in index["chunks"]:
+        score = 0.0
+        dl = chunk["length"] or 1
+        for term in terms:
+            tf = chunk["tf"].get(term)
+            if not tf:
+                continue
+            df = index["df"].get(term, 0)
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * dl / (index["avgdl"] or 1))
+            score += idf * tf * (BM25_K1 + 1) / norm
+        scores.append(score)
+    return scores
+
+
+def top_k():
+    """REFERENCE_TOP_K, read per call so a value loaded from .env applies."""
+    return int(os.getenv("REFERENCE_TOP_K", "4"))
+
+
+def search(skill_dir, query, k=None):
+    """Top-k reference sections that share a term with query, best first, in context_packer's section format.
+
+    Sections scoring 0 are never returned: a message unrelated to the
+    references gets none rather than k arbitrary ones.
+    """
+    k = top_k() if k is None else k
+    index = get_index(skill_dir)
+    scored = []
+    for chunk, score in zip(index["chunks"], bm25_scores(index, query)):
+        if score <= 0:
+            continue
+        scored.append({
+            "name": chunk["name"],
+            "title": chunk["title"],
+            "text": chunk["text"],
+            "tokens": chunk["tokens"],
+            "order": chunk["order"],
+            "score": round(score, 4),
+        })
+    scored.sort(key=lambda s: (-s["score"], s["order"]))
+    return scored[:k] if k > 0 else scored
+
+
+def _skill_dirs(paths):
+    if paths:
+        return [os.path.abspath(p) for p in paths]
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    skills_root = os.path.abspath(os.path.join(script_dir, "..", "..", "skills"))
+    if not os.path.isdir(skills_root):
+        return []
+    return [os.path.join(skills_root, name) for name in sorted(os.listdir(skills_root))
+            if os.path.isdir(os.path.join(skills_root, name, "reference"))]
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in ("build", "rebuild", "search"):
+        print("用法:")
+        print("  python3 backend/scripts/reference_index.py build [skill_dir ...]")
+        print("  python3 backend/scripts/reference_index.py rebuild [skill_dir ...]")
+        print("  python3 backend/scripts/reference_index.py search <skill_dir> \"查询\" [k]")
+        sys.exit(1)
+    if sys.argv[1] == "search":
+        if len(sys.argv) < 4:
+            print("用法: python3 backend/scripts/reference_index.py search <skill_dir> \"查询\" [k]")
+            sys.exit(1)
+        k = int(sys.argv[4]) if len(sys.argv) > 4 else top_k()
+        for hit in search(os.path.abspath(sys.argv[2]), sys.argv[3], k):
+            print(f"{hit['score']:>7.3f}  {hit['name']} § {hit['title']}  (~{hit['tokens']} tokens)")
+        return
+    force = sys.argv[1] == "rebuild"
+    for skill_dir in _skill_dirs(sys.argv[2:]):
+        index, changed = update_index(skill_dir, force=force)
+        print(f"{os.path.basename(skill_dir)}: {len(index['chunks'])} 段，更新 {changed} 个文件")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,26 @@
 #!/usr/bin/env python3
+import argparse
 import json
 import os
+import queue
+import random
 import re
 import sys
+import threading
+import time
+import urllib.error
 import urllib.request
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from context_packer import estimate_tokens, pack_context, trim_history
+import reference_index
 
 
 # --- Paths ---
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 PROJECT_ROOT = os.path.abspath(os.path.join(SCRIPT_DIR, "..", ".."))
 SKILLS_DIR = os.path.join(PROJECT_ROOT, "skills")
+HISTORY_MAX_MESSAGES = int(os.getenv("HISTORY_MAX_MESSAGES", "40"))
 
 
 def read_text(path):
@@ -17,18 +28,6 @@ def read_text(path):
         return f.read().strip()
 
 
-def collect_reference_files(skill_dir):
-    reference_dir = os.path.join(skill_dir, "reference")
-    if not os.path.isdir(reference_dir):
-        return []
-    files = []
-    for name in sorted(os.listdir(reference_dir)):
-        path = os.path.join(reference_dir, name)
-        if os.path.isfile(path):
-            files.append((f"reference/{name}", read_text(path)))
-    return files
-
-
 def parse_skill_file(skill_path):
     lines = read_text(skill_path).splitlines()
     meta = {}
@@ -110,6 +109,9 @@ def choose_skill_auto(skills, user_text):
 
 
 def request_chat_ollama(host, payload):
+    keep_alive = os.getenv("OLLAMA_KEEP_ALIVE", "30m").strip()
+    if keep_alive and "keep_alive" not in payload:
+        payload = dict(payload, keep_alive=keep_alive)
     req = urllib.request.Request(
         f"{host}/api/chat",
         data=json.dumps(payload).encode("utf-8"),
@@ -183,82 +185,485 @@ def load_ollama_options():
         return {}
 
 
-def chat_loop(request_fn, model, system_prompt, options, assistant_label):
-    print("进入连续对话模式，输入 /exit 退出。")
+# --- Streaming chat loops ---
+
+def stream_chat_ollama(host, payload):
+    """Yield reply text pieces from Ollama's NDJSON stream."""
+    payload = dict(payload, stream=True)
+    keep_alive = os.getenv("OLLAMA_KEEP_ALIVE", "30m").strip()
+    if keep_alive and "keep_alive" not in payload:
+        payload["keep_alive"] = keep_alive
+    req = urllib.request.Request(
+        f"{host}/api/chat",
+        data=json.dumps(payload).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+        method="POST",
+    )
+    with urllib.request.urlopen(req, timeout=300) as resp:
+        for raw in resp:
+            line = raw.decode("utf-8").strip()
+            if not line:
+                continue
+            data = json.loads(line)
+            piece = data.get("message", {}).get("content", "")
+            if piece:
+                yield piece
+            if data.get("done"):
+                break
+
+
+def stream_chat_deepseek(base_url, api_key, payload):
+    """Yield reply text pieces from DeepSeek's server-sent events."""
+    req = urllib.request.Request(
+        f"{base_url}/chat/completions",
+        data=json.dumps(dict(payload, stream=True)).encode("utf-8"),
+        headers={
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {api_key}",
+        },
+        method="POST",
+    )
+    with urllib.request.urlopen(req, timeout=300) as resp:
+        for raw in resp:
+            line = raw.decode("utf-8").strip()
+            if not line.startswith("data:"):
+                continue
+            data = line[5:].strip()
+            if data == "[DONE]":
+                break
+            choices = json.loads(data).get("choices") or []
+            piece = (choices[0].get("delta") or {}).get("content") if choices else None
+            if piece:
+                yield piece
+
+
+class SkillStore:
+    """Parsed SKILL.md system prompts, reused across turns until the file changes."""
+
+    def __init__(self):
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def system_prompt(self, skill):
+        path = skill["file"]
+        mtime = os.stat(path).st_mtime_ns
+        with self._lock:
+            cached = self._cache.get(path)
+            if cached and cached[0] == mtime:
+                return cached[1]
+        prompt = build_system_prompt(read_text(path), [])
+        with self._lock:
+            self._cache[path] = (mtime, prompt)
+        return prompt
+
+
+class StreamRenderer:
+    """Writes to the terminal from its own thread so network reads never wait on the tty."""
+
+    def __init__(self, out=None):
+        self.out = out or sys.stdout
+        self._queue = queue.Queue()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if isinstance(item, threading.Event):
+                item.set()
+                continue
+            self.out.write(item)
+            self.out.flush()
+
+    def write(self, text):
+        self._queue.put(text)
+
+    def drain(self):
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait()
+
+
+def stream_reply(request_fn, stream_fn, payload, renderer, assistant_label):
+    """Render the reply as it arrives; falls back to a blocking call if streaming fails before any text."""
+    started = time.monotonic()
+    first = None
+    parts = []
+    renderer.write(f"\n{assistant_label}> ")
+    try:
+        if stream_fn is None:
+            raise RuntimeError("streaming disabled")
+        for piece in stream_fn(payload):
+            if first is None:
+                first = time.monotonic() - started
+            parts.append(piece)
+            renderer.write(piece)
+    except Exception:
+        if parts:
+            raise
+        reply = request_fn(payload) or ""
+        first = time.monotonic() - started
+        parts = [reply]
+        renderer.write(reply)
+    total = time.monotonic() - started
+    renderer.write(f"\n[耗时] 首字 {first or total:.2f}s / 总计 {total:.2f}s\n\n")
+    return "".join(parts)
+
+
+def run_chat_turn(ctx, chosen, user_text, history, echo):
+    """Pack and stream one turn; returns the updated history."""
+    renderer = ctx["renderer"]
+    if echo:
+        renderer.write(f"你> {user_text}\n")
+    if ctx["announce"] and chosen:
+        renderer.write(f"[CHAT-AUTO] 使用技能：{chosen['name']}\n")
+    if chosen:
+        system_prompt = ctx["store"].system_prompt(chosen)
+        sections = reference_index.search(chosen["dir"], user_text)
+    else:
+        system_prompt = "你是一个助手。回答要清晰、分步骤。"
+        sections = []
+    messages, ctx_stats = pack_context(system_prompt, history, user_text, sections=sections)
+    renderer.write(f"[上下文] 约 {ctx_stats['tokens']} tokens\n")
+
+    payload = {
+        "model": ctx["model"],
+        "stream": False,
+        "messages": messages,
+        **ctx["options"],
+    }
+    try:
+        reply = stream_reply(ctx["request_fn"], ctx["stream_fn"], payload, renderer, ctx["label"])
+    except Exception as exc:
+        renderer.write(f"\n请求失败: {exc}\n")
+        return history
+    history = history + [
+        {"role": "user", "content": user_text},
+        {"role": "assistant", "content": reply},
+    ]
+    return trim_history(history, HISTORY_MAX_MESSAGES)
+
+
+def run_chat(ctx, pick_skill):
+    """Interactive loop shared by --chat-skill and --chat-auto.
+
+    Turn N streams on a worker thread while turn N+1's input is read and its
+    skill selected, so with piped input selection overlaps rendering. On a
+    terminal the prompt waits for the previous reply to finish printing.
+    """
+    interactive = sys.stdin.isatty()
+    renderer = ctx["renderer"]
+    pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="chat")
     history = []
-    while True:
-        try:
-            user_text = input("你> ").strip()
-        except EOFError:
-            break
-        if not user_text:
-            continue
-        if user_text.lower() in ("/exit", "exit", "quit", "/quit"):
-            break
-
-        messages = [{"role": "system", "content": system_prompt}]
-        messages.extend(history)
-        messages.append({"role": "user", "content": user_text})
-
-        payload = {
-            "model": model,
-            "stream": False,
-            "messages": messages,
-            **options,
-        }
-        try:
-            reply = request_fn(payload) or ""
-        except Exception as exc:
-            print("请求失败:", exc)
-            continue
-        print(f"\n{assistant_label}> {reply}\n")
-        history.append({"role": "user", "content": user_text})
-        history.append({"role": "assistant", "content": reply})
-        history = history[-6:]
+    previous = None
+    try:
+        while True:
+            if interactive:
+                if previous is not None:
+                    history = previous.result()
+                    previous = None
+                renderer.drain()
+                try:
+                    user_text = input("你> ").strip()
+                except EOFError:
+                    break
+            else:
+                line = sys.stdin.readline()
+                if not line:
+                    break
+                user_text = line.strip()
+            if not user_text:
+                continue
+            if user_text.lower() in ("/exit", "exit", "quit", "/quit"):
+                break
 
+            try:
+                chosen = pick_skill(user_text)
+            except Exception as exc:
+                renderer.write(f"选择技能失败: {exc}\n")
+                chosen = None
+            if previous is not None:
+                history = previous.result()
+            previous = pool.submit(run_chat_turn, ctx, chosen, user_text, history, not interactive)
+        if previous is not None:
+            previous.result()
+    finally:
+        pool.shutdown(wait=True)
+        renderer.drain()
+
+
+def make_chat_context(request_fn, stream_fn, model, options, assistant_label, announce):
+    return {
+        "request_fn": request_fn,
+        "stream_fn": stream_fn,
+        "model": model,
+        "options": options,
+        "label": assistant_label,
+        "announce": announce,
+        "store": SkillStore(),
+        "renderer": StreamRenderer(),
+    }
+
+
+def chat_loop(request_fn, stream_fn, model, skill, options, assistant_label):
+    print("进入连续对话模式，输入 /exit 退出。")
+    ctx = make_chat_context(request_fn, stream_fn, model, options, assistant_label, announce=False)
+    run_chat(ctx, lambda user_text: skill)
 
-def chat_auto_loop(request_fn, model, skills, options, assistant_label):
+
+def chat_auto_loop(request_fn, stream_fn, model, skills, options, assistant_label):
     print("进入连续对话模式（自动选技能），输入 /exit 退出。")
-    history = []
-    base_prompt = "你是一个助手。回答要清晰、分步骤。"
-    while True:
+    ctx = make_chat_context(request_fn, stream_fn, model, options, assistant_label, announce=True)
+    run_chat(ctx, lambda user_text: choose_skill_by_model(request_fn, model, skills, user_text))
+
+
+# --- Batch mode ---
+
+class RateLimiter:
+    """Token buckets for requests per second and tokens per minute; acquire() blocks."""
+
+    def __init__(self, rps=0.0, tpm=0.0):
+        self.rps = rps
+        self.tpm = tpm
+        self.request_capacity = max(1.0, rps)
+        # Allow bursts of ten seconds' worth of tokens.
+        self.token_capacity = tpm / 6.0
+        self._requests = self.request_capacity
+        self._tokens = self.token_capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._last
+        self._last = now
+        if self.rps:
+            self._requests = min(self.request_capacity, self._requests + elapsed * self.rps)
+        if self.tpm:
+            self._tokens = min(self.token_capacity, self._tokens + elapsed * self.tpm / 60.0)
+
+    def acquire(self, tokens=0):
+        tokens = min(tokens, self.token_capacity) if self.tpm else 0
+        while True:
+            with self._lock:
+                self._refill()
+                request_wait = (1 - self._requests) / self.rps if self.rps and self._requests < 1 else 0.0
+                token_wait = (tokens - self._tokens) / (self.tpm / 60.0) if self.tpm and self._tokens < tokens else 0.0
+                if request_wait <= 0 and token_wait <= 0:
+                    if self.rps:
+                        self._requests -= 1
+                    if self.tpm:
+                        self._tokens -= tokens
+                    return
+            time.sleep(max(request_wait, token_wait))
+
+    def charge(self, tokens):
+        """Account for output tokens once known; the bucket may go negative."""
+        if self.tpm:
+            with self._lock:
+                self._tokens -= tokens
+
+
+def is_retryable(exc):
+    if isinstance(exc, urllib.error.HTTPError):
+        return exc.code == 429 or exc.code >= 500
+    return isinstance(exc, OSError)
+
+
+def call_with_retry(request_fn, payload, retries):
+    for attempt in range(retries + 1):
         try:
-            user_text = input("你> ").strip()
-        except EOFError:
-            break
-        if not user_text:
-            continue
-        if user_text.lower() in ("/exit", "exit", "quit", "/quit"):
-            break
+            return request_fn(payload) or ""
+        except Exception as exc:
+            if attempt >= retries or not is_retryable(exc):
+                raise
+            time.sleep(random.uniform(0, min(8.0, 0.5 * (2 ** attempt))))
 
-        chosen = choose_skill_by_model(request_fn, model, skills, user_text)
+
+def read_batch_records(path):
+    """Yield (index, record) from a JSONL file; a bare string line is taken as the text."""
+    with open(path, "r", encoding="utf-8") as f:
+        for index, line in enumerate(f):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                record = {"text": line}
+            if not isinstance(record, dict):
+                record = {"text": str(record)}
+            yield index, record
+
+
+def load_checkpoint(path):
+    done = set()
+    if path and os.path.isfile(path):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip().isdigit():
+                    done.add(int(line))
+    return done
+
+
+class BatchContext:
+    def __init__(self, request_fn, model, options, skills, select, limiter, retries):
+        self.request_fn = request_fn
+        self.model = model
+        self.options = options
+        self.skills = skills
+        self.skills_by_name = {s["name"]: s for s in skills}
+        self.select = select
+        self.limiter = limiter
+        self.retries = retries
+        self._skill_text = {}
+        self._lock = threading.Lock()
+
+    def skill_text(self, skill):
+        with self._lock:
+            if skill["file"] not in self._skill_text:
+                self._skill_text[skill["file"]] = read_text(skill["file"])
+            return self._skill_text[skill["file"]]
+
+    def limited_call(self, payload):
+        prompt_tokens = sum(estimate_tokens(m.get("content", "")) for m in payload["messages"])
+        self.limiter.acquire(prompt_tokens)
+        reply = call_with_retry(self.request_fn, payload, self.retries)
+        self.limiter.charge(estimate_tokens(reply))
+        return reply
+
+    def choose(self, record, text):
+        if record.get("skill"):
+            return self.skills_by_name.get(record["skill"])
+        if self.select == "lexical":
+            return choose_skill_auto(self.skills, text)
+        if self.select == "model":
+            return choose_skill_by_model(self.limited_call, self.model, self.skills, text)
+        return None
+
+
+def run_batch_record(ctx, index, record):
+    started = time.monotonic()
+    text = str(record.get("text") or record.get("input") or "")
+    result = {"index": index, "id": record.get("id", index), "skill": None}
+    try:
+        chosen = ctx.choose(record, text)
         if chosen:
-            print(f"[CHAT-AUTO] 使用技能：{chosen['name']}")
-            skill_text = read_text(chosen["file"])
-            references = collect_reference_files(chosen["dir"])
-            system_prompt = build_system_prompt(skill_text, references)
+            result["skill"] = chosen["name"]
+            sections = reference_index.search(chosen["dir"], text)
+            system_prompt = build_system_prompt(ctx.skill_text(chosen), [])
         else:
-            system_prompt = base_prompt
-
-        messages = [{"role": "system", "content": system_prompt}]
-        messages.extend(history)
-        messages.append({"role": "user", "content": user_text})
-
-        payload = {
-            "model": model,
-            "stream": False,
-            "messages": messages,
-            **options,
-        }
-        try:
-            reply = request_fn(payload) or ""
-        except Exception as exc:
-            print("请求失败:", exc)
-            continue
-        print(f"\n{assistant_label}> {reply}\n")
-        history.append({"role": "user", "content": user_text})
-        history.append({"role": "assistant", "content": reply})
-        history = history[-6:]
+            sections = []
+            system_prompt = "你是一个助手。回答要清晰、分步骤。"
+        messages, ctx_stats = pack_context(system_prompt, [], text, sections=sections)
+        payload = {"model": ctx.model, "stream": False, "messages": messages, **ctx.options}
+        result["output"] = ctx.limited_call(payload)
+        result["context_tokens"] = ctx_stats["tokens"]
+    except Exception as exc:
+        result["error"] = str(exc)
+    result["latency_ms"] = round((time.monotonic() - started) * 1000, 1)
+    return result
+
+
+def run_batch(argv, request_fn, model, options, skills_root):
+    parser = argparse.ArgumentParser(prog="run_skill.py --batch", description="批量处理 JSONL 输入")
+    parser.add_argument("input", help="每行一个 JSON：{\"id\", \"text\", \"skill\"(可选)}")
+    parser.add_argument("--output", default="", help="结果 JSONL，默认输出到标准输出")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--select", choices=["lexical", "model", "none"], default="lexical",
+                        help="记录未指定 skill 时的选技能方式")
+    parser.add_argument("--rps", type=float, default=0.0, help="每秒请求数上限，0 为不限")
+    parser.add_argument("--tpm", type=float, default=0.0, help="每分钟 token 上限（估算），0 为不限")
+    parser.add_argument("--retries", type=int, default=2)
+    parser.add_argument("--checkpoint", default="", help="记录已完成序号，重跑时跳过")
+    parser.add_argument("--ordered", action="store_true", help="按输入顺序写出（默认按完成顺序）")
+    args = parser.parse_args(argv)
+
+    skills = list_skills(skills_root)
+    ctx = BatchContext(request_fn, model, options, skills, args.select,
+                       RateLimiter(args.rps, args.tpm), args.retries)
+    done = load_checkpoint(args.checkpoint)
+    out = open(args.output, "a", encoding="utf-8") if args.output else sys.stdout
+    checkpoint = open(args.checkpoint, "a", encoding="utf-8") if args.checkpoint else None
+
+    concurrency = max(1, args.concurrency)
+    # Ordered output may buffer finished records behind a slow one; bound that window too.
+    window = concurrency * 4
+    stats = {"ok": 0, "error": 0, "skipped": 0, "latencies": [], "tokens": 0, "skills": {}}
+    pending = {}
+    finished = {}
+    order = []
+
+    def emit(result):
+        out.write(json.dumps(result, ensure_ascii=False) + "\n")
+        out.flush()
+        if "error" in result:
+            stats["error"] += 1
+        else:
+            stats["ok"] += 1
+            stats["tokens"] += result.get("context_tokens", 0) + estimate_tokens(result.get("output", ""))
+            if checkpoint:
+                checkpoint.write(f"{result['index']}\n")
+                checkpoint.flush()
+        stats["latencies"].append(result["latency_ms"])
+        skill = result["skill"] or "NONE"
+        stats["skills"][skill] = stats["skills"].get(skill, 0) + 1
+
+    def drain(block):
+        if not pending:
+            return
+        completed, _ = wait(list(pending), timeout=None if block else 0, return_when=FIRST_COMPLETED)
+        for future in completed:
+            index = pending.pop(future)
+            result = future.result()
+            if args.ordered:
+                finished[index] = result
+            else:
+                emit(result)
+        while args.ordered and order and order[0] in finished:
+            emit(finished.pop(order.pop(0)))
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch") as pool:
+        for index, record in read_batch_records(args.input):
+            if index in done:
+                stats["skipped"] += 1
+                continue
+            while len(pending) >= concurrency or (args.ordered and len(order) >= window):
+                drain(block=True)
+            order.append(index)
+            pending[pool.submit(run_batch_record, ctx, index, record)] = index
+            drain(block=False)
+        while pending:
+            drain(block=True)
+    elapsed = time.monotonic() - started
+
+    if args.output:
+        out.close()
+    if checkpoint:
+        checkpoint.close()
+    print_batch_summary(stats, elapsed)
+    return 1 if stats["error"] else 0
+
+
+def print_batch_summary(stats, elapsed):
+    latencies = sorted(stats["latencies"])
+
+    def pct(p):
+        if not latencies:
+            return 0.0
+        return latencies[max(0, min(len(latencies) - 1, int(round(p / 100.0 * len(latencies))) - 1))]
+
+    processed = stats["ok"] + stats["error"]
+    minutes = elapsed / 60.0 if elapsed > 0 else 0.0
+    lines = [
+        f"[BATCH] 完成 {stats['ok']}，失败 {stats['error']}，跳过 {stats['skipped']}，耗时 {elapsed:.1f}s",
+        f"[BATCH] 吞吐 {processed / elapsed if elapsed else 0:.2f} 条/s，"
+        f"约 {stats['tokens'] / minutes if minutes else 0:.0f} tokens/min",
+        f"[BATCH] 延迟 p50 {pct(50):.0f}ms / p95 {pct(95):.0f}ms / p99 {pct(99):.0f}ms",
+        "[BATCH] 技能分布 " + "，".join(f"{k}: {v}" for k, v in sorted(stats["skills"].items())),
+    ]
+    for line in lines:
+        print(line, file=sys.stderr)
 
 
 def main():
@@ -270,6 +675,7 @@ def main():
         print("  python3 backend/scripts/run_skill.py --skill <skill-name> \"用户输入\"")
         print("  python3 backend/scripts/run_skill.py --chat-auto")
         print("  python3 backend/scripts/run_skill.py --chat-skill <skill-name>")
+        print("  python3 backend/scripts/run_skill.py --batch input.jsonl --output out.jsonl [--concurrency 4]")
         sys.exit(1)
 
     host = os.getenv("OLLAMA_HOST", "http://localhost:11434")
@@ -293,9 +699,15 @@ def main():
         request_fn = lambda payload: request_chat_deepseek(
             deepseek_base_url, deepseek_api_key, payload
         )
+        stream_fn = lambda payload: stream_chat_deepseek(
+            deepseek_base_url, deepseek_api_key, payload
+        )
         options = {}
     else:
         request_fn = lambda payload: request_chat_ollama(host, payload)
+        stream_fn = lambda payload: stream_chat_ollama(host, payload)
+    if os.getenv("CLI_STREAM", "1").strip().lower() in ("0", "false", "no", "off"):
+        stream_fn = None
 
     if sys.argv[1] == "--list":
         skills = list_skills(skills_root)
@@ -307,10 +719,13 @@ def main():
         sys.exit(0)
 
     mode = sys.argv[1]
+    skill_dir = skill_file = None
+    if mode == "--batch":
+        sys.exit(run_batch(sys.argv[2:], request_fn, model, options, skills_root))
     if mode == "--chat-auto":
         skills = list_skills(skills_root)
         print("[CHAT-AUTO] 将在每次对话中自动选择技能。")
-        chat_auto_loop(request_fn, model, skills, options, assistant_label)
+        chat_auto_loop(request_fn, stream_fn, model, skills, options, assistant_label)
         sys.exit(0)
     elif mode == "--chat-skill":
         if len(sys.argv) < 3:
@@ -322,10 +737,8 @@ def main():
         if not os.path.isfile(skill_file):
             print("未找到 SKILL.md:", skill_file)
             sys.exit(1)
-        skill_text = read_text(skill_file)
-        references = collect_reference_files(skill_dir)
-        system_prompt = build_system_prompt(skill_text, references)
-        chat_loop(request_fn, model, system_prompt, options, assistant_label)
+        skill = {"name": skill_name, "dir": skill_dir, "file": skill_file}
+        chat_loop(request_fn, stream_fn, model, skill, options, assistant_label)
         sys.exit(0)
     elif mode == "--auto":
         if len(sys.argv) < 3:
@@ -336,14 +749,9 @@ def main():
         chosen = choose_skill_auto(skills, user_text)
         if chosen:
             print(f"[AUTO] 使用技能：{chosen['name']}")
-            skill_dir = chosen["dir"]
-            skill_file = chosen["file"]
-            skill_text = read_text(skill_file)
-            references = collect_reference_files(skill_dir)
-            system_prompt = build_system_prompt(skill_text, references)
+            skill_dir, skill_file = chosen["dir"], chosen["file"]
         else:
             print("[AUTO] 未匹配技能，使用默认提示。")
-            system_prompt = "你是一个助手。回答要清晰、分步骤。"
     elif mode == "--model-auto":
         if len(sys.argv) < 3:
             print("用法: python3 backend/scripts/run_skill.py --model-auto \"用户输入\"")
@@ -353,14 +761,9 @@ def main():
         chosen = choose_skill_by_model(request_fn, model, skills, user_text)
         if chosen:
             print(f"[MODEL-AUTO] 使用技能：{chosen['name']}")
-            skill_dir = chosen["dir"]
-            skill_file = chosen["file"]
-            skill_text = read_text(skill_file)
-            references = collect_reference_files(skill_dir)
-            system_prompt = build_system_prompt(skill_text, references)
+            skill_dir, skill_file = chosen["dir"], chosen["file"]
         else:
             print("[MODEL-AUTO] 未匹配技能，使用默认提示。")
-            system_prompt = "你是一个助手。回答要清晰、分步骤。"
     elif mode == "--skill":
         if len(sys.argv) < 4:
             print("用法: python3 backend/scripts/run_skill.py --skill <skill-name> \"用户输入\"")
@@ -372,22 +775,19 @@ def main():
         if not os.path.isfile(skill_file):
             print("未找到 SKILL.md:", skill_file)
             sys.exit(1)
-        skill_text = read_text(skill_file)
-        references = collect_reference_files(skill_dir)
-        system_prompt = build_system_prompt(skill_text, references)
     else:
         print("未知参数。使用 --list / --auto / --model-auto / --skill")
         sys.exit(1)
 
-    payload = {
-        "model": model,
-        "stream": False,
-        "messages": [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_text},
-        ],
-        **options,
-    }
+    # Same retrieval and packing as the chat and batch paths.
+    if skill_file:
+        system_prompt = build_system_prompt(read_text(skill_file), [])
+        sections = reference_index.search(skill_dir, user_text)
+    else:
+        system_prompt = "你是一个助手。回答要清晰、分步骤。"
+        sections = []
+    messages, _ = pack_context(system_prompt, [], user_text, sections=sections)
+    payload = {"model": model, "stream": False, "messages": messages, **options}
 
     try:
         body = request_fn(payload) or ""
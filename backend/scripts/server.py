@@ -1,21 +1,35 @@
 #!/usr/bin/env python3
 import base64
 import io
-import cgi
 import json
 import os
 import re
+import select
+import signal
+import socket
 import sys
 import urllib.request
 import mimetypes
 import threading
 import time
-from http.server import BaseHTTPRequestHandler, HTTPServer
-import webbrowser
+from urllib.parse import parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from threading import Timer
-
-from PIL import Image, ImageEnhance
-import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+import admission
+import cassette
+import metrics
+import profiling
+from providers import (
+    CancelToken, RequestCancelled, ResilientClient, ResponseCache, SingleFlight,
+    breaker_states, payload_key, post_json, resilience_settings,
+)
+from context_packer import pack_context, trim_history
+import reference_index
+import session_store
+import skill_catalog
+from lifecycle import Lifecycle
 
 
 # --- Paths ---
@@ -33,18 +47,6 @@ def read_text(path):
         return f.read().strip()
 
 
-def collect_reference_files(skill_dir):
-    reference_dir = os.path.join(skill_dir, "reference")
-    if not os.path.isdir(reference_dir):
-        return []
-    files = []
-    for name in sorted(os.listdir(reference_dir)):
-        path = os.path.join(reference_dir, name)
-        if os.path.isfile(path):
-            files.append((f"reference/{name}", read_text(path)))
-    return files
-
-
 def parse_skill_file(skill_path):
     lines = read_text(skill_path).splitlines()
     meta = {}
@@ -77,6 +79,7 @@ def build_system_prompt(skill_text, references):
     return "\n\n".join(parts)
 
 
+@metrics.timed("list_skills")
 def list_skills(skills_root):
     if not os.path.isdir(skills_root):
         return []
@@ -86,60 +89,215 @@ def list_skills(skills_root):
         skill_file = os.path.join(skill_dir, "SKILL.md")
         if os.path.isdir(skill_dir) and os.path.isfile(skill_file):
             meta, _ = parse_skill_file(skill_file)
-            skills.append({
-                "name": meta.get("name", name),
-                "description": meta.get("description", "无描述"),
-                "dir": skill_dir,
-                "file": skill_file,
-            })
+            skills.append(skill_entry(name, meta, skill_dir, skill_file))
     return skills
 
 
-def request_chat_ollama(host, payload):
-    req = urllib.request.Request(
-        f"{host}/api/chat",
-        data=json.dumps(payload).encode("utf-8"),
-        headers={"Content-Type": "application/json"},
-        method="POST",
-    )
-    with urllib.request.urlopen(req, timeout=300) as resp:
-        body = resp.read().decode("utf-8")
-    data = json.loads(body)
+def skill_entry(dirname, meta, skill_dir, skill_file):
+    return {
+        "name": meta.get("name", dirname),
+        "description": meta.get("description", "无描述"),
+        "dir": skill_dir,
+        "file": skill_file,
+        "cache_ttl": parse_cache_ttl(meta.get("cache_ttl")),
+        # Skills that grade photos get pixel statistics of an attached image in their prompt.
+        "image_stats": meta.get("image_stats", "").strip().lower() in ("1", "true", "yes", "on"),
+    }
+
+
+def parse_cache_ttl(value):
+    try:
+        return max(0, int(value or 0))
+    except ValueError:
+        return 0
+
+
+class SkillIndex:
+    """Skill list and parsed SKILL.md files, built once at boot.
+
+    Requests reuse the parsed entries; at most every `rescan_sec` the
+    skills/ listing and SKILL.md mtimes are re-checked and the list is rebuilt
+    only if something changed.
+
+    With a compiled catalog (skill_catalog.py) warm() checks the catalog
+    against the disk once at boot (stat only, re-reading changed directories)
+    and later rescans run in a background thread, so no request waits on
+    stat()ing thousands of directories; a request may see the previous list
+    until the rescan finishes.
+    """
+
+    def __init__(self, root, catalog=None, rescan_sec=2.0):
+        self.root = root
+        self.catalog = catalog
+        self.rescan_sec = rescan_sec
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._skills = []
+        self._signature = None
+        self._checked = 0.0
+        self._refreshing = False
+        self._documents = {}
+
+    def _scan_signature(self):
+        if not os.path.isdir(self.root):
+            return ()
+        signature = []
+        for name in sorted(os.listdir(self.root)):
+            try:
+                signature.append((name, os.stat(os.path.join(self.root, name, "SKILL.md")).st_mtime_ns))
+            except OSError:
+                continue
+        return tuple(signature)
+
+    def _catalog_skills(self):
+        return [skill_entry(os.path.basename(s["dir"]), s["meta"], s["dir"], s["file"])
+                for s in self.catalog.skills()]
+
+    def _refresh_catalog(self):
+        try:
+            fingerprint = self.catalog.refresh()["fingerprint"]
+            if fingerprint != self._signature:
+                skills = self._catalog_skills()
+                with self._lock:
+                    self._skills, self._signature = skills, fingerprint
+        except Exception as e:
+            print(f"Skill catalog refresh failed: {e}")
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def _first_catalog_load(self):
+        with self._load_lock:
+            if self._signature is not None:
+                return
+            skills = self._catalog_skills()
+            if not skills:
+                # Empty catalog: compile it now rather than serve an empty list.
+                with self._lock:
+                    self._refreshing = True
+                self._refresh_catalog()
+                return
+            with self._lock:
+                # Unverified until the first background rescan compares it with the disk.
+                self._skills, self._signature, self._checked = skills, "", 0.0
+
+    def skills(self):
+        now = time.time()
+        if self.catalog is not None:
+            if self._signature is None:
+                self._first_catalog_load()
+            with self._lock:
+                due = not self._refreshing and now - self._checked >= self.rescan_sec
+                if due:
+                    self._checked, self._refreshing = now, True
+                skills = list(self._skills)
+            if due:
+                threading.Thread(target=self._refresh_catalog, name="skill-catalog", daemon=True).start()
+            return skills
+        with self._lock:
+            if self._signature is not None and now - self._checked < self.rescan_sec:
+                return list(self._skills)
+            signature = self._scan_signature()
+            if signature != self._signature:
+                self._skills = list_skills(self.root)
+                self._signature = signature
+            self._checked = now
+            return list(self._skills)
+
+    def document(self, skill_file):
+        """(meta, full SKILL.md text), re-read only when the file's mtime changes."""
+        mtime = os.stat(skill_file).st_mtime_ns
+        with self._lock:
+            cached = self._documents.get(skill_file)
+            if cached and cached[0] == mtime:
+                return cached[1], cached[2]
+        meta, _ = parse_skill_file(skill_file)
+        text = read_text(skill_file)
+        with self._lock:
+            self._documents[skill_file] = (mtime, meta, text)
+        return meta, text
+
+    def warm(self):
+        """Parse every skill and load its reference index so the first request does no scanning.
+
+        With a catalog only the list is loaded; bodies and reference indexes
+        of thousands of skills are loaded when a skill is first used.
+        """
+        if self.catalog is not None:
+            # Compare with the disk before serving, so edits made while stopped show up at once.
+            with self._lock:
+                self._refreshing = True
+            self._refresh_catalog()
+            with self._lock:
+                self._checked = time.time()
+            return len(self.skills())
+        skills = self.skills()
+        for skill in skills:
+            self.document(skill["file"])
+            reference_index.get_index(skill["dir"])
+        return len(skills)
+
+
+# Built by init_config() once .env is loaded: opening the catalog writes skills/.skill_catalog.sqlite3.
+SKILL_INDEX = None
+
+
+def record_usage(provider, usage):
+    """Token accounting from provider responses, including DeepSeek prefix-cache hits."""
+    if not usage:
+        return
+    for field, kind in (
+        ("prompt_tokens", "prompt"),
+        ("completion_tokens", "completion"),
+        ("prompt_cache_hit_tokens", "prompt_cache_hit"),
+        ("prompt_cache_miss_tokens", "prompt_cache_miss"),
+    ):
+        value = usage.get(field)
+        if isinstance(value, (int, float)):
+            metrics.inc("llm_tokens", value, provider=provider, kind=kind)
+
+
+def request_chat_ollama(host, payload, cancel=None, timeout=300, connect_timeout=None):
+    data = request_ollama_raw(host, payload, cancel=cancel, timeout=timeout, connect_timeout=connect_timeout)
+    record_usage("ollama", {
+        "prompt_tokens": data.get("prompt_eval_count"),
+        "completion_tokens": data.get("eval_count"),
+    })
     return data.get("message", {}).get("content", "")
 
 
-def request_ollama_raw(host, payload):
-    req = urllib.request.Request(
-        f"{host}/api/chat",
-        data=json.dumps(payload).encode("utf-8"),
-        headers={"Content-Type": "application/json"},
-        method="POST",
-    )
-    with urllib.request.urlopen(req, timeout=300) as resp:
-        body = resp.read().decode("utf-8")
-    return json.loads(body)
+def request_ollama_raw(host, payload, cancel=None, timeout=300, connect_timeout=None):
+    if OLLAMA_KEEP_ALIVE and "keep_alive" not in payload:
+        payload = dict(payload, keep_alive=OLLAMA_KEEP_ALIVE)
+    data = post_json(f"{host}/api/chat", payload, timeout=timeout, cancel=cancel,
+                     connect_timeout=connect_timeout)
+    mark_model_used(payload.get("model"))
+    return data
 
 
-def request_chat_deepseek(base_url, api_key, payload):
-    req = urllib.request.Request(
+def request_chat_deepseek(base_url, api_key, payload, cancel=None, timeout=300, connect_timeout=None):
+    data = post_json(
         f"{base_url}/chat/completions",
-        data=json.dumps(payload).encode("utf-8"),
-        headers={
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {api_key}",
-        },
-        method="POST",
+        payload,
+        headers={"Authorization": f"Bearer {api_key}"},
+        timeout=timeout,
+        cancel=cancel,
+        connect_timeout=connect_timeout,
     )
-    with urllib.request.urlopen(req, timeout=300) as resp:
-        body = resp.read().decode("utf-8")
-    data = json.loads(body)
+    record_usage("deepseek", data.get("usage"))
     choices = data.get("choices", [])
     if not choices:
         return ""
     return choices[0].get("message", {}).get("content", "")
 
 
-def choose_skill_by_model(request_fn, model, skills, user_text):
+def strip_reasoning(text):
+    """Drop <think>...</think> blocks emitted by reasoning models before the answer."""
+    return re.sub(r"<think>.*?(</think>|$)", "", text or "", flags=re.S).strip()
+
+
+@metrics.timed("select_skill")
+def choose_skill_by_model(request_fn, model, skills, user_text, cancel=None):
     if not skills:
         return None
     options = "\n".join(
@@ -160,7 +318,7 @@ def choose_skill_by_model(request_fn, model, skills, user_text):
             {"role": "user", "content": selector_prompt},
         ],
     }
-    choice = request_fn(payload).strip()
+    choice = strip_reasoning(request_fn(payload, cancel=cancel))
     choice = re.sub(r"[^a-zA-Z0-9_\-]+", "", choice)
     if not choice or choice.upper() == "NONE":
         return None
@@ -170,7 +328,8 @@ def choose_skill_by_model(request_fn, model, skills, user_text):
     return None
 
 
-def extract_city_by_model(request_fn, model, user_text):
+@metrics.timed("extract_city")
+def extract_city_by_model(request_fn, model, user_text, cancel=None):
     selector_prompt = (
         "从用户输入中提取城市名，只输出城市名或 NONE。"
         "不要输出其它文字。\n\n"
@@ -185,7 +344,9 @@ def extract_city_by_model(request_fn, model, user_text):
         ],
     }
     try:
-        choice = request_fn(payload).strip()
+        choice = strip_reasoning(request_fn(payload, cancel=cancel))
+    except RequestCancelled:
+        raise
     except Exception:
         return None
     choice = re.sub(r"[^a-zA-Z0-9\u4e00-\u9fff\-]+", "", choice)
@@ -194,6 +355,7 @@ def extract_city_by_model(request_fn, model, user_text):
     return choice
 
 
+@metrics.timed("ip_lookup")
 def get_city_by_ip():
     try:
         req = urllib.request.Request(
@@ -209,21 +371,25 @@ def get_city_by_ip():
         return None
 
 
-def build_skill_prompt(skill_file, skill_dir, user_text, request_fn, model):
-    skill_text = read_text(skill_file)
-    references = collect_reference_files(skill_dir)
-    system_prompt = build_system_prompt(skill_text, references)
+@metrics.timed("build_prompt")
+def load_skill_context(skill_file, skill_dir, user_text, request_fn, model, cancel=None):
+    """Return (skill_text, sections, hint) for a chosen skill; hint is per-request text."""
+    meta, skill_text = SKILL_INDEX.document(skill_file)
+    with metrics.stage("retrieve_references"):
+        sections = reference_index.search(skill_dir, user_text)
 
-    meta, _ = parse_skill_file(skill_file)
+    hint = ""
     if meta.get("name") == "weather":
-        city = extract_city_by_model(request_fn, model, user_text)
+        city = extract_city_by_model(request_fn, model, user_text, cancel=cancel)
         if not city:
+            if cancel is not None:
+                cancel.raise_if_cancelled("ip_lookup")
             city = get_city_by_ip() or "当前位置"
-        system_prompt += (
+        hint = (
             "\n\n[系统提示] 如果用户未指定城市，请使用解析到的城市："
             f"{city}。"
         )
-    return system_prompt
+    return skill_text, sections, hint
 
 
 CATEGORY_LABELS = {
@@ -258,7 +424,7 @@ def normalize_category(text):
     return alias_map.get(text, "unknown")
 
 
-def classify_image_ollama(host, model, image_bytes):
+def classify_image_ollama(host, model, image_bytes, options=None):
     b64_image = base64.b64encode(image_bytes).decode("utf-8")
     prompt = (
         "你是图像分类器。只输出一个标签："
@@ -276,8 +442,9 @@ def classify_image_ollama(host, model, image_bytes):
             }
         ],
     }
-    data = request_ollama_raw(host, payload)
-    content = data.get("message", {}).get("content", "")
+    data = CASSETTE.call("ollama", lambda p, cancel=None: request_ollama_raw(host, p),
+                         apply_call_options(payload, "ollama", options))
+    content = strip_reasoning(data.get("message", {}).get("content", ""))
     return normalize_category(content)
 
 
@@ -297,12 +464,10 @@ def classify_image_fallback(filename=""):
 
 
 def classify_image(image_bytes, filename=""):
-    provider = HOST_CFG.get("provider", "ollama")
-    if provider == "ollama":
-        host = HOST_CFG.get("host")
-        model = HOST_CFG.get("vision_model") or HOST_CFG.get("model")
+    tier = HOST_CFG.get("tiers", {}).get("vision")
+    if tier and tier["provider"] == "ollama":
         try:
-            return classify_image_ollama(host, model, image_bytes)
+            return classify_image_ollama(tier["host"], tier["model"], image_bytes, tier["options"])
         except Exception:
             return classify_image_fallback(filename)
     return classify_image_fallback(filename)
@@ -311,14 +476,37 @@ def classify_image(image_bytes, filename=""):
 # --- Server Logic ---
 
 # Global State
-HISTORY = []
+SESSIONS = None  # opened by init_config() once .env is loaded
 HOST_CFG = {}
 HTTPD = None
-LAST_HEARTBEAT = time.time()
 HEARTBEAT_TIMEOUT_SEC = 60
-ACTIVE_REQUESTS = 0
-ACTIVE_REQUESTS_LOCK = threading.Lock()
-ACTIVE_MODE = None
+# Liveness comes from open /events streams plus ordinary traffic; see lifecycle.py.
+LIFECYCLE = Lifecycle(idle_timeout=HEARTBEAT_TIMEOUT_SEC)
+# Per-lane concurrency, queueing and rate limits; see admission.py. Built by init_config()
+# once .env is loaded, so ADMIT_* settings there take effect.
+ADMISSION = None
+# Longest side graded when the image lane is under pressure.
+PREVIEW_MAX_SIDE = 1280
+REJECT_MESSAGES = {
+    "rate_limited": "请求过于频繁，请稍后再试。",
+    "queue_full": "服务繁忙，请稍后再试。",
+    "deadline": "排队超时，请稍后再试。",
+}
+EVENTS_PING_SEC = float(os.getenv("EVENTS_PING_SEC", "15"))
+HISTORY_MAX_MESSAGES = 40  # HISTORY_MAX_MESSAGES, set in init_config
+# "auto": routine photo corrections are derived from pixel statistics without the model; "llm": always ask.
+# GRADE_MODE, set in init_config.
+GRADE_MODE = "llm"
+SERVER_PORT = int(os.getenv("SERVER_PORT", "8000"))
+# Set by manager.py when it runs several workers on one inherited listening socket.
+WORKER_ID = os.getenv("SERVER_WORKER_ID", "")
+STARTED_AT = time.time()
+READY_AT = None
+DRAIN_TIMEOUT_SEC = float(os.getenv("SERVER_DRAIN_TIMEOUT", "30"))
+# Sent with every Ollama request so the model stays loaded between chats ("" = Ollama default).
+OLLAMA_KEEP_ALIVE = ""
+MODEL_STATUS = {}
+MODEL_STATUS_LOCK = threading.Lock()
 
 # Mode control
 BOYFRIEND_SKILL_NAME = "boyfriend-mode"
@@ -335,17 +523,34 @@ def detect_mode_command(text):
     return None
 
 
-def mark_request_start():
-    global ACTIVE_REQUESTS, LAST_HEARTBEAT
-    with ACTIVE_REQUESTS_LOCK:
-        ACTIVE_REQUESTS += 1
-    LAST_HEARTBEAT = time.time()
+def watch_disconnect(conn, cancel, done, interval=0.25):
+    """Cancel `cancel` once the client closes its side of `conn`.
 
+    The request body has already been read and the handler speaks HTTP/1.0,
+    so the socket only becomes readable again when the peer hangs up.
+    """
+    while not done.is_set():
+        try:
+            readable, _, _ = select.select([conn], [], [], interval)
+        except (OSError, ValueError):
+            return
+        if not readable:
+            continue
+        try:
+            peek = conn.recv(1, socket.MSG_PEEK)
+        except BlockingIOError:
+            continue
+        except OSError:
+            peek = b""
+        if not peek:
+            cancel.cancel("client disconnected")
+        return
 
-def mark_request_end():
-    global ACTIVE_REQUESTS
-    with ACTIVE_REQUESTS_LOCK:
-        ACTIVE_REQUESTS = max(0, ACTIVE_REQUESTS - 1)
+
+def start_disconnect_watcher(conn, cancel):
+    done = threading.Event()
+    threading.Thread(target=watch_disconnect, args=(conn, cancel, done), daemon=True).start()
+    return done
 
 
 def should_request_more_info(text):
@@ -383,6 +588,7 @@ def derive_warmth_from_text(text):
     return None
 
 
+@metrics.timed("parse_adjustments")
 def parse_adjustments(reply):
     if not reply:
         return {}
@@ -436,9 +642,62 @@ def parse_adjustments(reply):
     return adjustments
 
 
-def apply_adjustments(image_bytes, adjustments):
-    image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
-    arr = np.asarray(image).astype(np.float32)
+def analyze_image(image_bytes):
+    """Pixel statistics of an attached image (image_stats.summarize_image); None if it cannot be decoded."""
+    import image_stats
+    try:
+        with metrics.stage("image_stats"):
+            return image_stats.summarize_image(image_bytes)
+    except Exception as e:
+        print(f"Image statistics failed: {e}")
+        return None
+
+
+def image_stats_hint(stats):
+    if not stats:
+        return ""
+    import image_stats
+    return image_stats.format_stats(stats)
+
+
+# Words of a bare "fix this photo" request; anything else in the message (a direction such as
+# 暖一点 or 压暗高光, a style, or another task like 总结截图) is left to the model.
+ROUTINE_GRADE_WORDS = (
+    "请", "帮我", "帮忙", "麻烦", "给我", "把", "将", "这张", "这幅", "一张",
+    "照片", "相片", "图片", "图像", "图",
+    "一键", "自动", "快速", "简单", "常规", "基础",
+    "调色", "调整", "调调", "调", "修图", "修", "校色", "校正", "矫正", "优化", "处理", "美化",
+    "一下", "下", "吧", "呢", "哦", "谢谢",
+)
+ROUTINE_GRADE_RE = re.compile(
+    "^(?:" + "|".join(sorted(map(re.escape, ROUTINE_GRADE_WORDS), key=len, reverse=True)) + ")*$"
+)
+PUNCT_SPACE_RE = re.compile(r"[\s\W_]+")
+
+
+def is_routine_grade_request(user_text):
+    """True if the message, minus the attachment marker, says nothing beyond "grade this photo"."""
+    text = PUNCT_SPACE_RE.sub("", user_text.replace("[[IMAGE_ATTACHED]]", ""))
+    return bool(ROUTINE_GRADE_RE.match(text))
+
+
+def image_libs():
+    """(Image, ImageEnhance, np): imported on first use so text-only startups never pay for them."""
+    from PIL import Image, ImageEnhance
+    import numpy as np
+    return Image, ImageEnhance, np
+
+
+@metrics.timed("grade_image")
+def apply_adjustments(image_bytes, adjustments, max_side=None):
+    """Grade the image; with max_side, a downscaled preview (longest side at most max_side)."""
+    Image, ImageEnhance, np = image_libs()
+    image = Image.open(io.BytesIO(image_bytes))
+    if max_side:
+        image.draft("RGB", (max_side, max_side))
+        image.thumbnail((max_side, max_side), Image.BILINEAR)
+    image = image.convert("RGB")
+    arr = np.asarray(image, dtype=np.float32).copy()
 
     exposure = adjustments.get("exposure", 0)
     contrast = adjustments.get("contrast", 1)
@@ -450,106 +709,250 @@ def apply_adjustments(image_bytes, adjustments):
     blacks = adjustments.get("blacks", 0)
     clarity = adjustments.get("clarity", 0)
 
-    arr = arr * (1 + exposure)
-    arr = (arr - 128) * contrast + 128
-
-    luma = (arr[:, :, 0] * 0.2126 + arr[:, :, 1] * 0.7152 + arr[:, :, 2] * 0.0722) / 255.0
-    if highlights:
-        delta = (highlights / 100) * 80
-        arr[luma > 0.5] += delta
-    if shadows:
-        delta = (shadows / 100) * 80
-        arr[luma < 0.5] += delta
-    if whites:
-        delta = (whites / 100) * 60
-        arr[luma > 0.5] += delta
-    if blacks:
-        delta = (blacks / 100) * 60
-        arr[luma < 0.5] += delta
+    # In place on one float32 buffer: masked fancy indexing used to dominate grading time.
+    arr *= 1 + exposure
+    arr -= 128
+    arr *= contrast
+    arr += 128
+
+    luma = arr @ np.array([0.2126, 0.7152, 0.0722], dtype=np.float32)
+    luma /= 255.0
+    bright_delta = (highlights / 100) * 80 + (whites / 100) * 60
+    dark_delta = (shadows / 100) * 80 + (blacks / 100) * 60
+    if bright_delta or dark_delta:
+        offset = np.where(luma > 0.5, np.float32(bright_delta),
+                          np.where(luma < 0.5, np.float32(dark_delta), np.float32(0)))
+        arr += offset[:, :, None]
     if clarity:
         clarity_factor = 1 + (clarity / 100) * 0.3
-        arr = (arr - 128) * clarity_factor + 128
+        arr -= 128
+        arr *= clarity_factor
+        arr += 128
 
     arr[:, :, 0] *= warmth
     arr[:, :, 2] *= (2 - warmth)
 
-    arr = np.clip(arr, 0, 255).astype(np.uint8)
+    np.clip(arr, 0, 255, out=arr)
+    arr = arr.astype(np.uint8)
     image = Image.fromarray(arr, mode="RGB")
     if saturation != 1:
         image = ImageEnhance.Color(image).enhance(saturation)
 
-    output = io.BytesIO()
-    image.save(output, format="PNG")
-    return output.getvalue()
+    with metrics.stage("encode_png"):
+        output = io.BytesIO()
+        image.save(output, format="PNG")
+        return output.getvalue()
+
+METRIC_PATHS = {
+    '/', '/index.html', '/skills', '/shutdown', '/metrics', '/status', '/readyz',
+    '/chat', '/analyze-image',
+}
+
+
+WORK_KINDS = {'/chat': 'chat', '/analyze-image': 'image'}
+
+
+def metric_path(path):
+    path = path.split('?', 1)[0]
+    if path in METRIC_PATHS:
+        return path
+    if path.startswith('/assets/'):
+        return '/assets/'
+    if path.startswith('/debug/profiles'):
+        return '/debug/profiles'
+    return 'other'
+
 
 class ChatHandler(BaseHTTPRequestHandler):
-    def _send_response(self, status, content_type, content):
+    def _send_response(self, status, content_type, content, headers=None):
         self.send_response(status)
         self.send_header('Content-Type', content_type)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        timings = metrics.current_timings()
+        if timings:
+            self.send_header('Server-Timing', metrics.server_timing_header(timings))
+        if self._profile_id:
+            self.send_header('X-Profile-Id', str(self._profile_id))
         self.end_headers()
         self.wfile.write(content)
+        self._status = status
+
+    def _begin_metrics(self):
+        self._status = None
+        self._started = time.perf_counter()
+        metrics.begin_request()
+
+    def _end_metrics(self, method):
+        metrics.end_request()
+        self._profile_id = None
+        path = metric_path(self.path)
+        metrics.inc("http_requests", method=method, path=path, status=self._status or 0)
+        metrics.observe(
+            "http_request_duration_seconds",
+            time.perf_counter() - self._started,
+            method=method,
+            path=path,
+        )
+
+    _profile_id = None
+
+    def _set_profile_id(self, profile_id):
+        self._profile_id = profile_id
+
+    def _serve_profiles(self, path):
+        """/debug/profiles lists the ring buffer; /<id> is the text report, /<id>.prof the pstats dump."""
+        if not profiling.authorized(self.headers.get(profiling.HEADER)):
+            self._send_response(403, 'text/plain', b'Forbidden')
+            return
+        rest = path[len('/debug/profiles'):].strip('/')
+        if not rest:
+            body = json.dumps(profiling.list_profiles()).encode('utf-8')
+            self._send_response(200, 'application/json', body)
+            return
+        name, _, ext = rest.partition('.')
+        record = profiling.get_profile(int(name)) if name.isdigit() else None
+        if record is None or ext not in ('', 'prof'):
+            self._send_response(404, 'text/plain', b'Not Found')
+        elif ext == 'prof':
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Disposition', f'attachment; filename="profile-{record["id"]}.prof"')
+            self.end_headers()
+            self.wfile.write(record['pstats'])
+            self._status = 200
+        else:
+            self._send_response(200, 'text/plain; charset=utf-8', profiling.render_text(record).encode('utf-8'))
+
+    def _send_rejected(self, rejected):
+        body = json.dumps({
+            'error': REJECT_MESSAGES.get(rejected.reason, str(rejected)),
+            'reason': rejected.reason,
+            'lane': rejected.lane,
+        }, ensure_ascii=False).encode('utf-8')
+        self._send_response(rejected.status, 'application/json', body,
+                            {'Retry-After': str(rejected.retry_after)})
+
+    def _serve_events(self, query):
+        """Long-lived SSE stream per tab: its being open is the tab's liveness signal."""
+        session_id = session_store.normalize_session_id(parse_qs(query).get('session', [''])[0])
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-store')
+        self.end_headers()
+        token = LIFECYCLE.open_stream(session_id)
+        try:
+            self.wfile.write(b'retry: 3000\nevent: hello\ndata: {}\n\n')
+            self.wfile.flush()
+            while not LIFECYCLE.wait_draining(EVENTS_PING_SEC):
+                self.wfile.write(b': ping\n\n')
+                self.wfile.flush()
+            self.wfile.write(b'event: draining\ndata: {}\n\n')
+            self.wfile.flush()
+        except OSError:
+            pass  # tab closed
+        finally:
+            LIFECYCLE.close_stream(token)
+            self.close_connection = True
 
     def do_GET(self):
-        global LAST_HEARTBEAT
-        mark_request_start()
+        path, _, query = self.path.partition('?')
+        if path == '/heartbeat':
+            # Fallback liveness probe for clients without /events: no metrics or work accounting.
+            LIFECYCLE.touch()
+            self._send_response(200, 'text/plain', b'OK')
+            return
+        if path == '/events':
+            self._serve_events(query)
+            return
+        LIFECYCLE.touch()
+        self._begin_metrics()
         try:
-            if self.path == '/' or self.path == '/index.html':
-                LAST_HEARTBEAT = time.time()
-                try:
-                    with open(os.path.join(FRONTEND_DIR, 'index.html'), 'rb') as f:
-                        self._send_response(200, 'text/html', f.read())
-                except FileNotFoundError:
-                    self._send_response(404, 'text/plain', b'index.html not found')
-            elif self.path.startswith('/assets/'):
-                LAST_HEARTBEAT = time.time()
-                rel_path = os.path.normpath(self.path[len('/assets/'):])
-                if rel_path.startswith('..') or rel_path.startswith('/'):
-                    self._send_response(403, 'text/plain', b'Forbidden')
-                    return
-                asset_path = os.path.join(ASSETS_DIR, rel_path)
-                if not os.path.isfile(asset_path):
-                    self._send_response(404, 'text/plain', b'Asset not found')
-                    return
-                content_type, _ = mimetypes.guess_type(asset_path)
-                if not content_type:
-                    content_type = 'application/octet-stream'
-                try:
-                    with open(asset_path, 'rb') as f:
-                        self._send_response(200, content_type, f.read())
-                except Exception:
-                    self._send_response(500, 'text/plain', b'Failed to load asset')
-            elif self.path == '/skills':
-                LAST_HEARTBEAT = time.time()
-                skills = list_skills(SKILLS_DIR)
-                # Simplify for frontend
-                simple_skills = [{"name": s["name"], "description": s["description"]} for s in skills]
-                self._send_response(200, 'application/json', json.dumps(simple_skills).encode('utf-8'))
-            elif self.path == '/heartbeat':
-                LAST_HEARTBEAT = time.time()
-                self._send_response(200, 'text/plain', b'OK')
-            elif self.path == '/shutdown':
-                LAST_HEARTBEAT = time.time()
-                self._send_response(200, 'text/plain', b'OK')
-                if HTTPD:
-                    threading.Thread(target=HTTPD.shutdown, daemon=True).start()
-            else:
-                self._send_response(404, 'text/plain', b'Not Found')
+            with ADMISSION.admit('control'):
+                self._route_get(path, query)
+        except admission.Rejected as e:
+            self._send_rejected(e)
         finally:
-            mark_request_end()
+            self._end_metrics('GET')
+
+    def _route_get(self, path, query):
+        if self.path == '/' or self.path == '/index.html':
+            try:
+                with open(os.path.join(FRONTEND_DIR, 'index.html'), 'rb') as f:
+                    self._send_response(200, 'text/html', f.read())
+            except FileNotFoundError:
+                self._send_response(404, 'text/plain', b'index.html not found')
+        elif self.path.startswith('/assets/'):
+            rel_path = os.path.normpath(self.path[len('/assets/'):])
+            if rel_path.startswith('..') or rel_path.startswith('/'):
+                self._send_response(403, 'text/plain', b'Forbidden')
+                return
+            asset_path = os.path.join(ASSETS_DIR, rel_path)
+            if not os.path.isfile(asset_path):
+                self._send_response(404, 'text/plain', b'Asset not found')
+                return
+            content_type, _ = mimetypes.guess_type(asset_path)
+            if not content_type:
+                content_type = 'application/octet-stream'
+            try:
+                with open(asset_path, 'rb') as f:
+                    self._send_response(200, content_type, f.read())
+            except Exception:
+                self._send_response(500, 'text/plain', b'Failed to load asset')
+        elif self.path == '/skills':
+            skills = SKILL_INDEX.skills()
+            # Simplify for frontend
+            simple_skills = [{"name": s["name"], "description": s["description"]} for s in skills]
+            self._send_response(200, 'application/json', json.dumps(simple_skills).encode('utf-8'))
+        elif self.path == '/status':
+            status = model_status()
+            status.update(process_status())
+            resp = json.dumps(status, ensure_ascii=False).encode('utf-8')
+            self._send_response(200, 'application/json', resp)
+        elif self.path == '/readyz':
+            code, body = readiness()
+            self._send_response(code, 'application/json', body)
+        elif self.path == '/metrics':
+            for backend, state in breaker_states().items():
+                metrics.set_gauge("provider_circuit_open", 0 if state == "closed" else 1, provider=backend)
+            body = metrics.render_prometheus().encode('utf-8')
+            self._send_response(200, 'text/plain; version=0.0.4; charset=utf-8', body)
+        elif profiling.ENABLED and path.startswith('/debug/profiles'):
+            self._serve_profiles(path)
+        elif path == '/shutdown':
+            self._send_response(200, 'text/plain', b'OK')
+            # Managed workers are shared by every tab; the manager owns their lifecycle.
+            # Otherwise only the last live tab going idle stops the server.
+            session_id = session_store.normalize_session_id(parse_qs(query).get('session', [''])[0])
+            if HTTPD and not WORKER_ID and not LIFECYCLE.live_sessions(exclude=session_id):
+                begin_drain()
+        else:
+            self._send_response(404, 'text/plain', b'Not Found')
 
     def do_POST(self):
-        global LAST_HEARTBEAT
-        mark_request_start()
+        kind = WORK_KINDS.get(self.path)
+        if kind is None:
+            LIFECYCLE.touch()
+            self._handle_post()
+            return
+        # Counted so an idle or SIGTERM shutdown waits for it to finish.
+        profile = profiling.profile_request(self.path, self.headers.get(profiling.HEADER), self._set_profile_id)
+        with LIFECYCLE.work(kind), profile:
+            self._handle_post()
+
+    def _handle_post(self):
+        self._begin_metrics()
         try:
             if self.path == '/chat':
-                LAST_HEARTBEAT = time.time()
                 content_length = int(self.headers['Content-Length'])
                 post_data = self.rfile.read(content_length)
                 try:
                     data = json.loads(post_data)
                     user_msg = data.get('message', '')
                     selected_skill = data.get('skill', None) # Get selected skill
+                    session_id = session_store.normalize_session_id(data.get('session_id'))
                     image_data = data.get('image_data', '') or ''
+                    grade_mode = (data.get('grade_mode') or GRADE_MODE).strip().lower()
 
                     image_bytes = None
                     if image_data:
@@ -562,26 +965,70 @@ class ChatHandler(BaseHTTPRequestHandler):
                     if not user_msg:
                         raise ValueError("Empty message")
 
-                    reply, skill_name = self.process_chat(user_msg, selected_skill)
-
-                    image_base64 = None
-                    if image_bytes and not should_request_more_info(reply):
-                        adjustments = parse_adjustments(reply)
-                        graded_bytes = apply_adjustments(image_bytes, adjustments)
-                        image_base64 = base64.b64encode(graded_bytes).decode("utf-8")
-
-                    resp = json.dumps({
-                        'reply': reply,
-                        'skill': skill_name,
-                        'image_base64': image_base64,
-                    }).encode('utf-8')
-                    self._send_response(200, 'application/json', resp)
+                    lane = 'image' if image_bytes else 'text'
+                    budget = admission.parse_deadline(
+                        self.headers.get('X-Request-Deadline') or data.get('deadline_ms'))
+                    with ADMISSION.admit(lane, self.client_address[0], budget) as ticket:
+                        stats = analyze_image(image_bytes) if image_bytes else None
+
+                        cancel = CancelToken()
+                        watcher_done = start_disconnect_watcher(self.connection, cancel)
+                        try:
+                            auto = None
+                            if stats and grade_mode == "auto":
+                                auto = self.auto_grade(user_msg, selected_skill, stats, session_id)
+                            if auto:
+                                reply, skill_name, adjustments = auto
+                                context_tokens = 0
+                            else:
+                                grade_mode = "llm"
+                                reply, skill_name, context_tokens = self.process_chat(
+                                    user_msg, selected_skill, cancel=cancel, session_id=session_id,
+                                    image_hint=image_stats_hint(stats),
+                                )
+                                adjustments = None
+
+                            image_base64 = None
+                            preview = False
+                            if image_bytes and not should_request_more_info(reply):
+                                if adjustments is None:
+                                    cancel.raise_if_cancelled("parse_adjustments")
+                                    adjustments = parse_adjustments(reply)
+                                cancel.raise_if_cancelled("grade_image")
+                                preview = ADMISSION.under_pressure(ticket)
+                                if preview:
+                                    metrics.inc("admission_degraded", lane=lane)
+                                graded_bytes = apply_adjustments(
+                                    image_bytes, adjustments, PREVIEW_MAX_SIDE if preview else None)
+                                cancel.raise_if_cancelled("encode_base64")
+                                with metrics.stage("encode_base64"):
+                                    image_base64 = base64.b64encode(graded_bytes).decode("utf-8")
+                        finally:
+                            watcher_done.set()
+                        cancel.raise_if_cancelled("respond")
+
+                        resp = json.dumps({
+                            'reply': reply,
+                            'skill': skill_name,
+                            'image_base64': image_base64,
+                            'context_tokens': context_tokens,
+                            'grade_mode': grade_mode if image_bytes else None,
+                            'degraded': 'preview' if preview else None,
+                        }).encode('utf-8')
+                        self._send_response(200, 'application/json', resp)
+                except admission.Rejected as e:
+                    self._send_rejected(e)
+                except RequestCancelled as e:
+                    # Nobody is listening any more; skip the write and drop the socket.
+                    metrics.inc("cancelled_requests", stage=e.stage)
+                    self._status = 499
+                    self.close_connection = True
                 except Exception as e:
                     resp = json.dumps({'error': str(e)}).encode('utf-8')
                     self._send_response(500, 'application/json', resp)
             elif self.path == '/analyze-image':
-                LAST_HEARTBEAT = time.time()
                 try:
+                    import cgi
                     content_type = self.headers.get('Content-Type', '')
                     ctype, _ = cgi.parse_header(content_type)
                     if ctype != 'multipart/form-data':
@@ -604,38 +1051,42 @@ class ChatHandler(BaseHTTPRequestHandler):
                     if not image_bytes:
                         raise ValueError("Empty image data")
 
-                    category = classify_image(image_bytes, filename)
+                    with ADMISSION.admit('image', self.client_address[0]), metrics.stage("classify_image"):
+                        category = classify_image(image_bytes, filename)
                     label = CATEGORY_LABELS.get(category, CATEGORY_LABELS["unknown"])
                     resp = json.dumps({
                         "category": category,
                         "label": label,
                     }).encode('utf-8')
                     self._send_response(200, 'application/json', resp)
+                except admission.Rejected as e:
+                    self._send_rejected(e)
                 except Exception as e:
                     resp = json.dumps({'error': str(e)}).encode('utf-8')
                     self._send_response(400, 'application/json', resp)
             else:
                 self._send_response(404, 'application/json', b'{}')
         finally:
-            mark_request_end()
+            self._end_metrics('POST')
 
-    def process_chat(self, user_text, selected_skill_name=None):
-        global HISTORY, ACTIVE_MODE
-        request_fn = HOST_CFG['request_fn']
-        model = HOST_CFG['model']
-        skills_root = SKILLS_DIR
-        base_prompt = "你是一个助手。回答要清晰、分步骤。"
+    def process_chat(self, user_text, selected_skill_name=None, cancel=None,
+                     session_id=session_store.DEFAULT_SESSION, image_hint=""):
+        tiers = HOST_CFG['tiers']
+        state = SESSIONS.load(session_id)
 
         # 0. Update mode state
         mode_command = detect_mode_command(user_text)
         if mode_command == "on":
-            ACTIVE_MODE = BOYFRIEND_SKILL_NAME
+            state["active_mode"] = BOYFRIEND_SKILL_NAME
         elif mode_command == "off":
-            ACTIVE_MODE = None
+            state["active_mode"] = None
+        active_mode = state["active_mode"]
 
         # 1. Choose Skill
-        skills = list_skills(skills_root)
+        skills = SKILL_INDEX.skills()
         chosen = None
+        history = list(state["history"])
+        result = None
         
         # If manual selection is provided and valid (not "auto")
         if selected_skill_name and selected_skill_name != "auto":
@@ -643,44 +1094,249 @@ class ChatHandler(BaseHTTPRequestHandler):
                 if s["name"] == selected_skill_name:
                     chosen = s
                     break
-        elif ACTIVE_MODE:
+        elif active_mode:
             for s in skills:
-                if s["name"] == ACTIVE_MODE:
+                if s["name"] == active_mode:
                     chosen = s
                     break
+        elif SPECULATIVE_ROUTING:
+            # Auto selection, overlapping the selector call with a speculative answer
+            chosen, result = speculative_generate(skills, user_text, history, cancel, image_hint)
         else:
             # Auto selection
-            chosen = choose_skill_by_model(request_fn, model, skills, user_text)
-        
-        skill_name = None
-        if chosen:
-            skill_name = chosen['name']
-            system_prompt = build_skill_prompt(
-                chosen["file"], chosen["dir"], user_text, request_fn, model
+            router = tiers['router']
+            chosen = choose_skill_by_model(
+                router['request_fn'], router['model'], skills, user_text, cancel=cancel
             )
-        else:
-            system_prompt = base_prompt
-
-        # 2. Build Messages
-        messages = [{"role": "system", "content": system_prompt}]
-        messages.extend(HISTORY)
-        messages.append({"role": "user", "content": user_text})
-
-        # 3. Call Model
-        payload = {
-            "model": model,
-            "stream": False,
-            "messages": messages,
-        }
-        
-        reply = request_fn(payload) or ""
+
+        # 2-3. Build messages and call the model
+        if result is None:
+            result = generate_reply(chosen, user_text, history, cancel, image_hint)
+        reply, ctx_stats = result
+        skill_name = chosen['name'] if chosen else None
         
         # 4. Update History
-        HISTORY.append({"role": "user", "content": user_text})
-        HISTORY.append({"role": "assistant", "content": reply})
-        HISTORY = HISTORY[-6:]  # Keep last 3 turns
+        record_turn(state, session_id, user_text, reply)
+
+        return reply, skill_name, ctx_stats["tokens"]
+
+    def auto_grade(self, user_text, selected_skill_name, stats, session_id):
+        """Grade locally from pixel statistics: (reply, skill_name, adjustments), or None to ask the model.
 
-        return reply, skill_name
+        Used for the grading skill (selected, or picked when selection is
+        automatic) when the message carries no instruction of its own.
+        """
+        import image_stats
+        state = SESSIONS.load(session_id)
+        if state["active_mode"]:
+            return None
+        graders = [s for s in SKILL_INDEX.skills() if s["image_stats"]]
+        if selected_skill_name and selected_skill_name != "auto":
+            graders = [s for s in graders if s["name"] == selected_skill_name]
+        if not graders or not is_routine_grade_request(user_text):
+            return None
+        adjustments = image_stats.derive_auto_adjustments(stats)
+        reply = image_stats.describe_auto_adjustments(adjustments)
+        record_turn(state, session_id, user_text, reply)
+        metrics.inc("auto_grades")
+        return reply, graders[0]["name"], adjustments
+
+
+def record_turn(state, session_id, user_text, reply):
+    history = list(state["history"])
+    history.append({"role": "user", "content": user_text})
+    history.append({"role": "assistant", "content": reply})
+    state["history"] = trim_history(history, HISTORY_MAX_MESSAGES)  # pack_context decides what is sent
+    SESSIONS.save(session_id, state)
+
+
+BASE_PROMPT = "你是一个助手。回答要清晰、分步骤。"
+
+
+def generate_reply(chosen, user_text, history, cancel=None, image_hint=""):
+    """Build the packed prompt for `chosen` (or the base prompt) and run the answer call.
+
+    `image_hint` (pixel statistics of an attached image) is added to the
+    per-request context only for skills that set `image_stats` in SKILL.md.
+    """
+    tiers = HOST_CFG['tiers']
+    answer = tiers['answer']
+    if chosen:
+        extractor = tiers['extractor']
+        skill_text, sections, hint = load_skill_context(
+            chosen["file"], chosen["dir"], user_text,
+            extractor['request_fn'], extractor['model'], cancel=cancel,
+        )
+        if image_hint and chosen.get("image_stats"):
+            hint = f"{hint}\n\n{image_hint}"
+        # Stable per skill: references and hints go after history, not in here.
+        system_prompt = build_system_prompt(skill_text, [])
+    else:
+        sections, hint = [], ""
+        system_prompt = BASE_PROMPT
+
+    # Token-budgeted, stable prefix first for provider caching
+    with metrics.stage("pack_context"):
+        messages, ctx_stats = pack_context(
+            system_prompt, history, user_text, sections=sections, dynamic=hint
+        )
+    metrics.observe("context_tokens", ctx_stats["tokens"], buckets=metrics.TOKEN_BUCKETS)
+
+    payload = {
+        "model": answer['model'],
+        "stream": False,
+        "messages": messages,
+    }
+    # Only skills whose SKILL.md sets cache_ttl get exact-match reply caching.
+    cache_ttl = chosen.get("cache_ttl", 0) if chosen else 0
+    with metrics.stage("generate"):
+        reply = answer['request_fn'](payload, cancel=cancel, cache_ttl=cache_ttl) or ""
+    return reply, ctx_stats
+
+
+# --- Speculative routing ---
+
+# Set by configure_speculation() once .env is loaded; the pool is created on first use.
+SPECULATIVE_ROUTING = False
+SPECULATIVE_MIN_SCORE = 2
+SPECULATION_WORKERS = 1
+SPECULATION_SLOTS = threading.BoundedSemaphore(1)
+_SPECULATION_POOL = None
+_SPECULATION_POOL_LOCK = threading.Lock()
+
+
+def speculative_min_score():
+    """SPECULATIVE_MIN_SCORE: lexical score from which the guess is answered speculatively."""
+    return int(os.getenv("SPECULATIVE_MIN_SCORE", "2"))
+
+
+def configure_speculation():
+    global SPECULATIVE_ROUTING, SPECULATIVE_MIN_SCORE, SPECULATION_WORKERS, SPECULATION_SLOTS
+    SPECULATIVE_ROUTING = os.getenv("SPECULATIVE_ROUTING", "0").strip().lower() in ("1", "true", "yes", "on")
+    SPECULATIVE_MIN_SCORE = speculative_min_score()
+    # One worker per /chat request the text and image lanes admit at once; when every worker is
+    # busy the request skips speculation rather than queue behind other requests' answers.
+    SPECULATION_WORKERS = int(os.getenv("SPECULATION_WORKERS", "0")) or sum(
+        ADMISSION.lanes[lane].concurrency for lane in ("text", "image")
+    )
+    SPECULATION_SLOTS = threading.BoundedSemaphore(SPECULATION_WORKERS)
+
+
+def speculation_pool():
+    global _SPECULATION_POOL
+    with _SPECULATION_POOL_LOCK:
+        if _SPECULATION_POOL is None:
+            _SPECULATION_POOL = ThreadPoolExecutor(max_workers=SPECULATION_WORKERS,
+                                                   thread_name_prefix="speculate")
+        return _SPECULATION_POOL
+
+
+def score_skill(skill, user_text):
+    name = skill["name"].lower()
+    desc = skill["description"].lower()
+    text = user_text.lower()
+
+    score = 0
+    if name in text:
+        score += 4
+    if desc in text:
+        score += 3
+
+    tokens = re.split(r"[^a-z0-9\u4e00-\u9fff]+", f"{name} {desc}")
+    tokens = [t for t in tokens if len(t) >= 2]
+    for t in tokens:
+        if t and t in text:
+            score += 1
+    return score
+
+
+def predict_skill_lexical(skills, user_text):
+    """Best lexical match and its score (same scorer as run_skill.py's --auto)."""
+    best = None
+    best_score = 0
+    for skill in skills:
+        score = score_skill(skill, user_text)
+        if score > best_score:
+            best = skill
+            best_score = score
+    return best, best_score
+
+
+def speculative_generate(skills, user_text, history, cancel=None, image_hint=""):
+    """Run the LLM selector and a speculative answer for the lexical guess in parallel.
+
+    Returns (chosen, result); result is None when the speculation was skipped
+    or discarded and the caller must generate for `chosen` itself.
+    """
+    router = HOST_CFG['tiers']['router']
+    predicted, score = predict_skill_lexical(skills, user_text)
+    score_label = str(min(score, 10))
+    slots = SPECULATION_SLOTS
+    skip = None
+    if predicted is None or score < SPECULATIVE_MIN_SCORE:
+        skip = "skipped"
+    elif not slots.acquire(blocking=False):
+        skip = "busy"
+    if skip:
+        metrics.inc("speculative_routing", outcome=skip, score=score_label)
+        chosen = choose_skill_by_model(
+            router['request_fn'], router['model'], skills, user_text, cancel=cancel
+        )
+        return chosen, None
+
+    spec_cancel = CancelToken()
+    remove_link = cancel.add_callback(lambda: spec_cancel.cancel("parent cancelled")) if cancel else None
+
+    def timed_generate():
+        # Stages are timed on this pool thread; the handler adopts them if the guess is used.
+        metrics.begin_request()
+        started = time.perf_counter()
+        try:
+            result = generate_reply(predicted, user_text, history, spec_cancel, image_hint)
+        finally:
+            timings = metrics.end_request()
+        return result, time.perf_counter() - started, timings
+
+    spec_started = time.perf_counter()
+    try:
+        future = speculation_pool().submit(timed_generate)
+    except BaseException:
+        slots.release()
+        raise
+    future.add_done_callback(lambda _: slots.release())
+    try:
+        chosen = choose_skill_by_model(
+            router['request_fn'], router['model'], skills, user_text, cancel=cancel
+        )
+        select_seconds = time.perf_counter() - spec_started
+    except BaseException:
+        future.cancel()
+        spec_cancel.cancel("selector failed")
+        if remove_link:
+            remove_link()
+        raise
+
+    if chosen is not None and chosen["name"] == predicted["name"]:
+        metrics.inc("speculative_routing", outcome="hit", score=score_label)
+        try:
+            with metrics.stage("speculative_wait"):
+                result, generate_seconds, timings = future.result()
+        finally:
+            if remove_link:
+                remove_link()
+        metrics.add_timings(timings)
+        # The sequential path would have taken selector + generation back to back.
+        saved = select_seconds + generate_seconds - (time.perf_counter() - spec_started)
+        metrics.inc("speculative_saved_seconds", max(0.0, saved))
+        return chosen, result
+
+    future.cancel()
+    spec_cancel.cancel("speculation miss")
+    if remove_link:
+        remove_link()
+    metrics.inc("speculative_routing", outcome="miss", score=score_label)
+    metrics.inc("speculative_wasted_seconds", time.perf_counter() - spec_started)
+    return chosen, None
 
 
 def load_env_file():
@@ -723,8 +1379,281 @@ def load_env_file():
         print(f"Warning: Failed to read .env file: {e}")
 
 
+CALL_PURPOSES = ("router", "extractor", "vision", "answer")
+# Short classification calls get tight output limits unless overridden.
+PURPOSE_DEFAULTS = {
+    "router": {"max_tokens": 16, "temperature": 0.0, "stop": ["\n"]},
+    "extractor": {"max_tokens": 16, "temperature": 0.0, "stop": ["\n"]},
+    "vision": {"max_tokens": 8, "temperature": 0.0, "stop": ["\n"]},
+    "answer": {},
+}
+
+
+def is_reasoning_model(model):
+    name = (model or "").lower()
+    return "-r1" in name or name.startswith("r1") or "reasoner" in name
+
+
+def parse_stop(raw):
+    raw = raw.strip()
+    if raw.startswith("["):
+        try:
+            return [str(s) for s in json.loads(raw)]
+        except ValueError:
+            pass
+    return [s.replace("\\n", "\n") for s in raw.split(",") if s]
+
+
+def apply_call_options(payload, provider, options):
+    """Map per-call limits onto the provider's payload shape."""
+    if not options:
+        return payload
+    payload = dict(payload)
+    if provider == "deepseek":
+        for key in ("max_tokens", "temperature", "stop"):
+            if options.get(key) is not None:
+                payload[key] = options[key]
+        return payload
+    ollama_options = dict(payload.get("options") or {})
+    for key, target in (("max_tokens", "num_predict"), ("temperature", "temperature"), ("stop", "stop")):
+        if options.get(key) is not None:
+            ollama_options[target] = options[key]
+    payload["options"] = ollama_options
+    return payload
+
+
+def make_provider_fn(provider, cfg):
+    timeouts = {"timeout": cfg["read_timeout"], "connect_timeout": cfg["connect_timeout"]}
+    if provider == "deepseek":
+        base_url, api_key = cfg["deepseek_base_url"], cfg["deepseek_api_key"]
+        fn = lambda payload, cancel=None: request_chat_deepseek(
+            base_url, api_key, payload, cancel=cancel, **timeouts
+        )
+    else:
+        host = cfg["host"]
+        fn = lambda payload, cancel=None: request_chat_ollama(host, payload, cancel=cancel, **timeouts)
+    return CASSETTE.wrap(provider, fn)
+
+
+def observe_provider_event(event, backend):
+    metrics.inc("provider_events", provider=backend, event=event)
+    if event == "circuit_open":
+        print(f"[provider] circuit opened for {backend}")
+
+
+def failover_chain(purpose, provider, cfg):
+    """Providers to try in order: LLM_<PURPOSE>_FAILOVER or LLM_FAILOVER, primary always first."""
+    raw = os.getenv(f"LLM_{purpose.upper()}_FAILOVER", "") or os.getenv("LLM_FAILOVER", "")
+    chain = [provider]
+    for name in (p.strip().lower() for p in raw.split(",")):
+        if name not in ("deepseek", "ollama") or name in chain:
+            continue
+        if name == "deepseek" and not cfg["deepseek_api_key"]:
+            continue
+        chain.append(name)
+    return chain
+
+
+# --- Single-flight and response cache ---
+
+SINGLE_FLIGHT = os.getenv("SINGLE_FLIGHT", "1").strip().lower() in ("1", "true", "yes", "on")
+FLIGHTS = SingleFlight()
+RESPONSE_CACHE = ResponseCache(int(os.getenv("RESPONSE_CACHE_MAX", "256")))
+# LLM_CASSETTE_MODE=record|replay captures or serves provider calls; see cassette.py.
+# Off until init_config() builds it from the environment, before any call tier.
+CASSETTE = cassette.Cassette()
+
+
+def coalesced_call(identity, base_fn, payload, cancel=None, cache_ttl=0):
+    """Run base_fn once per identical in-flight request; cache replies for skills that opt in.
+
+    `identity` is everything that determines the reply: providers, options and payload.
+    """
+    if not SINGLE_FLIGHT and cache_ttl <= 0:
+        return base_fn(payload, cancel=cancel)
+    key = payload_key(identity)
+    if cache_ttl > 0:
+        cached = RESPONSE_CACHE.get(key)
+        if cached is not None:
+            metrics.inc("response_cache", result="hit")
+            return cached
+        metrics.inc("response_cache", result="miss")
+    if SINGLE_FLIGHT:
+        reply, shared = FLIGHTS.do(key, lambda token: base_fn(payload, cancel=token), cancel=cancel)
+        metrics.inc("single_flight", result="shared" if shared else "leader")
+    else:
+        reply = base_fn(payload, cancel=cancel)
+    if cache_ttl > 0 and reply:
+        RESPONSE_CACHE.put(key, reply, cache_ttl)
+    return reply
+
+
+def load_call_tier(purpose, cfg):
+    """Provider, model and output limits for one call purpose (LLM_<PURPOSE>_* env vars)."""
+    prefix = f"LLM_{purpose.upper()}_"
+    # Image classification needs Ollama's images field; other providers fall back to filename rules.
+    provider = os.getenv(prefix + "PROVIDER", "").lower() or cfg["provider"]
+    default_model = cfg["deepseek_model"] if provider == "deepseek" else cfg["ollama_model"]
+    if purpose == "vision":
+        default_model = cfg["vision_model"] or cfg["ollama_model"]
+    model = os.getenv(prefix + "MODEL", "") or default_model
+
+    options = dict(PURPOSE_DEFAULTS[purpose])
+    explicit = set()
+    if os.getenv(prefix + "MAX_TOKENS"):
+        options["max_tokens"] = int(os.getenv(prefix + "MAX_TOKENS"))
+        explicit.add("max_tokens")
+    if os.getenv(prefix + "TEMPERATURE"):
+        options["temperature"] = float(os.getenv(prefix + "TEMPERATURE"))
+    if os.getenv(prefix + "STOP"):
+        options["stop"] = parse_stop(os.getenv(prefix + "STOP"))
+        explicit.add("stop")
+    if is_reasoning_model(model):
+        # A think-chain comes before the one-word answer; default limits would cut it off.
+        for key in ("max_tokens", "stop"):
+            if key not in explicit:
+                options.pop(key, None)
+
+    backends = []
+    chain = failover_chain(purpose, provider, cfg)
+    for name in chain:
+        backend_fn = make_provider_fn(name, cfg)
+        # Fallback providers run their own default model for this purpose.
+        backend_model = None
+        if name != provider:
+            backend_model = cfg["deepseek_model"] if name == "deepseek" else cfg["ollama_model"]
+        backends.append((name, make_backend_call(backend_fn, name, backend_model, options)))
+    client = ResilientClient(backends, observer=observe_provider_event, **resilience_settings())
+    request_fn = lambda payload, cancel=None, cache_ttl=0: coalesced_call(
+        {"chain": chain, "options": options, **payload}, client.call, payload,
+        cancel=cancel, cache_ttl=cache_ttl,
+    )
+    return {
+        "purpose": purpose,
+        "provider": provider,
+        "model": model,
+        "options": options,
+        "host": cfg["host"],
+        "failover": chain[1:],
+        "request_fn": request_fn,
+    }
+
+
+def make_backend_call(base_fn, provider, model, options):
+    def call(payload, cancel=None):
+        if model:
+            payload = dict(payload, model=model)
+        return base_fn(apply_call_options(payload, provider, options), cancel=cancel)
+    return call
+
+
+# --- Model readiness ---
+
+def set_model_state(model, **fields):
+    with MODEL_STATUS_LOCK:
+        entry = MODEL_STATUS.get(model)
+        if entry is not None:
+            entry.update(fields, updated=time.time())
+
+
+def mark_model_used(model):
+    with MODEL_STATUS_LOCK:
+        entry = MODEL_STATUS.get(model)
+        if entry is not None and entry["provider"] == "ollama":
+            entry.update(state="ready", error="", last_used=time.time(), updated=time.time())
+
+
+def register_models(tiers, cfg):
+    """One MODEL_STATUS entry per distinct model, listing the call purposes it serves."""
+    with MODEL_STATUS_LOCK:
+        MODEL_STATUS.clear()
+        for purpose, tier in tiers.items():
+            models = [(tier["provider"], tier["model"])]
+            for name in tier.get("failover", []):
+                models.append((name, cfg["deepseek_model"] if name == "deepseek" else cfg["ollama_model"]))
+            if purpose == "vision" and tier["provider"] != "ollama":
+                continue  # Vision only calls a model on Ollama; otherwise filename rules are used.
+            for provider, model in models:
+                entry = MODEL_STATUS.setdefault(model, {
+                    "model": model,
+                    "provider": provider,
+                    "purposes": [],
+                    # Remote APIs have no load step; local models are unknown until warmed or used.
+                    "state": "ready" if provider == "deepseek" else "unknown",
+                    "load_seconds": None,
+                    "error": "",
+                    "last_used": None,
+                    "updated": time.time(),
+                })
+                if purpose not in entry["purposes"]:
+                    entry["purposes"].append(purpose)
+
+
+def warm_model(host, model, timeout):
+    set_model_state(model, state="loading", error="")
+    started = time.time()
+    try:
+        # An empty message list makes Ollama load the model without generating anything.
+        request_ollama_raw(host, {"model": model, "messages": [], "stream": False},
+                           timeout=timeout)
+    except Exception as e:
+        set_model_state(model, state="error", error=str(e)[:200])
+        print(f"[warmup] {model} failed: {e}")
+        return
+    elapsed = time.time() - started
+    set_model_state(model, state="ready", load_seconds=round(elapsed, 2))
+    metrics.observe("model_warmup_seconds", elapsed, model=model)
+    print(f"[warmup] {model} ready in {elapsed:.1f}s")
+
+
+def start_warmup(host, timeout):
+    with MODEL_STATUS_LOCK:
+        models = [m for m, e in MODEL_STATUS.items() if e["provider"] == "ollama"]
+    for model in models:
+        threading.Thread(target=warm_model, args=(host, model, timeout), daemon=True).start()
+
+
+def loaded_ollama_models(host):
+    """Names Ollama currently holds in memory (GET /api/ps), or None if it cannot be asked."""
+    try:
+        with urllib.request.urlopen(f"{host}/api/ps", timeout=1) as resp:
+            data = json.loads(resp.read().decode("utf-8"))
+    except Exception:
+        return None
+    return {m.get("name") for m in data.get("models", [])} | {m.get("model") for m in data.get("models", [])}
+
+
+def model_status():
+    with MODEL_STATUS_LOCK:
+        models = [dict(e, purposes=list(e["purposes"])) for e in MODEL_STATUS.values()]
+    if any(m["provider"] == "ollama" for m in models):
+        loaded = loaded_ollama_models(HOST_CFG.get("host", ""))
+        for m in models:
+            # Ollama unloads idle models after keep_alive; the next call pays the load again.
+            if loaded is not None and m["provider"] == "ollama" and m["state"] == "ready" \
+                    and m["model"] not in loaded:
+                m["state"] = "unloaded"
+    return {
+        "ready": all(m["state"] in ("ready", "unloaded") for m in models),
+        "keep_alive": OLLAMA_KEEP_ALIVE,
+        "models": models,
+    }
+
+
 def init_config():
+    global OLLAMA_KEEP_ALIVE, HISTORY_MAX_MESSAGES, SKILL_INDEX, GRADE_MODE, ADMISSION, PREVIEW_MAX_SIDE
+    global SESSIONS, CASSETTE
     load_env_file()
+    profiling.configure()
+    HISTORY_MAX_MESSAGES = int(os.getenv("HISTORY_MAX_MESSAGES", "40"))
+    GRADE_MODE = os.getenv("GRADE_MODE", "llm").strip().lower()
+    SESSIONS = session_store.open_store()
+    CASSETTE = cassette.from_env()
+    ADMISSION = admission.Admission()
+    PREVIEW_MAX_SIDE = int(os.getenv("ADMIT_PREVIEW_SIDE", "1280"))
+    configure_speculation()
+    SKILL_INDEX = SkillIndex(SKILLS_DIR, skill_catalog.open_catalog(SKILLS_DIR),
+                             float(os.getenv("SKILL_RESCAN_SEC", "2")))
     
     host = os.getenv("OLLAMA_HOST", "http://localhost:11434")
     model = os.getenv("OLLAMA_MODEL", "deepseek-r1:7b")
@@ -736,69 +1665,202 @@ def init_config():
     if not provider:
         provider = "deepseek" if deepseek_api_key else "ollama"
 
+    cfg = {
+        "provider": provider,
+        "host": host,
+        "ollama_model": model,
+        "vision_model": vision_model,
+        "deepseek_model": os.getenv("DEEPSEEK_MODEL", "deepseek-chat"),
+        "deepseek_base_url": deepseek_base_url,
+        "deepseek_api_key": deepseek_api_key,
+        "connect_timeout": float(os.getenv("LLM_CONNECT_TIMEOUT", "5")),
+        "read_timeout": float(os.getenv("LLM_READ_TIMEOUT", "300")),
+    }
+    tiers = {purpose: load_call_tier(purpose, cfg) for purpose in CALL_PURPOSES}
+
     print("-" * 30)
     print(f"Config Initialized:")
     print(f"  Provider: {provider}")
-    print(f"  Model: {model if provider == 'ollama' else os.getenv('DEEPSEEK_MODEL', 'deepseek-chat')}")
+    print(f"  Model: {tiers['answer']['model']}")
     print(f"  OLLAMA_HOST: {host}")
     print(f"  DEEPSEEK_BASE_URL: {deepseek_base_url}")
-    if provider == "deepseek":
+    if any(t["provider"] == "deepseek" for t in tiers.values()):
          print(f"  API Key: {'*' * 6 if deepseek_api_key else 'MISSING'}")
+    for purpose in CALL_PURPOSES:
+        tier = tiers[purpose]
+        failover = f" -> {','.join(tier['failover'])}" if tier["failover"] else ""
+        print(f"  [{purpose}] {tier['provider']}/{tier['model']} {tier['options'] or ''}{failover}")
+    if CASSETTE.mode != "off":
+        print(f"  Cassette: {CASSETTE.mode} ({CASSETTE.path}, speed {CASSETTE.speed:g})")
     print("-" * 30)
 
-    if provider == "deepseek":
-        model = os.getenv("DEEPSEEK_MODEL", "deepseek-chat")
-        if not deepseek_api_key:
+    if any(t["provider"] == "deepseek" for p, t in tiers.items() if p != "vision"):
+        if not deepseek_api_key and CASSETTE.mode != "replay":
             print("Error: DEEPSEEK_API_KEY not found.")
             sys.exit(1)
-        request_fn = lambda payload: request_chat_deepseek(
-            deepseek_base_url, deepseek_api_key, payload
-        )
-    else:
-        request_fn = lambda payload: request_chat_ollama(host, payload)
-        
+
+    OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m").strip()
+    register_models(tiers, cfg)
+    warmup = os.getenv("OLLAMA_WARMUP", "1").strip().lower() in ("1", "true", "yes", "on")
+    if warmup and CASSETTE.mode != "replay":
+        start_warmup(host, float(os.getenv("OLLAMA_WARMUP_TIMEOUT", "600")))
+
+    answer = tiers["answer"]
     return {
-        'request_fn': request_fn,
-        'model': model,
+        'request_fn': answer['request_fn'],
+        'model': answer['model'],
         'vision_model': vision_model,
         'provider': provider,
         'host': host,
+        'tiers': tiers,
     }
 
 
 def open_browser():
-    webbrowser.open("http://localhost:8000")
+    import webbrowser
+    webbrowser.open(f"http://localhost:{SERVER_PORT}")
+
+
+def process_status():
+    lifecycle = LIFECYCLE.snapshot()
+    return {
+        "worker": WORKER_ID,
+        "pid": os.getpid(),
+        "uptime_seconds": round(time.time() - STARTED_AT, 1),
+        # Process start to accepting requests; the manager reports full restart times.
+        "startup_seconds": round(READY_AT - STARTED_AT, 3) if READY_AT else None,
+        "active_requests": sum(lifecycle["active"].values()),
+        "active_work": lifecycle["active"],
+        "live_streams": lifecycle["live_streams"],
+        "idle_seconds": lifecycle["idle_seconds"],
+        "draining": lifecycle["draining"],
+        "admission": ADMISSION.snapshot(),
+        "grade_mode": GRADE_MODE,
+    }
+
+
+def readiness():
+    """(status, body) for /readyz: ready once serving, not ready again while draining."""
+    draining = LIFECYCLE.draining
+    ready = READY_AT is not None and not draining
+    body = json.dumps({"ready": ready, "draining": draining}).encode('utf-8')
+    return (200 if ready else 503), body
+
+
+class HealthHandler(BaseHTTPRequestHandler):
+    """Per-worker /healthz and /readyz on a private port, so the manager can probe each process."""
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path == '/readyz':
+            code, body = readiness()
+        elif self.path == '/healthz':
+            code, body = 200, json.dumps(process_status()).encode('utf-8')
+        else:
+            self.send_response(404)
+            self.end_headers()
+            return
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_health_server(port):
+    health = ThreadingHTTPServer(("127.0.0.1", port), HealthHandler)
+    health.daemon_threads = True
+    threading.Thread(target=health.serve_forever, daemon=True).start()
+    return health
+
+
+def make_http_server(server_address):
+    """Bind normally, or adopt the listening socket a manager passed down in SERVER_LISTEN_FD."""
+    listen_fd = os.getenv("SERVER_LISTEN_FD", "")
+    if not listen_fd:
+        httpd = ThreadingHTTPServer(server_address, ChatHandler)
+    else:
+        httpd = ThreadingHTTPServer(server_address, ChatHandler, bind_and_activate=False)
+        httpd.socket.close()
+        httpd.socket = socket.socket(fileno=int(listen_fd))
+        httpd.server_address = httpd.socket.getsockname()
+        httpd.server_name, httpd.server_port = httpd.server_address[:2]
+    httpd.daemon_threads = True
+    return httpd
+
+
+def signal_ready():
+    """Write "ready" to the pipe a manager passed in SERVER_READY_FD, so it need not poll."""
+    ready_fd = os.getenv("SERVER_READY_FD", "")
+    if not ready_fd:
+        return
+    try:
+        os.write(int(ready_fd), b"ready\n")
+        os.close(int(ready_fd))
+    except (OSError, ValueError):
+        pass
+
+
+def begin_drain(signum=None, frame=None):
+    """Stop accepting (SIGTERM, idle or /shutdown); in-flight work is drained after serve_forever returns."""
+    if HTTPD is None or not LIFECYCLE.begin_drain():
+        return
+    print(f"Draining (pid {os.getpid()})...")
+    # shutdown() blocks until serve_forever exits, so it cannot run on the serving thread.
+    threading.Thread(target=HTTPD.shutdown, daemon=True).start()
+
+
+def report_drain(report):
+    drained = ", ".join(f"{k}={v}" for k, v in sorted(report["drained"].items())) or "none"
+    abandoned = ", ".join(f"{k}={v}" for k, v in sorted(report["abandoned"].items())) or "none"
+    print(f"Drained in {report['seconds']:.2f}s; finished: {drained}; abandoned at deadline: {abandoned}")
 
 
 def monitor_inactivity():
-    while True:
+    while not LIFECYCLE.draining:
         time.sleep(2)
-        if HTTPD is None:
-            continue
-        with ACTIVE_REQUESTS_LOCK:
-            active = ACTIVE_REQUESTS
-        if active > 0:
-            continue
-        if time.time() - LAST_HEARTBEAT > HEARTBEAT_TIMEOUT_SEC:
-            HTTPD.shutdown()
-            break
+        if HTTPD is not None and LIFECYCLE.is_idle():
+            begin_drain()
 
 
 if __name__ == '__main__':
     HOST_CFG = init_config()
     server_host = os.getenv("SERVER_HOST", "127.0.0.1")
-    server_address = (server_host, 8000)
-    print(f"Starting server on http://{server_host}:8000")
+    server_address = (server_host, SERVER_PORT)
+    print(f"Starting server on http://{server_host}:{SERVER_PORT}")
     if "--no-browser" not in sys.argv:
         print("Auto-opening browser...")
         Timer(1, open_browser).start()
     else:
         print("Browser auto-open disabled (--no-browser).")
     
-    HTTPD = HTTPServer(server_address, ChatHandler)
-    threading.Thread(target=monitor_inactivity, daemon=True).start()
+    # eager: import PIL/numpy before serving; background: right after; lazy: on the first image.
+    image_preload = os.getenv("SERVER_IMAGE_PRELOAD", "background").strip().lower()
+    if image_preload == "eager":
+        image_libs()
+    print(f"Skill index: {SKILL_INDEX.warm()} skills")
+
+    HTTPD = make_http_server(server_address)
+    if os.getenv("SERVER_HEALTH_PORT"):
+        start_health_server(int(os.getenv("SERVER_HEALTH_PORT")))
+    if WORKER_ID:
+        print(f"Worker {WORKER_ID} (pid {os.getpid()}) serving, sessions: {SESSIONS.kind}")
+    else:
+        threading.Thread(target=monitor_inactivity, daemon=True).start()
+    signal.signal(signal.SIGTERM, begin_drain)
+    READY_AT = time.time()
+    signal_ready()
+    if image_preload == "background":
+        threading.Thread(target=image_libs, name="preload-image-libs", daemon=True).start()
+    if hasattr(SESSIONS, "warm"):
+        # Replays the session log after the port is up; early requests wait for it.
+        threading.Thread(target=SESSIONS.warm, name="load-sessions", daemon=True).start()
     try:
         HTTPD.serve_forever()
     except KeyboardInterrupt:
         print("\nStopping server...")
-        HTTPD.server_close()
+    if LIFECYCLE.draining:
+        report_drain(LIFECYCLE.wait_drained(DRAIN_TIMEOUT_SEC))
+    HTTPD.server_close()
@@ -0,0 +1,465 @@
+#!/usr/bin/env python3
+"""Per-session chat state (history and active mode) for server workers.
+
+    SESSION_STORE=log      append-only segment log in SESSION_LOG_DIR, shared by every worker
+                           (default where fcntl is available)
+    SESSION_STORE=sqlite   SQLite file at SESSION_DB, shared by every worker (default on Windows)
+    SESSION_STORE=memory   in-process dict; lost when the process exits
+
+State must be shared because consecutive requests of one browser tab can land
+on different worker processes, and durable so restarts and idle shutdowns
+keep conversations. open_store() reads the SESSION_* settings when it is
+called, so server.init_config() opens the store once .env is loaded.
+"""
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: the log store needs flock, fall back to SQLite
+    fcntl = None
+
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.abspath(os.path.join(SCRIPT_DIR, "..", ".."))
+DEFAULT_DB = os.path.join(PROJECT_ROOT, "backend", "data", "sessions.sqlite3")
+DEFAULT_LOG_DIR = os.path.join(PROJECT_ROOT, "backend", "data", "sessions.log.d")
+DEFAULT_SESSION = "default"
+SESSION_ID_RE = re.compile(r"^[A-Za-z0-9_\-]{1,64}$")
+# Sessions untouched for this long are purged (SESSION_TTL).
+SESSION_TTL = 7 * 24 * 3600
+PURGE_EVERY = 200
+DEFAULT_STORE = "log" if fcntl else "sqlite"
+
+
+def normalize_session_id(value):
+    value = (value or "").strip()
+    return value if SESSION_ID_RE.match(value) else DEFAULT_SESSION
+
+
+def empty_state():
+    return {"history": [], "active_mode": None}
+
+
+class MemorySessionStore:
+    kind = "memory"
+
+    def __init__(self, ttl=SESSION_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._writes = 0
+
+    def load(self, session_id):
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            state = entry[1] if entry else empty_state()
+            return {"history": list(state["history"]), "active_mode": state["active_mode"]}
+
+    def save(self, session_id, state):
+        with self._lock:
+            self._sessions[session_id] = (time.time(), {
+                "history": list(state.get("history", [])),
+                "active_mode": state.get("active_mode"),
+            })
+            self._writes += 1
+            if self._writes % PURGE_EVERY == 0:
+                self._purge_locked(self.ttl)
+
+    def delete(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def _purge_locked(self, max_age):
+        cutoff = time.time() - max_age
+        for sid in [sid for sid, (updated, _) in self._sessions.items() if updated < cutoff]:
+            del self._sessions[sid]
+
+    def count(self):
+        with self._lock:
+            return len(self._sessions)
+
+
+class SQLiteSessionStore:
+    """One row per session; WAL mode so workers read while another writes."""
+
+    kind = "sqlite"
+
+    def __init__(self, path=DEFAULT_DB, ttl=SESSION_TTL):
+        self.path = path
+        self.ttl = ttl
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._local = threading.local()
+        self._writes = 0
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "id TEXT PRIMARY KEY, state TEXT NOT NULL, updated REAL NOT NULL)"
+        )
+        conn.commit()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def load(self, session_id):
+        row = self._conn().execute("SELECT state FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        if not row:
+            return empty_state()
+        try:
+            state = json.loads(row[0])
+        except ValueError:
+            return empty_state()
+        return {"history": state.get("history", []), "active_mode": state.get("active_mode")}
+
+    def save(self, session_id, state):
+        data = json.dumps({
+            "history": state.get("history", []),
+            "active_mode": state.get("active_mode"),
+        }, ensure_ascii=False)
+        conn = self._conn()
+        conn.execute(
+            "INSERT INTO sessions (id, state, updated) VALUES (?, ?, ?) "
+            "ON CONFLICT(id) DO UPDATE SET state = excluded.state, updated = excluded.updated",
+            (session_id, data, time.time()),
+        )
+        conn.commit()
+        self._writes += 1
+        if self._writes % PURGE_EVERY == 0:
+            conn.execute("DELETE FROM sessions WHERE updated < ?", (time.time() - self.ttl,))
+            conn.commit()
+
+    def delete(self, session_id):
+        conn = self._conn()
+        conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+        conn.commit()
+
+    def count(self):
+        return self._conn().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+
+# --- Append-only log store ---
+
+SEGMENT_BYTES = 4 * 1024 * 1024
+# Once this many segments exist, the next rotation compacts them into one snapshot.
+MAX_SEGMENTS = 4
+SEGMENT_RE = re.compile(r"^(\d{8})\.log$")
+READ_CHUNK = 1 << 20
+
+
+def history_delta(old, new):
+    """(drop, append) with new == old[drop:] + append, dropping as little as possible."""
+    for drop in range(len(old) + 1):
+        kept = len(old) - drop
+        if kept <= len(new) and new[:kept] == old[drop:]:
+            return drop, new[kept:]
+    return len(old), new
+
+
+class LogSessionStore:
+    """Sessions as an append-only log of per-turn deltas in numbered segment files.
+
+    A save appends one JSON line holding only what changed (history entries
+    dropped from the front, entries appended, the active mode), so its cost
+    does not grow with the conversation. Appends from all threads and
+    processes are serialised by an flock on LOCK, and durability uses group
+    commit: a save returns after an fsync that may cover other concurrent
+    appends too (SESSION_LOG_FSYNC=0 leaves flushing to the OS).
+
+    Every process keeps the full state in memory and tails the segments,
+    applying records written by other workers before each load and save.
+    The active segment rotates at SESSION_LOG_SEGMENT_BYTES. When
+    SESSION_LOG_MAX_SEGMENTS exist, the live sessions (minus those idle for
+    longer than SESSION_TTL) are written as a snapshot segment and the
+    older segments are deleted. The first use replays from the newest
+    snapshot, so disk use and rebuild time stay bounded. A torn last line
+    after a crash is skipped. Concurrent saves of one session are
+    last-writer-wins, as with SQLiteSessionStore.
+    """
+
+    kind = "log"
+
+    def __init__(self, directory=DEFAULT_LOG_DIR, segment_bytes=SEGMENT_BYTES,
+                 max_segments=MAX_SEGMENTS, fsync=True, ttl=SESSION_TTL):
+        self.directory = directory
+        self.ttl = ttl
+        self.segment_bytes = segment_bytes
+        self.max_segments = max(2, max_segments)
+        self.fsync = fsync
+        if fcntl is None:
+            raise RuntimeError("SESSION_STORE=log needs fcntl (POSIX); use SESSION_STORE=sqlite on this platform")
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._lock_fd = os.open(os.path.join(directory, "LOCK"), os.O_RDWR | os.O_CREAT, 0o644)
+        self._sessions = {}
+        self._seg = None
+        self._read_fd = None
+        self._offset = 0
+        self._partial = b""
+        self._write_seg = None
+        self._write_fd = None
+        # Group commit: appends are numbered; one fsync covers every append before it.
+        self._sync_cond = threading.Condition()
+        self._written = 0
+        self._synced = 0
+        self._syncing = False
+        # The in-memory index is built by the first call that catches up (see warm()).
+        with self._lock, self._flocked():
+            self._cleanup_locked()
+
+    # -- files --
+
+    def _path(self, number):
+        return os.path.join(self.directory, f"{number:08d}.log")
+
+    def _segments(self):
+        numbers = []
+        for name in os.listdir(self.directory):
+            m = SEGMENT_RE.match(name)
+            if m:
+                numbers.append(int(m.group(1)))
+        return sorted(numbers)
+
+    @contextmanager
+    def _flocked(self):
+        """Exclusive across processes; taken inside self._lock."""
+        fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    def _cleanup_locked(self):
+        """Drop segments already covered by a newer snapshot (a crash between writing it and deleting them)."""
+        segments = self._segments()
+        snapshots = [n for n in segments if self._is_snapshot(n)]
+        if snapshots:
+            for number in segments:
+                if number < snapshots[-1]:
+                    os.unlink(self._path(number))
+        for name in os.listdir(self.directory):
+            if name.endswith(".tmp"):
+                os.unlink(os.path.join(self.directory, name))
+
+    def _is_snapshot(self, number):
+        with open(self._path(number), "rb") as f:
+            return f.readline().startswith(b'{"op": "snapshot"')
+
+    # -- reading --
+
+    def _catch_up_locked(self):
+        """Apply every record appended since the last call, following rotations and compactions."""
+        while True:
+            if self._read_fd is not None:
+                self._read_available()
+            later = [n for n in self._segments() if self._seg is None or n > self._seg]
+            if not later:
+                return
+            try:
+                fd = os.open(self._path(later[0]), os.O_RDONLY)
+            except FileNotFoundError:
+                continue  # compacted away between listing and opening; list again
+            if self._read_fd is not None:
+                os.close(self._read_fd)
+            self._seg, self._read_fd, self._offset, self._partial = later[0], fd, 0, b""
+
+    def _read_available(self):
+        while True:
+            chunk = os.pread(self._read_fd, READ_CHUNK, self._offset)
+            if not chunk:
+                return
+            self._offset += len(chunk)
+            data = self._partial + chunk
+            lines = data.split(b"\n")
+            self._partial = lines.pop()
+            for line in lines:
+                self._apply_line(line)
+
+    def _apply_line(self, line):
+        try:
+            record = json.loads(line)
+        except ValueError:
+            return  # torn write from a crash
+        op = record.get("op")
+        if op == "snapshot":
+            self._sessions.clear()
+        elif op == "set":
+            self._sessions[record["sid"]] = (record["t"], record["history"], record.get("mode"))
+        elif op == "turn":
+            _, history, _ = self._sessions.get(record["sid"], (0, [], None))
+            self._sessions[record["sid"]] = (record["t"], history[record["drop"]:] + record["add"],
+                                             record.get("mode"))
+        elif op == "del":
+            self._sessions.pop(record["sid"], None)
+
+    # -- writing --
+
+    def _append(self, record):
+        """Append one record (caller holds both locks) and apply it through the reader; returns its number."""
+        self._catch_up_locked()
+        if self._seg is None:
+            self._new_segment_locked()
+            self._catch_up_locked()
+        if self._partial:
+            # A torn line from a crashed writer: terminate it so the next record starts clean.
+            self._write(b"\n")
+        self._write(json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n")
+        self._read_available()
+        with self._sync_cond:
+            self._written += 1
+            seq = self._written
+        if self._offset >= self.segment_bytes:
+            self._rotate_locked()
+        return seq
+
+    def _write(self, data):
+        if self._write_seg != self._seg:
+            self._close_write_fd()
+            self._write_fd = os.open(self._path(self._seg), os.O_WRONLY | os.O_APPEND)
+            self._write_seg = self._seg
+        os.write(self._write_fd, data)
+
+    def _close_write_fd(self):
+        if self._write_fd is None:
+            return
+        with self._sync_cond:
+            while self._syncing:
+                self._sync_cond.wait()
+            if self.fsync:
+                os.fsync(self._write_fd)
+            self._synced = self._written
+        os.close(self._write_fd)
+        self._write_fd = self._write_seg = None
+
+    def _new_segment_locked(self, lines=(), snapshot=False):
+        number = (self._segments() or [0])[-1] + 1
+        tmp = self._path(number) + ".tmp"
+        with open(tmp, "wb") as f:
+            if snapshot:
+                f.write(b'{"op": "snapshot"}\n')
+            for line in lines:
+                f.write(line)
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        os.rename(tmp, self._path(number))
+        if self.fsync:
+            dir_fd = os.open(self.directory, os.O_RDONLY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+        return number
+
+    def _rotate_locked(self):
+        if len(self._segments()) < self.max_segments:
+            self._new_segment_locked()
+        else:
+            self._compact_locked()
+        self._catch_up_locked()
+
+    def _compact_locked(self):
+        cutoff = time.time() - self.ttl
+        lines = [
+            json.dumps({"op": "set", "sid": sid, "t": t, "history": history, "mode": mode},
+                       ensure_ascii=False).encode("utf-8") + b"\n"
+            for sid, (t, history, mode) in self._sessions.items() if t >= cutoff
+        ]
+        snapshot = self._new_segment_locked(lines, snapshot=True)
+        self._close_write_fd()
+        for number in self._segments():
+            if number < snapshot:
+                os.unlink(self._path(number))
+
+    def _sync(self, seq):
+        """Group commit: return once an fsync issued after append `seq` has completed."""
+        if not self.fsync:
+            return
+        with self._sync_cond:
+            while True:
+                if self._synced >= seq:
+                    return
+                if not self._syncing:
+                    break
+                self._sync_cond.wait()
+            self._syncing = True
+            target = self._written
+            fd = self._write_fd
+        try:
+            if fd is not None:
+                os.fsync(fd)
+        finally:
+            with self._sync_cond:
+                self._syncing = False
+                self._synced = max(self._synced, target)
+                self._sync_cond.notify_all()
+
+    def compact(self):
+        with self._lock, self._flocked():
+            self._catch_up_locked()
+            self._compact_locked()
+            self._catch_up_locked()
+
+    # -- store interface --
+
+    def load(self, session_id):
+        with self._lock:
+            self._catch_up_locked()
+            entry = self._sessions.get(session_id)
+        if not entry:
+            return empty_state()
+        return {"history": list(entry[1]), "active_mode": entry[2]}
+
+    def save(self, session_id, state):
+        history = list(state.get("history", []))
+        with self._lock, self._flocked():
+            self._catch_up_locked()
+            _, old, _ = self._sessions.get(session_id, (0, [], None))
+            drop, add = history_delta(old, history)
+            record = {"op": "turn", "sid": session_id, "t": time.time(), "drop": drop, "add": add,
+                      "mode": state.get("active_mode")}
+            seq = self._append(record)
+        self._sync(seq)
+
+    def delete(self, session_id):
+        with self._lock, self._flocked():
+            seq = self._append({"op": "del", "sid": session_id})
+        self._sync(seq)
+
+    def count(self):
+        with self._lock:
+            self._catch_up_locked()
+            return len(self._sessions)
+
+    def warm(self):
+        """Build the in-memory index now instead of on the first request."""
+        return self.count()
+
+    def disk_bytes(self):
+        return sum(os.path.getsize(self._path(n)) for n in self._segments())
+
+
+def open_store(kind=None, path=None):
+    kind = (kind or os.getenv("SESSION_STORE", "") or DEFAULT_STORE).strip().lower()
+    ttl = int(os.getenv("SESSION_TTL", str(SESSION_TTL)))
+    if kind == "sqlite":
+        return SQLiteSessionStore(path or os.getenv("SESSION_DB", "") or DEFAULT_DB, ttl=ttl)
+    if kind == "log":
+        return LogSessionStore(
+            path or os.getenv("SESSION_LOG_DIR", "") or DEFAULT_LOG_DIR,
+            segment_bytes=int(os.getenv("SESSION_LOG_SEGMENT_BYTES", str(SEGMENT_BYTES))),
+            max_segments=int(os.getenv("SESSION_LOG_MAX_SEGMENTS", str(MAX_SEGMENTS))),
+            fsync=os.getenv("SESSION_LOG_FSYNC", "1").strip().lower() not in ("0", "false", "no", "off"),
+            ttl=ttl,
+        )
+    return MemorySessionStore(ttl=ttl)
@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""Compiled catalog of skills/ for large skill libraries.
+
+One SQLite file (`skills/.skill_catalog.sqlite3`) holds, per skill directory,
+the SKILL.md front-matter, a stat signature and sha256 hashes of all files.
+Listing skills then costs one query instead of an open/read per SKILL.md; the
+file is memory-mapped (PRAGMA mmap_size) so listings are served from the page
+cache. SKILL.md bodies and reference sections are still read from the files
+when a skill is used (SkillIndex.document, reference_index), which keeps them
+mtime-checked rather than tied to the last rescan.
+
+Refreshing is incremental: each directory is stat()ed and only directories
+whose SKILL.md or reference files changed (mtime or size) are re-read.
+
+    python3 backend/scripts/skill_catalog.py build              # incremental
+    python3 backend/scripts/skill_catalog.py rebuild            # re-read everything
+    python3 backend/scripts/skill_catalog.py verify             # hashes vs files on disk
+    python3 backend/scripts/skill_catalog.py build --root /path/to/skills
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.abspath(os.path.join(SCRIPT_DIR, "..", ".."))
+DEFAULT_ROOT = os.path.join(PROJECT_ROOT, "skills")
+CATALOG_NAME = ".skill_catalog.sqlite3"
+CATALOG_VERSION = "3"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS info (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS skills (
+    dir TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    description TEXT NOT NULL,
+    front_matter TEXT NOT NULL,
+    signature TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS skills_by_name ON skills (name);
+CREATE TABLE IF NOT EXISTS files (
+    dir TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    sha256 TEXT NOT NULL,
+    PRIMARY KEY (dir, path)
+);
+"""
+
+
+def mmap_bytes():
+    return int(os.getenv("SKILL_CATALOG_MMAP_MB", "256")) * 1024 * 1024
+
+
+# --- Parsing ---
+
+def parse_front_matter(data):
+    """SKILL.md front-matter with the same rules as server.parse_skill_file."""
+    lines = data.decode("utf-8").strip().splitlines()
+    meta = {}
+    if lines and lines[0].strip() == "---":
+        for line in lines[1:]:
+            stripped = line.strip()
+            if stripped == "---":
+                break
+            if ":" in stripped:
+                key, value = stripped.split(":", 1)
+                meta[key.strip()] = value.strip()
+    return meta
+
+
+def _sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def _read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+# --- Scanning ---
+
+def _scan_dir(skill_dir):
+    """Stat signature of one skill directory ("mtime:size" per file), or None if it has no SKILL.md.
+
+    This runs for every directory on every refresh, so it sticks to plain
+    string building; it is most of the cost of a no-change refresh.
+    """
+    try:
+        st = os.stat(skill_dir + "/SKILL.md")
+    except OSError:
+        return None
+    parts = [f"{st.st_mtime_ns}:{st.st_size}"]
+    try:
+        entries = [e for e in os.scandir(skill_dir + "/reference") if not e.name.startswith(".")]
+    except OSError:
+        entries = []
+    if entries:
+        entries.sort(key=lambda e: e.name)
+        for entry in entries:
+            if entry.is_file():
+                ref = entry.stat()
+                parts.append(f"{entry.name}:{ref.st_mtime_ns}:{ref.st_size}")
+    return "|".join(parts)
+
+
+def _reference_names(signature):
+    return [part.rsplit(":", 2)[0] for part in signature.split("|")[1:]]
+
+
+def scan(root):
+    """{directory name: signature} for every skill directory under root."""
+    if not os.path.isdir(root):
+        return {}
+    found = {}
+    for entry in os.scandir(root):
+        if entry.name.startswith(".") or not entry.is_dir():
+            continue
+        signature = _scan_dir(f"{root}/{entry.name}")
+        if signature is not None:
+            found[entry.name] = signature
+    return found
+
+
+class SkillCatalog:
+    def __init__(self, root=DEFAULT_ROOT, path=None):
+        self.root = os.path.abspath(root)
+        self.path = path or os.path.join(self.root, CATALOG_NAME)
+        self._local = threading.local()
+        conn = self._conn()
+        conn.executescript(SCHEMA)
+        row = conn.execute("SELECT value FROM info WHERE key = 'version'").fetchone()
+        if not row or row[0] != CATALOG_VERSION:
+            # Older layouts differ in columns, so drop rather than empty them.
+            conn.execute("BEGIN IMMEDIATE")
+            for table in ("skills", "files", "chunks"):
+                conn.execute(f"DROP TABLE IF EXISTS {table}")
+            conn.execute("COMMIT")
+            conn.executescript(SCHEMA)
+            conn.execute("INSERT OR REPLACE INTO info VALUES ('version', ?)", (CATALOG_VERSION,))
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA mmap_size={mmap_bytes()}")
+            self._local.conn = conn
+        return conn
+
+    def _compile(self, conn, dirname, signature):
+        skill_dir = os.path.join(self.root, dirname)
+        data = _read(os.path.join(skill_dir, "SKILL.md"))
+        meta = parse_front_matter(data)
+        conn.execute(
+            "INSERT OR REPLACE INTO skills VALUES (?, ?, ?, ?, ?)",
+            (dirname, meta.get("name", dirname), meta.get("description", "无描述"),
+             json.dumps(meta, ensure_ascii=False), signature),
+        )
+        conn.execute("INSERT INTO files VALUES (?, 'SKILL.md', ?, ?)", (dirname, len(data), _sha256(data)))
+        for name in _reference_names(signature):
+            rel = f"reference/{name}"
+            ref = _read(os.path.join(skill_dir, rel))
+            conn.execute("INSERT INTO files VALUES (?, ?, ?, ?)", (dirname, rel, len(ref), _sha256(ref)))
+
+    def _forget(self, conn, dirname):
+        for table in ("skills", "files"):
+            conn.execute(f"DELETE FROM {table} WHERE dir = ?", (dirname,))
+
+    def refresh(self, force=False):
+        """Re-compile changed directories and drop removed ones; returns counts and timing."""
+        started = time.perf_counter()
+        current = scan(self.root)
+        conn = self._conn()
+        stored = dict(conn.execute("SELECT dir, signature FROM skills"))
+        changed = [d for d, sig in sorted(current.items()) if force or stored.get(d) != sig]
+        removed = [d for d in stored if d not in current]
+        if changed or removed:
+            # IMMEDIATE: several workers may refresh at once; one writes, the others wait.
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for dirname in removed:
+                    self._forget(conn, dirname)
+                for dirname in changed:
+                    self._forget(conn, dirname)
+                    try:
+                        self._compile(conn, dirname, current[dirname])
+                    except (OSError, UnicodeDecodeError) as e:
+                        print(f"[skill_catalog] skipping {dirname}: {e}", file=sys.stderr)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        fingerprint = hashlib.sha256(repr(sorted(current.items())).encode("utf-8")).hexdigest()
+        return {
+            # Changes whenever any skill directory does, even if another process compiled it.
+            "fingerprint": fingerprint,
+            "skills": len(current),
+            "compiled": len(changed),
+            "removed": len(removed),
+            "seconds": round(time.perf_counter() - started, 4),
+        }
+
+    def skills(self):
+        """Entries in directory order: name, description, meta, dir, file."""
+        rows = self._conn().execute(
+            "SELECT dir, name, description, front_matter FROM skills ORDER BY dir"
+        ).fetchall()
+        return [self._entry(*row) for row in rows]
+
+    def _entry(self, dirname, name, description, front_matter):
+        skill_dir = f"{self.root}/{dirname}"
+        return {
+            "name": name,
+            "description": description,
+            "meta": json.loads(front_matter),
+            "dir": skill_dir,
+            "file": f"{skill_dir}/SKILL.md",
+        }
+
+    def verify(self):
+        """Problems between the catalog and the files on disk, as human-readable strings."""
+        problems = []
+        current = scan(self.root)
+        conn = self._conn()
+        stored = dict(conn.execute("SELECT dir, signature FROM skills"))
+        for dirname in sorted(set(current) - set(stored)):
+            problems.append(f"{dirname}: 未编入目录")
+        for dirname in sorted(set(stored) - set(current)):
+            problems.append(f"{dirname}: 目录中存在但磁盘上已删除")
+        for dirname, rel, size, digest in conn.execute("SELECT dir, path, size, sha256 FROM files ORDER BY dir, path"):
+            if dirname not in current:
+                continue
+            try:
+                data = _read(os.path.join(self.root, dirname, rel))
+            except OSError:
+                problems.append(f"{dirname}/{rel}: 文件缺失")
+                continue
+            if len(data) != size or _sha256(data) != digest:
+                problems.append(f"{dirname}/{rel}: 内容与目录中的哈希不一致")
+        return problems
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+def open_catalog(root=DEFAULT_ROOT):
+    """Catalog at SKILL_CATALOG (default skills/.skill_catalog.sqlite3), or None if disabled or unwritable."""
+    setting = os.getenv("SKILL_CATALOG", "").strip()
+    if setting.lower() in ("0", "off", "false", "no"):
+        return None
+    path = setting if setting and setting.lower() not in ("1", "on", "true", "yes") else None
+    try:
+        return SkillCatalog(root, path)
+    except sqlite3.Error as e:
+        print(f"[skill_catalog] disabled: {e}", file=sys.stderr)
+        return None
+
+
+def main():
+    args = sys.argv[1:]
+    root = DEFAULT_ROOT
+    if "--root" in args:
+        i = args.index("--root")
+        if i + 1 >= len(args):
+            args = []
+        else:
+            root = args[i + 1]
+            del args[i:i + 2]
+    if len(args) != 1 or args[0] not in ("build", "rebuild", "verify"):
+        print("用法:")
+        print("  python3 backend/scripts/skill_catalog.py build [--root skills_dir]")
+        print("  python3 backend/scripts/skill_catalog.py rebuild [--root skills_dir]")
+        print("  python3 backend/scripts/skill_catalog.py verify [--root skills_dir]")
+        sys.exit(1)
+    catalog = SkillCatalog(root)
+    if args[0] == "verify":
+        problems = catalog.verify()
+        for problem in problems:
+            print(problem)
+        print(f"{catalog.path}: {'发现 %d 个问题' % len(problems) if problems else '与磁盘一致'}")
+        sys.exit(1 if problems else 0)
+    report = catalog.refresh(force=args[0] == "rebuild")
+    print(f"{catalog.path}: {report['skills']} 个技能，重新编译 {report['compiled']} 个，"
+          f"移除 {report['removed']} 个，用时 {report['seconds'] * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
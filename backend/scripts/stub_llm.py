@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""Local stub LLM provider for offline benchmarks.
+
+Speaks both the DeepSeek (OpenAI-style) `/chat/completions` and the Ollama
+`/api/chat` protocols, with configurable latency, token rate and streaming.
+Faults can be injected to exercise retries and failover: a share of requests
+fails with --fail-status or hangs for --hang-seconds. POST /config updates
+CONFIG at runtime.
+
+    python3 backend/scripts/stub_llm.py --port 11500 --latency 0.2 --token-rate 80
+    DEEPSEEK_BASE_URL=http://127.0.0.1:11500 DEEPSEEK_API_KEY=stub python3 backend/scripts/server.py --no-browser
+    OLLAMA_HOST=http://127.0.0.1:11500 LLM_PROVIDER=ollama python3 backend/scripts/server.py --no-browser
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+DEFAULT_REPLY = (
+    "调整摘要：先校正曝光与白平衡，再压高光、提阴影，做出通透的电影感。\n"
+    "全局参数：曝光 +10~+20，对比度 +15~+25，色温 +5~+10，饱和度 +10~+15。\n"
+    "局部参数：高光 -30~-20，阴影 +20~+30，白色 +5，黑色 -10，清晰度 +10~+15。"
+)
+
+CONFIG = {
+    "latency": 0.0,
+    "token_rate": 0.0,
+    "chars_per_token": 2,
+    "reply": DEFAULT_REPLY,
+    "route": "summary-skill",
+    "city": "北京",
+    "category": "landscape",
+    "fail_rate": 0.0,
+    "fail_status": 503,
+    "hang_rate": 0.0,
+    "hang_seconds": 60.0,
+}
+STATS = {"requests": 0, "failed": 0, "hung": 0}
+STATS_LOCK = threading.Lock()
+# Message-prefix hashes seen so far, to mimic DeepSeek context caching.
+PREFIX_CACHE = set()
+# Models "loaded" by an Ollama request, for GET /api/ps.
+LOADED_MODELS = {}
+
+
+def pick_reply(messages):
+    system = " ".join(m.get("content", "") for m in messages if m.get("role") == "system")
+    if "技能名称" in system:
+        return CONFIG["route"]
+    if "城市名" in system:
+        return CONFIG["city"]
+    prompt = " ".join(m.get("content", "") for m in messages)
+    if "图像分类器" in prompt:
+        return CONFIG["category"]
+    return CONFIG["reply"]
+
+
+def split_tokens(text):
+    step = max(1, CONFIG["chars_per_token"])
+    return [text[i:i + step] for i in range(0, len(text), step)]
+
+
+def prompt_token_count(messages):
+    chars = sum(len(m.get("content", "")) for m in messages)
+    return max(1, chars // max(1, CONFIG["chars_per_token"]))
+
+
+def cached_prefix_tokens(messages):
+    """Tokens covered by the longest whole-message prefix seen before; records all prefixes."""
+    hit = 0
+    running = 0
+    digest = hashlib.sha1()
+    with STATS_LOCK:
+        for message in messages:
+            digest.update(json.dumps(message, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+            key = digest.hexdigest()
+            running += prompt_token_count([message])
+            if key in PREFIX_CACHE:
+                hit = running
+            else:
+                PREFIX_CACHE.add(key)
+    return hit
+
+
+def token_delay():
+    rate = CONFIG["token_rate"]
+    return 1.0 / rate if rate > 0 else 0.0
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b"{}"
+        return json.loads(raw or b"{}")
+
+    def _send_json(self, status, data):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _start_stream(self, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _end_stream(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            self._send_json(200, {"models": []})
+        elif self.path == "/api/ps":
+            with STATS_LOCK:
+                models = [{"name": name, "model": name, "keep_alive": keep}
+                          for name, keep in LOADED_MODELS.items()]
+            self._send_json(200, {"models": models})
+        elif self.path == "/stats":
+            with STATS_LOCK:
+                self._send_json(200, dict(STATS))
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        try:
+            payload = self._read_json()
+        except ValueError:
+            self._send_json(400, {"error": "invalid json"})
+            return
+        if self.path == "/config":
+            for key, value in payload.items():
+                if key in CONFIG:
+                    CONFIG[key] = type(CONFIG[key])(value)
+            self._send_json(200, CONFIG)
+            return
+        with STATS_LOCK:
+            STATS["requests"] += 1
+        if self._inject_fault():
+            return
+        messages = payload.get("messages") or []
+        reply = pick_reply(messages)
+        tokens = split_tokens(reply)
+        limit = payload.get("max_tokens") or (payload.get("options") or {}).get("num_predict")
+        if limit:
+            tokens = tokens[:int(limit)]
+            reply = "".join(tokens)
+        if CONFIG["latency"]:
+            time.sleep(CONFIG["latency"])
+
+        if self.path == "/chat/completions":
+            self._deepseek(payload, messages, reply, tokens)
+        elif self.path == "/api/chat":
+            self._ollama(payload, reply, tokens)
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def _inject_fault(self):
+        roll = random.random()
+        if roll < CONFIG["fail_rate"]:
+            with STATS_LOCK:
+                STATS["failed"] += 1
+            self._send_json(CONFIG["fail_status"], {"error": "injected failure"})
+            return True
+        if roll < CONFIG["fail_rate"] + CONFIG["hang_rate"]:
+            with STATS_LOCK:
+                STATS["hung"] += 1
+            time.sleep(CONFIG["hang_seconds"])
+            self.close_connection = True
+            return True
+        return False
+
+    def _deepseek(self, payload, messages, reply, tokens):
+        model = payload.get("model", "stub")
+        prompt_tokens = sum(prompt_token_count([m]) for m in messages)
+        hit = min(prompt_tokens, cached_prefix_tokens(messages))
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(tokens),
+            "prompt_cache_hit_tokens": hit,
+            "prompt_cache_miss_tokens": prompt_tokens - hit,
+        }
+        delay = token_delay()
+        if not payload.get("stream"):
+            time.sleep(delay * len(tokens))
+            self._send_json(200, {
+                "id": "stub",
+                "object": "chat.completion",
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": reply},
+                    "finish_reason": "stop",
+                }],
+                "usage": usage,
+            })
+            return
+        self._start_stream("text/event-stream")
+        for tok in tokens:
+            if delay:
+                time.sleep(delay)
+            chunk = {"choices": [{"index": 0, "delta": {"content": tok}}], "model": model}
+            self._write_chunk(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+        final = {"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "usage": usage}
+        self._write_chunk(f"data: {json.dumps(final)}\n\n".encode("utf-8"))
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._end_stream()
+
+    def _ollama(self, payload, reply, tokens):
+        model = payload.get("model", "stub")
+        with STATS_LOCK:
+            LOADED_MODELS[model] = payload.get("keep_alive")
+        delay = token_delay()
+        # Ollama streams by default unless the caller sends "stream": false.
+        if payload.get("stream") is False:
+            time.sleep(delay * len(tokens))
+            self._send_json(200, {
+                "model": model,
+                "message": {"role": "assistant", "content": reply},
+                "done": True,
+                "eval_count": len(tokens),
+            })
+            return
+        self._start_stream("application/x-ndjson")
+        for tok in tokens:
+            if delay:
+                time.sleep(delay)
+            line = {"model": model, "message": {"role": "assistant", "content": tok}, "done": False}
+            self._write_chunk((json.dumps(line, ensure_ascii=False) + "\n").encode("utf-8"))
+        final = {"model": model, "message": {"role": "assistant", "content": ""}, "done": True,
+                 "eval_count": len(tokens)}
+        self._write_chunk((json.dumps(final) + "\n").encode("utf-8"))
+        self._end_stream()
+
+
+def make_server(host="127.0.0.1", port=11500, **overrides):
+    for key, value in overrides.items():
+        if value is not None:
+            CONFIG[key] = value
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stub DeepSeek/Ollama provider")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11500)
+    parser.add_argument("--latency", type=float, default=0.0, help="固定首包延迟（秒）")
+    parser.add_argument("--token-rate", type=float, default=0.0, help="每秒输出 token 数，0 表示不限")
+    parser.add_argument("--reply", default=None, help="主回答文本")
+    parser.add_argument("--route", default=None, help="技能选择器返回的技能名")
+    parser.add_argument("--city", default=None, help="城市提取返回值")
+    parser.add_argument("--fail-rate", type=float, default=None, help="按比例返回错误状态码（0~1）")
+    parser.add_argument("--fail-status", type=int, default=None, help="注入错误时的状态码，默认 503")
+    parser.add_argument("--hang-rate", type=float, default=None, help="按比例挂起请求不响应（0~1）")
+    parser.add_argument("--hang-seconds", type=float, default=None, help="挂起时长（秒），默认 60")
+    args = parser.parse_args()
+
+    server = make_server(
+        args.host,
+        args.port,
+        latency=args.latency,
+        token_rate=args.token_rate,
+        reply=args.reply,
+        route=args.route,
+        city=args.city,
+        fail_rate=args.fail_rate,
+        fail_status=args.fail_status,
+        hang_rate=args.hang_rate,
+        hang_seconds=args.hang_seconds,
+    )
+    print(f"Stub LLM listening on http://{args.host}:{server.server_address[1]}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+import os
+import sys
+import threading
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+
+import admission  # noqa: E402
+
+
+def lanes(concurrency=1, queue=1, wait=1.0, rate=0.0, burst=1):
+    return {"text": (concurrency, queue, wait, rate, burst)}
+
+
+class AdmissionTest(unittest.TestCase):
+    def test_settings_read_at_construction(self):
+        with mock.patch.dict(os.environ, {"ADMISSION": "0", "ADMIT_TEXT_CONCURRENCY": "3"}):
+            gate = admission.Admission()
+        self.assertFalse(gate.enabled)
+        self.assertEqual(gate.lanes["text"].concurrency, 3)
+        with mock.patch.dict(os.environ, {"ADMISSION": "1"}):
+            self.assertTrue(admission.Admission().enabled)
+
+    def test_disabled_admits_everything(self):
+        gate = admission.Admission(enabled=False, lanes=lanes(concurrency=1, queue=0))
+        with gate.admit("text") as first, gate.admit("text") as second:
+            self.assertIsNone(first)
+            self.assertIsNone(second)
+        self.assertEqual(gate.snapshot(), {})
+
+    def test_queue_full_is_503(self):
+        gate = admission.Admission(enabled=True, lanes=lanes(concurrency=1, queue=0))
+        with gate.admit("text") as ticket:
+            self.assertFalse(ticket.queued)
+            with self.assertRaises(admission.Rejected) as caught:
+                with gate.admit("text"):
+                    pass
+        self.assertEqual((caught.exception.status, caught.exception.reason), (503, "queue_full"))
+        with gate.admit("text"):
+            pass
+
+    def test_queued_request_runs_when_slot_frees(self):
+        gate = admission.Admission(enabled=True, lanes=lanes(concurrency=1, queue=1, wait=5.0))
+        holding = threading.Event()
+        release = threading.Event()
+
+        def hold():
+            with gate.admit("text"):
+                holding.set()
+                release.wait(5)
+
+        worker = threading.Thread(target=hold)
+        worker.start()
+        holding.wait(5)
+        threading.Timer(0.1, release.set).start()
+        with gate.admit("text") as ticket:
+            self.assertTrue(ticket.queued)
+            self.assertTrue(gate.under_pressure(ticket))
+            self.assertGreater(ticket.waited, 0)
+        worker.join(5)
+        self.assertEqual(gate.snapshot()["text"]["running"], 0)
+
+    def test_deadline_expires_while_queued(self):
+        gate = admission.Admission(enabled=True, lanes=lanes(concurrency=1, queue=1))
+        with gate.admit("text"):
+            started = time.monotonic()
+            with self.assertRaises(admission.Rejected) as caught:
+                with gate.admit("text", budget=0.05):
+                    pass
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual((caught.exception.status, caught.exception.reason), (503, "deadline"))
+
+    def test_rate_limit_is_per_client(self):
+        gate = admission.Admission(enabled=True, lanes=lanes(concurrency=4, queue=0, rate=0.1, burst=2))
+        for _ in range(2):
+            with gate.admit("text", "10.0.0.1"):
+                pass
+        with self.assertRaises(admission.Rejected) as caught:
+            with gate.admit("text", "10.0.0.1"):
+                pass
+        self.assertEqual((caught.exception.status, caught.exception.reason), (429, "rate_limited"))
+        self.assertGreaterEqual(caught.exception.retry_after, 1)
+        with gate.admit("text", "10.0.0.2"):
+            pass
+
+    def test_parse_deadline(self):
+        self.assertEqual(admission.parse_deadline("1500"), 1.5)
+        self.assertIsNone(admission.parse_deadline("0"))
+        self.assertIsNone(admission.parse_deadline("soon"))
+        self.assertIsNone(admission.parse_deadline(None))
+
+
+if __name__ == "__main__":
+    unittest.main()
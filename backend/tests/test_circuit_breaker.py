@@ -0,0 +1,153 @@
+import os
+import sys
+import time
+import unittest
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+
+from providers import (  # noqa: E402
+    CircuitBreaker, ProviderError, ProviderUnavailable, RequestCancelled, ResilientClient,
+)
+
+RESET = 0.05
+
+
+def tripped(threshold=3):
+    breaker = CircuitBreaker(threshold, RESET)
+    for _ in range(threshold):
+        breaker.record_failure()
+    return breaker
+
+
+def half_open(threshold=3):
+    breaker = tripped(threshold)
+    time.sleep(RESET * 2)
+    return breaker
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    def test_opens_after_threshold_consecutive_failures(self):
+        breaker = CircuitBreaker(3, RESET)
+        self.assertFalse(breaker.record_failure())
+        self.assertFalse(breaker.record_failure())
+        self.assertEqual(breaker.state, "closed")
+        self.assertTrue(breaker.record_failure())
+        self.assertEqual(breaker.state, "open")
+        self.assertFalse(breaker.allow())
+
+    def test_success_resets_the_count(self):
+        breaker = CircuitBreaker(3, RESET)
+        breaker.record_failure()
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "closed")
+
+    def test_half_open_lets_one_probe_through(self):
+        breaker = half_open()
+        self.assertEqual(breaker.state, "half_open")
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+
+    def test_probe_success_closes(self):
+        breaker = half_open()
+        breaker.allow()
+        breaker.record_success()
+        self.assertEqual(breaker.state, "closed")
+        self.assertTrue(breaker.allow())
+        self.assertTrue(breaker.allow())
+
+    def test_probe_failure_reopens(self):
+        breaker = half_open()
+        breaker.allow()
+        self.assertTrue(breaker.record_failure())
+        self.assertEqual(breaker.state, "open")
+        self.assertFalse(breaker.allow())
+
+    def test_release_frees_the_probe(self):
+        breaker = half_open()
+        self.assertTrue(breaker.allow())
+        breaker.release()
+        self.assertEqual(breaker.state, "half_open")
+        self.assertTrue(breaker.allow())
+
+    def test_threshold_zero_disables(self):
+        breaker = CircuitBreaker(0, RESET)
+        for _ in range(10):
+            self.assertFalse(breaker.record_failure())
+        self.assertTrue(breaker.allow())
+        self.assertEqual(breaker.state, "closed")
+
+
+class ResilientClientBreakerTest(unittest.TestCase):
+    def client(self, *backends, threshold=2):
+        named = [(f"test-{uuid.uuid4().hex}", fn) for fn in backends]
+        client = ResilientClient(named, retries=0, backoff_base=0, breaker_threshold=threshold,
+                                 breaker_reset=RESET)
+        return client, [breaker for _, _, breaker, _ in client.backends]
+
+    def test_fails_over_while_primary_is_open(self):
+        calls = []
+
+        def broken(payload, cancel):
+            calls.append("primary")
+            raise ProviderError(503, "down")
+
+        client, (primary, _) = self.client(broken, lambda payload, cancel: "backup")
+        for _ in range(3):
+            self.assertEqual(client.call({}), "backup")
+        self.assertEqual(primary.state, "open")
+        self.assertEqual(calls, ["primary", "primary"])
+
+    def test_all_open_raises_unavailable(self):
+        def broken(payload, cancel):
+            raise ProviderError(503, "down")
+
+        client, _ = self.client(broken, threshold=1)
+        with self.assertRaises(ProviderError):
+            client.call({})
+        with self.assertRaises(ProviderUnavailable):
+            client.call({})
+
+    def test_client_error_counts_as_healthy_probe(self):
+        statuses = [503, 503, 400]
+
+        def backend(payload, cancel):
+            raise ProviderError(statuses.pop(0), "")
+
+        client, (breaker,) = self.client(backend)
+        for _ in range(2):
+            with self.assertRaises(ProviderError):
+                client.call({})
+        self.assertEqual(breaker.state, "open")
+        time.sleep(RESET * 2)
+        with self.assertRaises(ProviderError) as caught:
+            client.call({})
+        self.assertEqual(caught.exception.status, 400)
+        self.assertEqual(breaker.state, "closed")
+
+    def test_cancelled_probe_releases_slot(self):
+        outcomes = [ProviderError(503, ""), ProviderError(503, ""), RequestCancelled(), "ok"]
+
+        def backend(payload, cancel):
+            outcome = outcomes.pop(0)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+
+        client, (breaker,) = self.client(backend)
+        for _ in range(2):
+            with self.assertRaises(ProviderError):
+                client.call({})
+        time.sleep(RESET * 2)
+        with self.assertRaises(RequestCancelled):
+            client.call({})
+        self.assertEqual(breaker.state, "half_open")
+        self.assertEqual(client.call({}), "ok")
+        self.assertEqual(breaker.state, "closed")
+
+
+if __name__ == "__main__":
+    unittest.main()
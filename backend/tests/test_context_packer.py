@@ -0,0 +1,110 @@
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+
+import context_packer  # noqa: E402
+from context_packer import message_tokens, pack_context, select_history, trim_history  # noqa: E402
+
+
+def history(turns, words=20):
+    messages = []
+    for i in range(turns):
+        messages.append({"role": "user", "content": f"question {i} " + "word " * words})
+        messages.append({"role": "assistant", "content": f"answer {i} " + "word " * words})
+    return messages
+
+
+def section(name, title, text, order):
+    return {"name": name, "title": title, "text": text, "order": order,
+            "tokens": context_packer.estimate_tokens(text)}
+
+
+class SelectHistoryTest(unittest.TestCase):
+    def test_everything_fits(self):
+        msgs = history(3)
+        kept, used = select_history(msgs, 10_000)
+        self.assertEqual(kept, msgs)
+        self.assertEqual(used, sum(message_tokens(m) for m in msgs))
+
+    def test_start_moves_in_whole_blocks(self):
+        msgs = history(10)
+        block = context_packer.history_block_messages()
+        for budget in range(50, 600, 25):
+            kept, used = select_history(msgs, budget)
+            if not kept:
+                continue
+            start = len(msgs) - len(kept)
+            self.assertEqual(kept, msgs[start:])
+            self.assertLessEqual(used, budget)
+            if start % block:
+                # Only the newest-first fallback starts mid-block, when not even the last block fits.
+                self.assertGreater(sum(message_tokens(m) for m in msgs[-block:]), budget)
+
+    def test_same_prefix_across_turns(self):
+        msgs = history(8)
+        budget = sum(message_tokens(m) for m in msgs[6:])
+        first, _ = select_history(msgs, budget)
+        second, _ = select_history(msgs + history(1), budget)
+        self.assertEqual(first[0], second[0])
+
+    def test_newest_turn_truncated_when_nothing_fits(self):
+        msgs = history(2, words=400)
+        kept, used = select_history(msgs, 200)
+        self.assertEqual([m["role"] for m in kept], ["user", "assistant"])
+        self.assertTrue(kept[-1]["content"].endswith(context_packer.TRUNCATION_MARK))
+        self.assertLessEqual(used, 200)
+
+    def test_block_size_read_per_call(self):
+        with mock.patch.dict(os.environ, {"CONTEXT_HISTORY_BLOCK_TURNS": "3"}):
+            self.assertEqual(context_packer.history_block_messages(), 6)
+        with mock.patch.dict(os.environ, {"CONTEXT_HISTORY_BLOCK_TURNS": "1"}):
+            self.assertEqual(trim_history(history(5), 6), history(5)[4:])
+
+
+class PackContextTest(unittest.TestCase):
+    def test_layout(self):
+        refs = [section("reference/a.md", "A", "## A\nalpha", 0)]
+        messages, stats = pack_context("system", history(2), "now", refs, budget=4000, dynamic="hint")
+        self.assertEqual(messages[0], {"role": "system", "content": "system"})
+        self.assertEqual(messages[1:5], history(2))
+        self.assertEqual(messages[5]["role"], "system")
+        self.assertIn("alpha", messages[5]["content"])
+        self.assertIn("hint", messages[5]["content"])
+        self.assertEqual(messages[-1], {"role": "user", "content": "now"})
+        self.assertEqual(stats["reference_sections"], 1)
+        self.assertEqual(stats["history_messages"], 4)
+
+    def test_stays_within_budget(self):
+        refs = [section("reference/a.md", f"S{i}", "## S\n" + "text " * 100, i) for i in range(10)]
+        for budget in (300, 800, 2000):
+            _, stats = pack_context("system " * 50, history(30), "question", refs, budget=budget)
+            self.assertLessEqual(stats["tokens"], budget)
+            self.assertLess(stats["reference_sections"], 10)
+
+    def test_references_keep_priority_order_and_render_in_file_order(self):
+        refs = [section("reference/b.md", "late", "## late\nsecond", 5),
+                section("reference/a.md", "early", "## early\nfirst", 1)]
+        messages, _ = pack_context("system", [], "q", refs, budget=4000)
+        context = messages[1]["content"]
+        self.assertLess(context.index("reference/a.md"), context.index("reference/b.md"))
+
+    def test_budget_read_per_call(self):
+        with mock.patch.dict(os.environ, {"CONTEXT_TOKEN_BUDGET": "150"}):
+            _, small = pack_context("system", history(10), "q")
+        with mock.patch.dict(os.environ, {"CONTEXT_TOKEN_BUDGET": "100000"}):
+            _, large = pack_context("system", history(10), "q")
+        self.assertEqual((small["budget"], large["budget"]), (150, 100000))
+        self.assertLess(small["history_messages"], large["history_messages"])
+        self.assertEqual(large["history_dropped"], 0)
+
+    def test_no_context_message_without_references(self):
+        messages, stats = pack_context("system", [], "q", budget=1000)
+        self.assertEqual([m["role"] for m in messages], ["system", "user"])
+        self.assertEqual(stats["context_tokens"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
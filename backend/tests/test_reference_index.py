@@ -0,0 +1,80 @@
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+
+import reference_index  # noqa: E402
+
+
+GRADING = """# 色彩校正
+
+## 电影感
+降低饱和度，压暗高光，阴影偏青，高光偏橙。
+
+## 人像肤色
+肤色偏红时降低红色饱和度，适当提亮橙色明度。
+
+## Export
+Export as 16-bit TIFF for print, JPEG quality 90 for web.
+"""
+
+NOTES = """# Notes
+
+## Lenses
+A 50mm prime lens is a good default for portraits.
+"""
+
+
+class SearchTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+        self.skill = self._tmp.name
+        os.makedirs(os.path.join(self.skill, "reference"))
+        self.write("grading.md", GRADING)
+        self.write("notes.md", NOTES)
+
+    def write(self, name, text):
+        with open(os.path.join(self.skill, "reference", name), "w", encoding="utf-8") as f:
+            f.write(text)
+
+    def titles(self, query, k=None):
+        return [s["title"] for s in reference_index.search(self.skill, query, k)]
+
+    def test_best_match_first(self):
+        sections = reference_index.search(self.skill, "电影感怎么调")
+        self.assertEqual(sections[0]["title"], "电影感")
+        self.assertEqual(sections[0]["name"], "reference/grading.md")
+        scores = [s["score"] for s in sections]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+
+    def test_latin_terms(self):
+        self.assertEqual(self.titles("which lens suits portraits"), ["Lenses"])
+        self.assertEqual(self.titles("export tiff"), ["Export"])
+
+    def test_unrelated_query_returns_nothing(self):
+        self.assertEqual(self.titles("hello"), [])
+        self.assertEqual(self.titles(""), [])
+
+    def test_top_k(self):
+        self.assertEqual(len(self.titles("饱和度 高光 肤色 lens export", k=2)), 2)
+        with mock.patch.dict(os.environ, {"REFERENCE_TOP_K": "1"}):
+            self.assertEqual(len(self.titles("饱和度 高光 肤色 lens export")), 1)
+
+    def test_index_follows_file_changes(self):
+        self.assertEqual(self.titles("aperture"), [])
+        self.write("notes.md", NOTES + "\n## Aperture\nWide aperture for a shallow depth of field.\n")
+        self.assertEqual(self.titles("aperture"), ["Aperture"])
+        os.remove(os.path.join(self.skill, "reference", "notes.md"))
+        self.assertEqual(self.titles("lens"), [])
+
+    def test_skill_without_references(self):
+        with tempfile.TemporaryDirectory() as empty:
+            self.assertEqual(reference_index.search(empty, "电影感"), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
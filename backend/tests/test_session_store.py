@@ -0,0 +1,107 @@
+import os
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+
+import session_store  # noqa: E402
+
+
+def turns(n, start=0):
+    return [{"role": "user" if i % 2 == 0 else "assistant", "content": f"message {i}"}
+            for i in range(start, start + n)]
+
+
+@unittest.skipIf(session_store.fcntl is None, "the log store needs fcntl")
+class LogSessionStoreTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+        self.dir = self._tmp.name
+
+    def store(self, **kwargs):
+        kwargs.setdefault("fsync", False)
+        return session_store.LogSessionStore(self.dir, **kwargs)
+
+    def test_reopen_replays_saves_and_deletes(self):
+        store = self.store()
+        store.save("a", {"history": turns(4), "active_mode": "grading"})
+        store.save("b", {"history": turns(2), "active_mode": None})
+        store.delete("b")
+
+        reopened = self.store()
+        self.assertEqual(reopened.load("a"), {"history": turns(4), "active_mode": "grading"})
+        self.assertEqual(reopened.load("b"), session_store.empty_state())
+        self.assertEqual(reopened.count(), 1)
+
+    def test_trimmed_history_is_stored_as_delta(self):
+        store = self.store()
+        store.save("a", {"history": turns(6)})
+        store.save("a", {"history": turns(6, start=2)})
+        self.assertEqual(self.store().load("a")["history"], turns(6, start=2))
+
+    def test_other_instance_sees_new_records(self):
+        writer, reader = self.store(), self.store()
+        self.assertEqual(reader.count(), 0)
+        writer.save("a", {"history": turns(2)})
+        self.assertEqual(reader.load("a")["history"], turns(2))
+
+    def test_rotation_compacts_old_segments(self):
+        store = self.store(segment_bytes=256, max_segments=3)
+        for i in range(60):
+            store.save(f"s{i % 5}", {"history": turns(2, start=i)})
+        self.assertLessEqual(len(store._segments()), 3)
+
+        reopened = self.store()
+        for n in range(5):
+            last = 55 + n
+            self.assertEqual(reopened.load(f"s{n}")["history"], turns(2, start=last))
+
+    def test_compaction_drops_expired_sessions(self):
+        store = self.store(ttl=0.5)
+        store.save("old", {"history": turns(2)})
+        time.sleep(1.0)
+        store.save("new", {"history": turns(2)})
+        store.compact()
+        reopened = self.store()
+        self.assertEqual(reopened.load("old"), session_store.empty_state())
+        self.assertEqual(reopened.load("new")["history"], turns(2))
+
+    def test_torn_last_line_is_skipped(self):
+        store = self.store()
+        store.save("a", {"history": turns(2)})
+        with open(store._path(store._segments()[-1]), "ab") as f:
+            f.write(b'{"op": "turn", "sid": "a", "t": 1, "dr')
+
+        reopened = self.store()
+        self.assertEqual(reopened.load("a")["history"], turns(2))
+        reopened.save("b", {"history": turns(1)})
+        again = self.store()
+        self.assertEqual(again.load("a")["history"], turns(2))
+        self.assertEqual(again.load("b")["history"], turns(1))
+
+    def test_open_store_reads_settings_when_called(self):
+        env = {
+            "SESSION_STORE": "log",
+            "SESSION_LOG_DIR": self.dir,
+            "SESSION_LOG_MAX_SEGMENTS": "7",
+            "SESSION_LOG_FSYNC": "0",
+            "SESSION_TTL": "60",
+        }
+        with mock.patch.dict(os.environ, env):
+            store = session_store.open_store()
+        self.assertEqual((store.kind, store.max_segments, store.fsync, store.ttl), ("log", 7, False, 60))
+
+
+class HistoryDeltaTest(unittest.TestCase):
+    def test_delta(self):
+        self.assertEqual(session_store.history_delta([1, 2, 3], [1, 2, 3, 4]), (0, [4]))
+        self.assertEqual(session_store.history_delta([1, 2, 3], [3, 4]), (2, [4]))
+        self.assertEqual(session_store.history_delta([1, 2], [5]), (2, [5]))
+
+
+if __name__ == "__main__":
+    unittest.main()